@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the planning and file generation of geos-chem-schedule
+
+Notes
+-------
+ - Times list_of_times_to_run, create_new_input_file, update_output_line,
+ create_new_HEMCO_input_file, and the full create_the_input_files plus
+ create_queue_files, for synthetic run directories of daily chunks (12 to
+ 20,000 by default)
+ - File generation is timed with and without HEMCO file management, on tmpfs
+ (/dev/shm) and on disk (the current directory), so the cost of the file
+ system can be told apart from the cost of the code
+ - The results are saved as JSON. Compare them with an earlier file to find
+ regressions: python benchmark.py --compare=old_results.json
+ - Run with: python benchmark.py [--chunks=12,365,20000] [--repeat=3]
+ [--output=benchmark_results.json] [--compare=] [--tmpfs-dir=] [--disk-dir=]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import datetime
+import tempfile
+import calendar
+import subprocess
+
+from core import GC_Job, list_of_times_to_run, create_new_input_file
+from core import update_output_line, create_new_HEMCO_input_file
+from core import create_the_input_files, create_queue_files
+
+BENCHMARK_CHUNKS = [12, 365, 3650, 20000]
+BENCHMARK_REPEAT = 3
+BENCHMARK_OUTPUT = 'benchmark_results.json'
+# Slow down (as a fraction) of a benchmark to flag as a regression
+REGRESSION_THRESHOLD = 0.2
+TMPFS_DIR = '/dev/shm'
+START_DATE = datetime.date(2000, 1, 1)
+
+
+def get_end_date(n_chunks):
+    """
+    Get the end date (YYYYMMDD) of a run of n_chunks daily chunks
+    """
+    return (START_DATE + datetime.timedelta(days=n_chunks)).strftime(
+        "%Y%m%d")
+
+
+def get_synthetic_input_geos_lines(start_date, end_date):
+    """
+    Get the lines of a synthetic input.geos of a typical length
+    """
+    lines = ["GEOS-CHEM UNIT TEST SIMULATION: benchmark\n",
+             "------------------------+----------------------------------\n",
+             "%%% SIMULATION MENU %%% :\n",
+             "Start YYYYMMDD, hhmmss  : {} 000000\n".format(start_date),
+             "End   YYYYMMDD, hhmmss  : {} 000000\n".format(end_date),
+             "Run directory           : ./\n",
+             "Read and save CSPEC_FULL: f\n"]
+    lines += ["Setting {:<15} : T\n".format(n) for n in range(250)]
+    lines += ["Schedule output for {} : {}\n".format(month.upper(), "0"*31)
+              for month in calendar.month_abbr[1:]]
+    return lines
+
+
+def get_synthetic_HEMCO_lines():
+    """
+    Get the lines of a synthetic HEMCO_Config.rc of a typical length
+    """
+    lines = ["### BEGIN SECTION SETTINGS\n",
+             "ROOT:                        /data/HEMCO\n",
+             "MetYear:                     2016\n",
+             "EmisYear:                    2016\n",
+             "### END SECTION SETTINGS ###\n",
+             "### BEGIN SECTION BASE EMISSIONS\n"]
+    lines += ["0 DATA_{0} $ROOT/DATA/$YYYY/data_{0}_$YYYY.nc CO "
+              "1950-2014/1-12/1/0 C xy kg/m2/s CO 26 1 5\n".format(n)
+              for n in range(1500)]
+    lines += ["### END SECTION BASE EMISSIONS ###\n"]
+    return lines
+
+
+def make_synthetic_run_directory(run_dir, n_chunks):
+    """
+    Make a synthetic GEOS-Chem run directory of n_chunks daily chunks
+    """
+    os.makedirs(run_dir)
+    with open(os.path.join(run_dir, 'input.geos'), 'w') as input_file:
+        input_file.writelines(get_synthetic_input_geos_lines(
+            START_DATE.strftime("%Y%m%d"), get_end_date(n_chunks)))
+    with open(os.path.join(run_dir, 'HEMCO_Config.rc'), 'w') as HEMCO_file:
+        HEMCO_file.writelines(get_synthetic_HEMCO_lines())
+    return run_dir
+
+
+def get_benchmark_inputs(manage_hemco_files=False):
+    """
+    Get the inputs of a daily run, as scheduled with SLURM
+    """
+    inputs = GC_Job()
+    inputs.scheduler = 'SLURM'
+    inputs.step = 'day'
+    inputs.manage_hemco_files = manage_hemco_files
+    # Vary the years, so HEMCO_Config.rc has more than one variant
+    inputs.MetYear = '+0'
+    inputs.EmisYear = '2010'
+    inputs.use_job_array = False
+    inputs.submit_jobs_together = True
+    return inputs
+
+
+def time_function(function, repeat=BENCHMARK_REPEAT, setup=None):
+    """
+    Time a function (the fastest and median of a number of runs)
+
+    Parameters
+    -------
+    function (function): Function to time (called without arguments)
+    repeat (int): Number of times to run it
+    setup (function): Function run (untimed) before each run
+
+    Returns
+    -------
+    (dict)
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    seconds.sort()
+    return {'seconds_min': seconds[0],
+            'seconds_median': seconds[len(seconds) // 2]}
+
+
+def benchmark_planning(n_chunks, repeat=BENCHMARK_REPEAT):
+    """
+    Time the planning and line editing of n_chunks daily chunks
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is a result (dictionary) for each benchmark
+    """
+    inputs = get_benchmark_inputs()
+    start_date = START_DATE.strftime("%Y%m%d")
+    end_date = get_end_date(n_chunks)
+    times = list_of_times_to_run(start_date, end_date, inputs)
+    input_lines = get_synthetic_input_geos_lines(start_date, end_date)
+    output_line = input_lines[-1]
+    HEMCO_lines = get_synthetic_HEMCO_lines()
+    chunks = list(zip(times[:-1], times[1:]))
+
+    def plan():
+        list_of_times_to_run(start_date, end_date, inputs)
+
+    def create_input_files():
+        for start_time, end_time in chunks:
+            create_new_input_file(start_time, end_time, input_lines,
+                                  inputs=inputs)
+
+    def update_output_lines():
+        for _, end_time in chunks:
+            update_output_line(output_line, end_time, inputs=inputs)
+
+    def create_HEMCO_files():
+        for start_time, _ in chunks:
+            create_new_HEMCO_input_file(HEMCO_lines, EmisYear=start_time[:4],
+                                        MetYear=start_time[:4])
+
+    results = []
+    for name, function in (('list_of_times_to_run', plan),
+                           ('create_new_input_file', create_input_files),
+                           ('update_output_line', update_output_lines),
+                           ('create_new_HEMCO_input_file',
+                            create_HEMCO_files)):
+        result = {'benchmark': name, 'n_chunks': n_chunks}
+        result.update(time_function(function, repeat=repeat))
+        results.append(result)
+    return results
+
+
+def benchmark_file_generation(n_chunks, base_dir, filesystem,
+                              manage_hemco_files=False,
+                              repeat=BENCHMARK_REPEAT):
+    """
+    Time creating the input and queue files of n_chunks daily chunks
+
+    Parameters
+    -------
+    n_chunks (int): Number of daily chunks
+    base_dir (str): Directory to make the synthetic run directory in
+    filesystem (str): Name of the file system of base_dir (e.g. "tmpfs")
+    manage_hemco_files (bool): Create the HEMCO_Config.rc files too
+    repeat (int): Number of times to run it
+
+    Returns
+    -------
+    (dict)
+    """
+    inputs = get_benchmark_inputs(manage_hemco_files=manage_hemco_files)
+    work_dir = tempfile.mkdtemp(prefix='gcs_benchmark_', dir=base_dir)
+    run_dir = os.path.join(work_dir, 'run')
+    make_synthetic_run_directory(run_dir, n_chunks)
+    times = list_of_times_to_run(START_DATE.strftime("%Y%m%d"),
+                                 get_end_date(n_chunks), inputs)
+
+    def clean():
+        for generated_dir in ('input_files', 'SLURM_queue_files'):
+            shutil.rmtree(os.path.join(run_dir, generated_dir),
+                          ignore_errors=True)
+
+    def generate():
+        create_the_input_files(times, inputs=inputs, run_dir=run_dir)
+        create_queue_files(times, inputs=inputs, run_dir=run_dir,
+                           scheduler='SLURM')
+
+    try:
+        result = {'benchmark': 'create_the_input_files+create_queue_files',
+                  'n_chunks': n_chunks, 'filesystem': filesystem,
+                  'manage_hemco_files': manage_hemco_files}
+        result.update(time_function(generate, repeat=repeat, setup=clean))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def get_result_key(result):
+    """
+    Get the key of a result, to find the same benchmark in another run
+    """
+    return (result['benchmark'], result['n_chunks'],
+            result.get('filesystem'), result.get('manage_hemco_files'))
+
+
+def compare_results(results, baseline,
+                    threshold=REGRESSION_THRESHOLD):
+    """
+    Find the benchmarks that are slower than in a baseline
+
+    Parameters
+    -------
+    results (list): Results of this run
+    baseline (list): Results of an earlier run
+    threshold (float): Slow down (as a fraction) to flag as a regression
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is each result that regressed, with its "baseline"
+     (fastest seconds) and "slow_down" (fraction) added
+     - The fastest of the runs is compared, as it is least affected by noise
+    """
+    baseline = {get_result_key(i): i for i in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(get_result_key(result))
+        if (old is None) or (old['seconds_min'] <= 0):
+            continue
+        slow_down = result['seconds_min'] / old['seconds_min'] - 1.
+        if slow_down > threshold:
+            regression = dict(result)
+            regression.update({'baseline': old['seconds_min'],
+                               'slow_down': slow_down})
+            regressions.append(regression)
+    return regressions
+
+
+def get_git_commit():
+    """
+    Get the git commit of the code benchmarked (None if not in git)
+    """
+    result = subprocess.run(
+        ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, universal_newlines=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(chunks=None, repeat=BENCHMARK_REPEAT, tmpfs_dir=TMPFS_DIR,
+                   disk_dir='.', verbose=True):
+    """
+    Run all the benchmarks
+
+    Parameters
+    -------
+    chunks (list): Numbers of daily chunks to benchmark
+    repeat (int): Number of times to run each benchmark
+    tmpfs_dir (str): Directory on tmpfs (skipped if it does not exist)
+    disk_dir (str): Directory on disk
+    verbose (bool): Print each result to the screen
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the "results", and the time, machine and git
+     commit they are from
+    """
+    if chunks is None:
+        chunks = BENCHMARK_CHUNKS
+    filesystems = [('disk', disk_dir)]
+    if tmpfs_dir and os.path.isdir(tmpfs_dir):
+        filesystems.insert(0, ('tmpfs', tmpfs_dir))
+    results = []
+    for n_chunks in chunks:
+        new_results = benchmark_planning(n_chunks, repeat=repeat)
+        for filesystem, base_dir in filesystems:
+            for manage_hemco_files in (False, True):
+                new_results.append(benchmark_file_generation(
+                    n_chunks, base_dir, filesystem,
+                    manage_hemco_files=manage_hemco_files, repeat=repeat))
+        for result in new_results:
+            result['seconds_per_chunk'] = result['seconds_min'] / n_chunks
+            if verbose:
+                print_result(result)
+        results += new_results
+    return {
+        'created': datetime.datetime.now().replace(
+            microsecond=0).isoformat(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'git_commit': get_git_commit(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def print_result(result):
+    """
+    Print a benchmark result
+    """
+    name = result['benchmark']
+    if 'filesystem' in result:
+        name += ' ({}{})'.format(result['filesystem'],
+                                 ', HEMCO' if result['manage_hemco_files']
+                                 else '')
+    print("{:<62} {:>6} chunks {:>10.4f} s {:>10.1f} us/chunk".format(
+        name, result['n_chunks'], result['seconds_min'],
+        result['seconds_per_chunk']*1e6))
+    return
+
+
+def main():
+    """
+    Run the benchmarks, save the results, and compare them (if requested)
+    """
+    chunks = None
+    repeat = BENCHMARK_REPEAT
+    output = BENCHMARK_OUTPUT
+    compare = None
+    tmpfs_dir = TMPFS_DIR
+    disk_dir = '.'
+    for arg in sys.argv[1:]:
+        if arg.startswith("--chunks="):
+            chunks = [int(i) for i in arg[9:].split(',')]
+        elif arg.startswith("--repeat="):
+            repeat = int(arg[9:])
+        elif arg.startswith("--output="):
+            output = arg[9:].strip()
+        elif arg.startswith("--compare="):
+            compare = arg[10:].strip()
+        elif arg.startswith("--tmpfs-dir="):
+            tmpfs_dir = arg[12:].strip()
+        elif arg.startswith("--disk-dir="):
+            disk_dir = arg[11:].strip()
+        else:
+            print(__doc__)
+            sys.exit(2)
+    benchmarks = run_benchmarks(chunks=chunks, repeat=repeat,
+                                tmpfs_dir=tmpfs_dir, disk_dir=disk_dir)
+    with open(output, 'w') as output_file:
+        json.dump(benchmarks, output_file, indent=1, sort_keys=True)
+    print("Saved the results to {}".format(output))
+    if compare:
+        with open(compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare_results(benchmarks['results'], baseline)
+        for regression in regressions:
+            print("REGRESSION: {} ({} chunks) {:.0%} slower".format(
+                regression['benchmark'], regression['n_chunks'],
+                regression['slow_down']))
+        if regressions:
+            sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Plan the chunks of a run from measured throughput for geos-chem-schedule
+
+Notes
+-------
+ - Used with step "auto". The simulated days per hour of past chunks (from the
+ history store, see resource_history.py) sets how many days fit in the wall
+ time of a job, so the run is split into the fewest jobs that each fill, but
+ do not go over, their allocation
+ - Chunks can be aligned to the 1st of the month (e.g. for monthly bpch
+ output), in which case each chunk is as many whole months as fit
+"""
+import os
+import datetime
+from dateutil.relativedelta import relativedelta
+
+from utils import wall_time_to_seconds
+from resource_history import load_history, get_history_key
+from resource_history import get_history_samples, get_quantile
+
+# Where the planned times are kept (relative to the run directory)
+CHUNK_PLAN_FILE = 'input_files/chunk_plan.txt'
+
+
+def get_simulated_days_per_hour(run_dir='.', inputs=None, history=None):
+    """
+    Get the simulated days per hour to plan the chunks of a run with
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    history (list): Records of the history store (default: load the store)
+
+    Returns
+    -------
+    (float)
+
+    Notes
+    -------
+     - inputs.simulated_days_per_hour is used if set, otherwise this is
+     measured from the history store
+     - The quantile (inputs.resource_quantile) of the seconds per day is used,
+     so slow chunks are planned for
+     - Returns None if there is not enough history
+    """
+    if inputs.simulated_days_per_hour:
+        return float(inputs.simulated_days_per_hour)
+    if history is None:
+        history = load_history(inputs.history_file)
+    samples = get_history_samples(history, get_history_key(run_dir, inputs),
+                                  min_samples=inputs.min_history_samples)
+    if not samples:
+        return None
+    seconds_per_day = get_quantile(
+        [i['elapsed_seconds']/i['n_days'] for i in samples],
+        inputs.resource_quantile)
+    return 3600. / seconds_per_day
+
+
+def get_max_days_per_chunk(simulated_days_per_hour, inputs):
+    """
+    Get the most days a chunk can simulate within its wall time
+
+    Parameters
+    -------
+    simulated_days_per_hour (float): Throughput of the model
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (int)
+
+    Notes
+    -------
+     - The wall time is inputs.wall_time, capped at the partition limit
+     (inputs.max_wall_time), less the safety margin (inputs.resource_margin)
+    """
+    wall_time = min(wall_time_to_seconds(inputs.wall_time),
+                    wall_time_to_seconds(inputs.max_wall_time))
+    hours = wall_time / 3600. / (1 + inputs.resource_margin)
+    return max(int(simulated_days_per_hour * hours), 1)
+
+
+def plan_chunk_times(start_time, end_time, max_days, align_to_months=True):
+    """
+    Split a run into the fewest chunks of at most max_days
+
+    Parameters
+    -------
+    start_time (str): Start time of GEOS-Chem simulation (YYYYMMDD)
+    end_time (str): End time of GEOS-Chem simulation (YYYYMMDD)
+    max_days (int): Most days a chunk can simulate
+    align_to_months (bool): End chunks on the 1st of a month
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the start times and the end time of the run
+     - Without month alignment the days are shared evenly between the chunks
+     - With month alignment, a month that does not fit in a chunk is split
+     into chunks of max_days
+    """
+    start_datetime = datetime.datetime.strptime(start_time, "%Y%m%d")
+    end_datetime = datetime.datetime.strptime(end_time, "%Y%m%d")
+    n_days = (end_datetime - start_datetime).days
+    if not align_to_months:
+        n_chunks = -(-n_days // max_days)
+        boundaries = [start_datetime + relativedelta(
+            days=round(i * n_days / float(n_chunks)))
+            for i in range(n_chunks+1)]
+        return [i.strftime("%Y%m%d") for i in boundaries]
+
+    boundaries = [start_datetime]
+    while boundaries[-1] < end_datetime:
+        current = boundaries[-1]
+        limit = min(current + relativedelta(days=max_days), end_datetime)
+        # The last 1st of the month that fits (or the end of the run)
+        boundary = limit
+        if limit < end_datetime:
+            boundary = limit.replace(day=1)
+        if boundary <= current:
+            boundary = limit
+        boundaries.append(boundary)
+    return [i.strftime("%Y%m%d") for i in boundaries]
+
+
+def save_chunk_plan(times, run_dir='.'):
+    """
+    Save the planned times so a resumed run uses the same chunks
+    """
+    plan_file = os.path.join(run_dir, CHUNK_PLAN_FILE)
+    if not os.path.exists(os.path.dirname(plan_file)):
+        os.makedirs(os.path.dirname(plan_file))
+    with open(plan_file, 'w') as plan:
+        plan.write('\n'.join(times) + '\n')
+    return
+
+
+def load_chunk_plan(start_time, end_time, run_dir='.'):
+    """
+    Load the saved times of a run (see save_chunk_plan)
+
+    Notes
+    -------
+     - Returns None if there is no saved plan for the same start and end
+    """
+    plan_file = os.path.join(run_dir, CHUNK_PLAN_FILE)
+    if not os.path.isfile(plan_file):
+        return None
+    with open(plan_file, 'r') as plan:
+        times = [i.strip() for i in plan if i.strip()]
+    if (len(times) < 2) or (times[0] != start_time) or \
+            (times[-1] != end_time):
+        return None
+    return times
@@ -0,0 +1,238 @@
+"""
+Clone a GEOS-Chem run directory into the members of an ensemble
+
+Notes
+-------
+ - Large files that the members share unchanged (restart files, the geos
+ binary, ...) are reflinked (a copy-on-write clone, on e.g. Btrfs or XFS) or
+ else hardlinked, so cloning takes seconds and hardly any disk. Only if
+ neither is possible (e.g. a different file system) are they copied
+ - Small files, and the files edited for each member (input.geos and
+ HEMCO_Config.rc), are always copied so a member never changes the template
+ - A hardlinked file is the same file as the template's, so it must only be
+ read (as GEOS-Chem does with its initial restart and binary). Only the
+ member's initial restart is cloned, as GEOS-Chem writes over the others
+ - If the template has been scheduled, its input.geos and HEMCO_Config.rc
+ are links to its chunks' files, so the member gets a copy of the originals
+ - Files written by scheduling or running the template (its chunks, queue
+ files, logs and output) are not cloned
+"""
+import os
+import json
+import fcntl
+import shutil
+import fnmatch
+
+from utils import get_run_input_file
+
+# Linux ioctl to clone a file's extents (as "cp --reflink")
+FICLONE = 0x40049409
+# Files smaller than this are copied rather than linked
+CLONE_LINK_MIN_BYTES = 1 << 20
+# Files each member always has its own copy of (they are edited)
+CLONE_COPY_FILES = ['input.geos', 'HEMCO_Config.rc']
+# Directories created empty in each member
+CLONE_EMPTY_DIRS = ['OutputDir']
+# Files of the template not cloned (written by scheduling or running it)
+CLONE_SKIP_FILES = ['input_files', 'queue_output', 'logs', 'segments',
+                    'submitted_jobs.txt', 'feeder_state.json*', 'HEMCO.log',
+                    '*_queue_files', 'run_geos_*.sh', '*.log', '*.orig']
+
+
+def reflink_file(source, destination):
+    """
+    Clone a file's contents without copying them (raises OSError if the file
+    system can not)
+    """
+    with open(source, 'rb') as source_file:
+        with open(destination, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE,
+                        source_file.fileno())
+    shutil.copystat(source, destination)
+    return
+
+
+def link_or_copy_file(source, destination):
+    """
+    Reflink, hardlink or (if neither is possible) copy a file
+
+    Parameters
+    -------
+    source (str): File to clone
+    destination (str): Location of the clone
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is how the file was cloned ("reflink", "hardlink" or
+     "copy")
+    """
+    try:
+        reflink_file(source, destination)
+        return 'reflink'
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError:
+        shutil.copy2(source, destination)
+        return 'copy'
+
+
+def is_skipped_file(name):
+    """
+    Is a file of the template one that is not cloned?
+    """
+    return any(fnmatch.fnmatch(name, i) for i in CLONE_SKIP_FILES)
+
+
+def clone_run_directory(template_dir, member_dir, restart_file_template=None,
+                        start_time=None):
+    """
+    Clone a run directory
+
+    Parameters
+    -------
+    template_dir (str): GEOS-Chem run directory to clone
+    member_dir (str): Directory of the clone (must not exist)
+    restart_file_template (str): Name of restart files ({date} is replaced)
+    start_time (str): Start of the member's run in the format YYYYMMDD
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the number of files cloned each way ("reflink",
+     "hardlink", "copy" and "symlink")
+     - Symbolic links are cloned as links to the same place
+     - Of the template's restart files, only the one at start_time is cloned
+    """
+    template_dir = os.path.realpath(template_dir)
+    AssStr = "The member's directory {} already exists"
+    assert not os.path.lexists(member_dir), AssStr.format(member_dir)
+    member_root = os.path.realpath(member_dir)
+    counts = {'reflink': 0, 'hardlink': 0, 'copy': 0, 'symlink': 0}
+    restart_files = initial_restart = None
+    if restart_file_template:
+        restart_files = restart_file_template.format(date='*')
+        initial_restart = restart_file_template.format(date=start_time)
+    for source_dir, dir_names, file_names in os.walk(template_dir):
+        relative_dir = os.path.relpath(source_dir, template_dir)
+        destination_dir = os.path.normpath(os.path.join(member_dir,
+                                                        relative_dir))
+        os.makedirs(destination_dir)
+        # Never clone the template's other clones (e.g. into the template)
+        dir_names[:] = [i for i in dir_names
+                        if not is_skipped_file(i) and os.path.realpath(
+                            os.path.join(source_dir, i)) != member_root]
+        for name in list(dir_names):
+            source = os.path.join(source_dir, name)
+            if os.path.islink(source) or (relative_dir == '.' and
+                                          name in CLONE_EMPTY_DIRS):
+                dir_names.remove(name)
+                file_names.append(name)
+        for name in sorted(file_names):
+            if is_skipped_file(name):
+                continue
+            if (relative_dir == '.') and restart_files and \
+                    fnmatch.fnmatch(name, restart_files) and \
+                    (name != initial_restart):
+                continue
+            source = os.path.join(source_dir, name)
+            destination = os.path.join(destination_dir, name)
+            if (relative_dir == '.') and (name in CLONE_COPY_FILES):
+                shutil.copy2(get_run_input_file(template_dir, name),
+                             destination)
+                counts['copy'] += 1
+            elif os.path.islink(source):
+                target = os.readlink(source)
+                if not os.path.isabs(target):
+                    target = os.path.normpath(os.path.join(source_dir,
+                                                           target))
+                    # Links within the run directory stay within the clone
+                    if target.startswith(template_dir + os.sep):
+                        target = os.path.relpath(target, source_dir)
+                os.symlink(target, destination)
+                counts['symlink'] += 1
+            elif os.path.isdir(source):
+                os.makedirs(destination)
+            elif os.path.getsize(source) < CLONE_LINK_MIN_BYTES:
+                shutil.copy2(source, destination)
+                counts['copy'] += 1
+            else:
+                counts[link_or_copy_file(source, destination)] += 1
+    return counts
+
+
+def get_clone_members(clone, template_dir='.'):
+    """
+    Get the members of an ensemble to clone
+
+    Parameters
+    -------
+    clone (str): Number of members, or a JSON file of the members' edits
+    template_dir (str): GEOS-Chem run directory to clone
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the edits of each member, by name
+     - Numbered members are named after the template (e.g. run_001) and have
+     no edits
+     - The JSON file has a dictionary of edits for each member, all optional:
+     "input.geos" (settings by the start of their line, with "start_date" and
+     "end_date" for the dates), "HEMCO_Config.rc" (settings by name, e.g.
+     "EmisYear" or "--> CEDS") and "settings" (to schedule the member with,
+     as for --batch-overrides=)
+    """
+    if str(clone).isdigit():
+        name = os.path.basename(os.path.realpath(template_dir))
+        return {'{}_{:03d}'.format(name, n_member+1): {}
+                for n_member in range(int(clone))}
+    with open(clone, 'r') as members_file:
+        return json.load(members_file)
+
+
+def set_HEMCO_settings(lines, settings):
+    """
+    Set the values of settings (e.g. "ROOT" or "--> CEDS") in HEMCO_Config.rc
+
+    Parameters
+    -------
+    lines (list): Lines of the HEMCO_Config.rc file
+    settings (dict): New values of the settings, by name
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the new lines, with each value in the same column as
+     the old one
+    """
+    new_lines = []
+    found = set()
+    for line in lines:
+        name = line.split('#')[0].split(':')[0].strip()
+        if (':' in line) and (name in settings):
+            colon = line.index(':') + 1
+            padding = len(line[colon:]) - len(line[colon:].lstrip(' '))
+            line = line[:colon] + ' '*max(padding, 1) + \
+                str(settings[name]) + '\n'
+            found.add(name)
+        new_lines.append(line)
+    missing = sorted(set(settings) - found)
+    AssStr = "No settings {} in HEMCO_Config.rc"
+    assert not missing, AssStr.format(missing)
+    return new_lines
@@ -9,9 +9,56 @@ import sys
 import shutil
 import datetime
 import calendar
+import copy
+import glob
+import multiprocessing
 from dateutil.relativedelta import relativedelta
 import pytest
 from utils import *
+from template_engine import load_template
+from input_geos import InputGeos
+from resume import get_completed_chunks, get_queued_chunks, get_times_to_resume
+from resource_history import predict_chunk_resources
+from resource_history import collect_run_directory_history
+from chunk_planner import get_simulated_days_per_hour, get_max_days_per_chunk
+from chunk_planner import plan_chunk_times, save_chunk_plan, load_chunk_plan
+from local_executor import get_local_processes, write_local_chunk_list
+from local_executor import run_local_chains, print_local_summary
+from out_of_hours import BEGIN_OPTIONS, get_begin_option, get_working_hours
+from out_of_hours import write_out_of_hours_files
+from hemco_files import HEMCOConfig
+from input_availability import get_missing_input_files
+from monitor import MONITOR_COMMANDS, get_scheduled_chunks, run_monitor
+from log_analysis import analyse_run_directory_logs, flag_regressions
+from log_analysis import record_log_history, print_log_analysis
+from feeder import add_feeder_chunks, run_feeder
+from registry import register_run_directory
+from retry import RETRY_POLICY_FILE
+from segments import create_segment_directories
+from dag import plan_campaign_dag, link_restart_handoff, write_dag_run_script
+from clone import clone_run_directory, get_clone_members, set_HEMCO_settings
+from placement import place_chunks
+from simulate import get_queue_waits, simulate_strategy
+from simulate import print_simulation_summary
+
+# Length of the chunks for each step size (see also step "auto")
+STEP_DELTAS = {
+    "12month": relativedelta(months=12),
+    "9month": relativedelta(months=9),
+    "6month": relativedelta(months=6),
+    "3month": relativedelta(months=3),
+    "2month": relativedelta(months=2),
+    "1month": relativedelta(months=1),
+    "month": relativedelta(months=1),
+    "2week": relativedelta(weeks=2),
+    "fortnight": relativedelta(weeks=2),
+    "1week": relativedelta(weeks=1),
+    "week": relativedelta(weeks=1),
+    "3day": relativedelta(days=3),
+    "2day": relativedelta(days=2),
+    "1day": relativedelta(days=1),
+    "day": relativedelta(days=1),
+}
 
 
 class GC_Job:
@@ -32,12 +79,118 @@ class GC_Job:
         email_address: "example@example.com"    - Address to send emails to
         email_setting: "e"   - Email on exit? google PBS email for more
         memory_need: "2Gb"   - Maximum memory you will need
-        submit_jobs_together: True  - Submit jobs together+dependant on each other
+        submit_jobs_together: None  - Submit jobs together+dependant on each other
+        (None - yes, unless out of hours)
         MetYear: "2016" - Year to use for meteorology (in HEMCO_Config.rc)?
         EmisYear: "2016" - Year to use for emissions (in HEMCO_Config.rc)?
         cpus_need: "20" - Number of CPUS to request per node?
         scheduler: "SLURM" - Scheduler (e.g. PBS, SLURM) to make scripts for?
+        ("local" runs the chunks on this machine without a scheduler)
         manage_hemco_files: "no" - mange the HEMCO_Config.rc file(s)?
+        use_job_array: False - Submit the chunks as one SLURM job array?
+        max_array_size: 1001 - SLURM's MaxArraySize (longer runs are split
+        into arrays, each after the last)
+        batch_run_dirs: None - Run directories (list, glob or comma separated)
+        batch_overrides: None - Per run directory settings (dict or JSON file)
+        batch_processes: None - Processes to schedule a batch with (None=all)
+        resume: False - Only schedule the chunks that have not completed?
+        restart_file_template: "GEOSChem.Restart.{date}_0000z.nc4" - Name
+        of the GEOS-Chem restart file for a date
+        predict_resources: False - Size wall time and memory from history?
+        history_file: "~/.geos-chem-schedule/history.jsonl" - History store
+        accounting_command: None - Command to get job accounting (None=sacct)
+        resource_quantile: 0.9 - Quantile of past chunks to size chunks from
+        resource_margin: 0.2 - Safety margin added to the predicted resources
+        min_history_samples: 3 - Past chunks needed to predict resources
+        max_wall_time: "48:00:00" - Longest wall time to request (the
+        partition limit)
+        simulated_days_per_hour: None - Throughput to plan step "auto" with
+        (None=measure from the history store)
+        align_chunks_to_months: True - End the "auto" chunks on the 1st of a
+        month (e.g. for monthly bpch output)?
+        local_geos_command: "./geos" - Command to run GEOS-Chem with locally
+        local_processes: None - Chunks to run at once locally (None=CPUs
+        divided by cpus_need)
+        working_hours: "08:00-18:00" - Hours not to start jobs in (out of hours)
+        working_days: ["Mon", "Tue", "Wed", "Thu", "Fri"] - Days with working
+        hours
+        holidays_file: None - File of holiday dates (YYYY-MM-DD) without
+        working hours
+        stage_to_scratch: False - Run each chunk in node-local scratch?
+        scratch_dir: "${TMPDIR:-/tmp}" - Node-local scratch (as seen by the job)
+        prefetch_inputs: False - Warm each chunk's inputs while the last runs?
+        prefetch_wall_time: "01:00:00" - Wall time of the prefetch jobs
+        postprocess_command: None - Command to post-process each chunk's
+        output with (in its own job, alongside the next chunk)
+        postprocess_wall_time: "01:00:00" - Wall time of the post-processing
+        jobs
+        hemco_tokens: None - Values of HEMCO_Config.rc tokens not set in it
+        hemco_switches: None - HEMCO_Config.rc brackets to force on or off
+        auto_retry: False - Resubmit chunks (SLURM) that fail from a node
+        failure, timeout or running out of memory?
+        max_retries: 2 - Most times to resubmit a chunk
+        retry_wall_time_factor: 1.5 - Wall time multiplier after a timeout
+        retry_memory_factor: 1.5 - Memory multiplier after running out of
+        memory
+        check_input_files: False - Check the inputs exist before submitting?
+        input_index_file: "~/.geos-chem-schedule/input_index.json" - Cache
+        of the input files found
+        input_index_max_age: 24 - Hours to trust a file found in the cache
+        input_check_threads: 32 - Threads to check the input files with
+        monitor: None - Show the state of the jobs ("status") or keep
+        watching them ("watch") instead of scheduling
+        monitor_command: None - Command to get the state of jobs with
+        ({job_ids} is replaced; None=sacct/qstat)
+        monitor_interval: 30 - Seconds between polls when watching
+        monitor_max_interval: 600 - Longest seconds between polls (backoff)
+        clone: None - Clone the run directory into this number of members, or
+        the members in a JSON file (with their edits), and schedule them
+        clone_dir: ".." - Directory to create the members in
+        spinup_dir: None - Run directory of a spin-up that every run directory
+        of the batch starts from (submitted as one graph)
+        segments: 1 - Number of segments to split the run into, which run at
+        the same time (each after a spin-up)
+        segment_spinup: "3month" - Spin-up before each segment (after the 1st)
+        segment_restart_file: None - Restart file the segments start from
+        (None=the run's initial restart)
+        stitch_segments: False - Link the segments' output into OutputDir
+        instead of scheduling
+        feeder: False - Submit the chunks (SLURM) from a local queue as slots
+        free up, rather than all at once?
+        feed: False - Carry on submitting from the feeder's queue instead of
+        scheduling
+        feeder_state_file: "feeder_state.json" - Feeder's queue of chunks
+        feeder_max_jobs: 100 - Most queued or running jobs the user can have
+        (e.g. SLURM's MaxSubmitJobs)
+        feeder_interval: 60 - Seconds between topping up the queue
+        feeder_submit_command: None - Command to submit a chunk with
+        ({options} and {queue_file} are replaced; None=sbatch)
+        feeder_active_command: None - Command to list the IDs of the user's
+        queued or running jobs (None=squeue)
+        registry: False - Record the runs scheduled in the campaign registry?
+        registry_file: "~/.geos-chem-schedule/registry.sqlite" - Campaign
+        registry (SQLite) of the runs, chunks and jobs
+        registry_report: False - Report the state of the registered runs
+        instead of scheduling
+        analyse_logs: False - Report the throughput of the chunks from their
+        logs instead of scheduling
+        regression_threshold: 0.2 - Fraction below the median simulated days
+        per hour to flag a chunk as a regression
+        auto_placement: False - Pick each chunk's partition (queue_name) from
+        the live load of the cluster?
+        advise_placement: False - Show the expected start and end in each
+        partition instead of scheduling
+        placement_capture_dir: None - Directory of captured sinfo/squeue (or
+        qstat -Qf) output to read the load from (None=run the commands)
+        simulate: None - Steps to compare (e.g. "month,3month,6month") by
+        simulating the run instead of scheduling
+        simulation_queue_wait: None - Mean queue wait in hours (None=draw
+        from the waits of past jobs)
+        simulation_accounting_file: None - Captured output of the queue wait
+        command to read past waits from (None=run sacct/qstat)
+        simulation_failure_rate: 0.01 - Failures per hour of running a chunk
+        simulation_overhead_seconds: 300 - Time each chunk takes to start up
+        simulation_runs: 200 - Number of times to simulate each step
     """
 
     def __init__(self):
@@ -59,7 +212,9 @@ class GC_Job:
         self.run_script = False
         self.scheduler = "SLURM"
         self.send_email = True
-        self.submit_jobs_together = True
+        self.submit_jobs_together = None
+        self.use_job_array = False
+        self.max_array_size = 1001
         self.step = "month"
         self.manage_hemco_files = False
         self.memory_need = "2Gb"
@@ -67,6 +222,77 @@ class GC_Job:
         self.out_of_hours = False
         self.out_of_hours_string = "no"
         self.wall_time = "48:00:00"
+        self.batch_run_dirs = None
+        self.batch_overrides = None
+        self.batch_processes = None
+        self.resume = False
+        self.restart_file_template = "GEOSChem.Restart.{date}_0000z.nc4"
+        self.predict_resources = False
+        self.history_file = os.path.join(os.path.expanduser('~'),
+                                         '.geos-chem-schedule',
+                                         'history.jsonl')
+        self.accounting_command = None
+        self.resource_quantile = 0.9
+        self.resource_margin = 0.2
+        self.min_history_samples = 3
+        self.max_wall_time = "48:00:00"
+        self.simulated_days_per_hour = None
+        self.align_chunks_to_months = True
+        self.local_geos_command = "./geos"
+        self.local_processes = None
+        self.working_hours = "08:00-18:00"
+        self.working_days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+        self.holidays_file = None
+        self.stage_to_scratch = False
+        self.scratch_dir = "${TMPDIR:-/tmp}"
+        self.prefetch_inputs = False
+        self.prefetch_wall_time = "01:00:00"
+        self.postprocess_command = None
+        self.postprocess_wall_time = "01:00:00"
+        self.hemco_tokens = None
+        self.hemco_switches = None
+        self.auto_retry = False
+        self.max_retries = 2
+        self.retry_wall_time_factor = 1.5
+        self.retry_memory_factor = 1.5
+        self.check_input_files = False
+        self.input_index_file = os.path.join(os.path.expanduser('~'),
+                                             '.geos-chem-schedule',
+                                             'input_index.json')
+        self.input_index_max_age = 24
+        self.input_check_threads = 32
+        self.monitor = None
+        self.monitor_command = None
+        self.monitor_interval = 30
+        self.monitor_max_interval = 600
+        self.clone = None
+        self.clone_dir = ".."
+        self.spinup_dir = None
+        self.segments = 1
+        self.segment_spinup = "3month"
+        self.segment_restart_file = None
+        self.stitch_segments = False
+        self.feeder = False
+        self.feed = False
+        self.feeder_state_file = "feeder_state.json"
+        self.feeder_max_jobs = 100
+        self.feeder_interval = 60
+        self.feeder_submit_command = None
+        self.feeder_active_command = None
+        self.registry = False
+        self.registry_file = "~/.geos-chem-schedule/registry.sqlite"
+        self.registry_report = False
+        self.analyse_logs = False
+        self.regression_threshold = 0.2
+        self.auto_placement = False
+        self.advise_placement = False
+        self.placement_capture_dir = None
+        self.simulate = None
+        self.simulation_queue_wait = None
+        self.simulation_accounting_file = None
+        self.simulation_failure_rate = 0.01
+        self.simulation_overhead_seconds = 300
+        self.simulation_runs = 200
         # Read the settings JSON file if this is present
         if os.path.exists(user_settings_file):
             settings_file = open(user_settings_file, 'r')
@@ -81,6 +307,28 @@ class GC_Job:
         self.__dict__.update(options)
         return
 
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return 'GC_Job({})'.format(self.variables())
+
+    def variables(self):
+        """
+        Return the variables of the job as a dictionary
+        """
+        return dict(self.__dict__)
+
+    def update(self, options):
+        """
+        Update the variables of the job from a dictionary of options
+        """
+        self.__dict__.update(options)
+        return
+
 
 def get_arguments(inputs, debug=False):
     """
@@ -119,11 +367,69 @@ def get_arguments(inputs, debug=False):
             elif arg.startswith("--cpus-need="):
                 inputs.cpus_need = arg[12:].strip()
             elif arg.startswith("--manage-hemco-files="):
-                inputs.cpus_need = arg[21:].strip()
+                inputs.manage_hemco_files = arg[21:].strip()
             elif arg.startswith("--submit-jobs-together="):
-                inputs.cpus_need = arg[23:].strip()
+                inputs.submit_jobs_together = arg[23:].strip()
+            elif arg.startswith("--job-array="):
+                inputs.use_job_array = arg[12:].strip()
             elif arg.startswith("--memory-need="):
                 inputs.memory_need = arg[14:].strip()
+            elif arg.startswith("--predict-resources="):
+                inputs.predict_resources = arg[20:].strip()
+            elif arg.startswith("--stage-to-scratch="):
+                inputs.stage_to_scratch = arg[19:].strip()
+            elif arg.startswith("--prefetch-inputs="):
+                inputs.prefetch_inputs = arg[18:].strip()
+            elif arg.startswith("--postprocess-command="):
+                inputs.postprocess_command = arg[22:].strip()
+            elif arg.startswith("--auto-retry="):
+                inputs.auto_retry = arg[13:].strip()
+            elif arg.startswith("--check-input-files="):
+                inputs.check_input_files = arg[20:].strip()
+            elif arg.startswith("--clone="):
+                inputs.clone = arg[8:].strip()
+            elif arg.startswith("--clone-dir="):
+                inputs.clone_dir = arg[12:].strip()
+            elif arg.startswith("--spinup-dir="):
+                inputs.spinup_dir = arg[13:].strip()
+            elif arg.startswith("--segments="):
+                inputs.segments = int(arg[11:].strip())
+            elif arg.startswith("--segment-spinup="):
+                inputs.segment_spinup = arg[17:].strip()
+            elif arg.startswith("--stitch-segments"):
+                inputs.stitch_segments = True
+            elif arg.startswith("--feeder="):
+                inputs.feeder = arg[9:].strip()
+            elif arg.startswith("--feed"):
+                inputs.feed = True
+            elif arg.startswith("--registry="):
+                inputs.registry = arg[11:].strip()
+            elif arg.startswith("--registry-report"):
+                inputs.registry_report = True
+            elif arg.startswith("--status"):
+                inputs.monitor = "status"
+            elif arg.startswith("--watch"):
+                inputs.monitor = "watch"
+            elif arg.startswith("--auto-placement="):
+                inputs.auto_placement = arg[17:].strip()
+            elif arg.startswith("--advise-placement"):
+                inputs.advise_placement = True
+            elif arg.startswith("--placement-capture-dir="):
+                inputs.placement_capture_dir = arg[24:].strip()
+            elif arg.startswith("--simulate="):
+                inputs.simulate = arg[11:].strip()
+            elif arg.startswith("--simulation-queue-wait="):
+                inputs.simulation_queue_wait = float(arg[24:].strip())
+            elif arg.startswith("--analyse-logs"):
+                inputs.analyse_logs = True
+            elif arg.startswith("--resume="):
+                inputs.resume = arg[9:].strip()
+            elif arg.startswith("--batch="):
+                inputs.batch_run_dirs = arg[8:].strip()
+            elif arg.startswith("--batch-overrides="):
+                inputs.batch_overrides = arg[18:].strip()
+            elif arg.startswith("--batch-processes="):
+                inputs.batch_processes = int(arg[18:].strip())
             elif arg.startswith("--help"):
                 print("""
             geos-chem-schedule.py
@@ -139,15 +445,45 @@ def get_arguments(inputs, debug=False):
             --wall-time=
             --submit-jobs-together=
             --manage-hemco-files=
+            --job-array=
             --memory-need=
             --cpus-need=
+            --resume=
+            --predict-resources=
+            --stage-to-scratch=
+            --prefetch-inputs=
+            --postprocess-command=
+            --auto-retry=
+            --check-input-files=
+            --clone=
+            --clone-dir=
+            --spinup-dir=
+            --segments=
+            --segment-spinup=
+            --stitch-segments (link the segments' output into OutputDir)
+            --feeder=
+            --feed (carry on submitting from the feeder's queue)
+            --registry=
+            --registry-report (show the state of all the registered runs)
+            --status (show the state of the submitted jobs)
+            --watch (keep showing it until the run finishes)
+            --analyse-logs (report the throughput of the completed chunks)
+            --auto-placement=
+            --advise-placement (show the expected start in each partition)
+            --placement-capture-dir=
+            --simulate= (compare steps, e.g. --simulate=month,3month,6month)
+            --simulation-queue-wait=
+            --batch=
+            --batch-overrides=
+            --batch-processes=
             e.g. to set the queue name to 'bob' write --queue-name=bob
+            e.g. to schedule many run directories write --batch="runs/*"
             """)
-        else:
-            print("""Invalid argument {arg}
+            else:
+                print("""Invalid argument {arg}
                      Try --help for more info.""".format(arg=arg)
-                  )
-            sys.exit(2)
+                      )
+                sys.exit(2)
     else:
         inputs = get_variables_from_cli(inputs)
     return inputs
@@ -179,6 +515,7 @@ def get_variables_from_cli(inputs):
     memory_need = inputs.memory_need
     MetYear = inputs.MetYear
     submit_jobs_together = inputs.submit_jobs_together
+    use_job_array = inputs.use_job_array
     manage_hemco_files = inputs.manage_hemco_files
     cpus_need = inputs.cpus_need
     step = inputs.step
@@ -203,7 +540,7 @@ def get_variables_from_cli(inputs):
 
     # Specify the step size
     clear_screen()
-    PrtStr = "What time step size do you want? \n(6month recommended for 4x5, 2x25. 6month, 3month, 2month, week or day available).\n"
+    PrtStr = "What time step size do you want? \n(6month recommended for 4x5, 2x25. 6month, 3month, 2month, week or day available, or auto to fit the chunks to the wall time).\n"
     print(PrtStr)
     input_read = str(input(DefaultInputPrtStr.format(step)))
     if input_read:
@@ -238,10 +575,11 @@ def get_variables_from_cli(inputs):
     del input_read
 
     # Check for out of hours run
-    if scheduler == 'PBS':
+    if scheduler in ('PBS', 'SLURM'):
         clear_screen()
         print("Do you only want to run jobs out of normal work hours?\n"
-              "(Monday to Friday 9am - 5pm)?\n")
+              "({} {})?\n".format('/'.join(inputs.working_days),
+                                   inputs.working_hours))
         input_read = str(input(DefaultInputPrtStr.format(out_of_hours_string)))
         if input_read:
             out_of_hours_string = input_read
@@ -260,11 +598,24 @@ def get_variables_from_cli(inputs):
     # Submit all the jobs into the queue at the same time?
     clear_screen()
     print("Submit jobs all jobs together (subsequently dependant)?\n")
+    # Out of hours jobs each submit the next one (see check_inputs)
+    if submit_jobs_together is None:
+        submit_jobs_together = str(out_of_hours_string).lower() not in \
+            ('yes', 'y', 'true')
     input_read = str(input(DefaultInputPrtStr.format(submit_jobs_together)))
     if input_read:
         submit_jobs_together = input_read
     del input_read
 
+    # Submit all the jobs as a single SLURM job array?
+    if scheduler == 'SLURM':
+        clear_screen()
+        print("Submit all jobs as a single SLURM job array?\n")
+        input_read = str(input(DefaultInputPrtStr.format(use_job_array)))
+        if input_read:
+            use_job_array = input_read
+        del input_read
+
     # Manage emissions and meteorological settings (HEMCO_Config.rc)
     clear_screen()
     print("Manage emissions & meteorological settings via HEMCO_Config.rc?\n")
@@ -338,6 +689,7 @@ def get_variables_from_cli(inputs):
     inputs.scheduler = scheduler
     inputs.send_email = send_email
     inputs.submit_jobs_together = submit_jobs_together
+    inputs.use_job_array = use_job_array
     inputs.manage_hemco_files = manage_hemco_files
     inputs.memory_need = memory_need
     inputs.MetYear = MetYear
@@ -347,7 +699,7 @@ def get_variables_from_cli(inputs):
     return inputs
 
 
-def list_of_times_to_run(start_time, end_time, inputs):
+def list_of_times_to_run(start_time, end_time, inputs, run_dir='.'):
     """
     Create a list of start times and the end time of the run
 
@@ -356,6 +708,7 @@ def list_of_times_to_run(start_time, end_time, inputs):
     start_time (str): Start time of GEOS-Chem simulation in input.goes
     end_time (str):  End time of GEOS-Chem simulation in input.goes
     inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory (used to plan the "auto" step)
 
     Returns
     -------
@@ -370,34 +723,16 @@ def list_of_times_to_run(start_time, end_time, inputs):
         """
         return _my_datetime.strftime("%Y%m%d")
 
-    if step == "12month":
-        time_delta = relativedelta(months=12)
-    elif step == "9month":
-        time_delta = relativedelta(months=9)
-    elif step == "6month":
-        time_delta = relativedelta(months=6)
-    elif step == "3month":
-        time_delta = relativedelta(months=3)
-    elif step == "2month":
-        time_delta = relativedelta(months=2)
-    elif step == "1month":
-        time_delta = relativedelta(months=1)
-    elif step == "month":
-        time_delta = relativedelta(months=1)
-    elif step == "2week":
-        time_delta = relativedelta(weeks=2)
-    elif step == "fortnight":
-        time_delta = relativedelta(weeks=2)
-    elif step == "1week":
-        time_delta = relativedelta(weeks=2)
-    elif step == "week":
-        time_delta = relativedelta(weeks=1)
-    elif step == "3day":
-        time_delta = relativedelta(days=1)
-    elif step == "1day":
-        time_delta = relativedelta(days=1)
-    elif step == "day":
-        time_delta = relativedelta(days=1)
+    # Plan the chunks from the measured throughput
+    if step == "auto":
+        times = get_auto_times_to_run(start_time, end_time, inputs,
+                                      run_dir=run_dir)
+        if times:
+            return times
+        print("Not enough history to plan the chunks, using a step of month")
+        step = "month"
+
+    time_delta = STEP_DELTAS[step]
 
     start_datetime = datetime.datetime.strptime(start_time, "%Y%m%d")
     end_datetime = datetime.datetime.strptime(end_time, "%Y%m%d")
@@ -412,6 +747,39 @@ def list_of_times_to_run(start_time, end_time, inputs):
     return times
 
 
+def get_auto_times_to_run(start_time, end_time, inputs, run_dir='.'):
+    """
+    Plan the times of a run (step "auto") from the measured throughput
+
+    Parameters
+    -------
+    start_time (str): Start time of GEOS-Chem simulation in input.goes
+    end_time (str):  End time of GEOS-Chem simulation in input.goes
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - A resumed run keeps the chunks it was planned with
+     - Returns None if there is not enough history to plan the chunks
+    """
+    if inputs.resume:
+        times = load_chunk_plan(start_time, end_time, run_dir=run_dir)
+        if times:
+            return times
+    simulated_days_per_hour = get_simulated_days_per_hour(run_dir=run_dir,
+                                                          inputs=inputs)
+    if not simulated_days_per_hour:
+        return None
+    max_days = get_max_days_per_chunk(simulated_days_per_hour, inputs)
+    return plan_chunk_times(start_time, end_time, max_days,
+                            align_to_months=inputs.align_chunks_to_months)
+
+
 def update_output_line(line, end_time, inputs=None):
     """
     Make sure we have a 3 in the end date in input.geos output menu
@@ -430,33 +798,38 @@ def update_output_line(line, end_time, inputs=None):
     -------
      - Returned output is the string to write to the *input.geos* file
     """
-    # Retrieve the frequency of output
-    step = inputs.step
-    # if the output is in
-    output_on_1st_of_month = False
-    if 'month' in step.lower():
-        output_on_1st_of_month = True
+    # The single line is parsed as a (one line) input.geos file
+    input_geos = InputGeos([line])
+    output_on_1st_of_month = get_output_on_1st_of_month(inputs)
+    return input_geos.create_lines(
+        None, end_time, output_on_1st_of_month=output_on_1st_of_month)[0]
 
-    # Get the name of the month
-    _current_month_name = calendar.month_name[int(end_time[4:6])]
-    _current_month_name = _current_month_name[0:3].upper()
 
-    # Replace all instances of 3 with 0 so we only have the final day as 3
-    line = line.replace('3', '0')
+def get_output_on_1st_of_month(inputs=None):
+    """
+    Should the output be written on the end day of every month's output line?
 
-    # Get the position of the last day of simulations
-    _current_day_of_month = int(end_time[6:8])
-    _position = 26+_current_day_of_month
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
 
-    if (line[20:23] == _current_month_name) or output_on_1st_of_month:
-        newline = line[:_position-1] + '3' + line[_position:]
-    else:
-        newline = line
+    Returns
+    -------
+    (bool)
 
-    return newline
+    Notes
+    -------
+     - This is the case if the run is split into chunks of months (or the
+     "auto" chunks are aligned to months)
+    """
+    if inputs is None:
+        return False
+    if inputs.step == 'auto':
+        return inputs.align_chunks_to_months
+    return 'month' in inputs.step.lower()
 
 
-def create_the_input_files(times, inputs=None, debug=False):
+def create_the_input_files(times, inputs=None, debug=False, run_dir='.'):
     """
     Create the input files for the run
 
@@ -465,21 +838,31 @@ def create_the_input_files(times, inputs=None, debug=False):
     times (list): list of string times in the format YYYYMMDD
     inputs (GC_Job class): Class containing various inputs like a dictionary
     debug (bool): Print debugging output to the screen
+    run_dir (str): GEOS-Chem run directory to create the input files for
 
     Returns
     -------
     (None)
     """
     # Create folder input files
-    _dir = os.path.dirname("input_files/")
+    _dir = os.path.join(run_dir, "input_files")
     if not os.path.exists(_dir):
         os.makedirs(_dir)
     # Modify the input files to have the correct start times
     # Also make sure they end on a 3
 
-    # Read the input file
-    with open("input.geos", "r") as input_file:
-        input_geos = input_file.readlines()
+    # Read the input file (once) for all the chunks
+    input_geos = InputGeos.from_file(get_run_input_file(run_dir,
+                                                        "input.geos"))
+    output_on_1st_of_month = get_output_on_1st_of_month(inputs)
+    # Also read the original HEMCO_Config.rc file (once) if managing these
+    if inputs.manage_hemco_files:
+        HEMCO_file_location = get_run_input_file(run_dir, "HEMCO_Config.rc")
+        with open(HEMCO_file_location, "r") as input_HEMCO_file:
+            input_HEMCO_geos = input_HEMCO_file.readlines()
+        # Each distinct HEMCO_Config.rc is only written once to the store
+        HEMCO_store_dir = os.path.join(_dir, "HEMCO_store")
+        HEMCO_store_files = {}
 
     for n_time, time in enumerate(times):
         end_time = time
@@ -492,11 +875,12 @@ def create_the_input_files(times, inputs=None, debug=False):
                                                 (start_time+filename)
                                                 )
 
-        new_input_geos = create_new_input_file(start_time, end_time,
-                                               input_geos, inputs=inputs)
+        new_input_geos = input_geos.create_file_string(
+            start_time, end_time,
+            output_on_1st_of_month=output_on_1st_of_month)
 
         with open(time_input_file_location, 'w') as output_file:
-            output_file.writelines(new_input_geos)
+            output_file.write(new_input_geos)
 
         # Also create files for controlling emissions via HEMCO
         if inputs.manage_hemco_files:
@@ -504,21 +888,22 @@ def create_the_input_files(times, inputs=None, debug=False):
             HEMCO_input_file_location = os.path.join(_dir,
                                                      (start_time+filename)
                                                      )
-            # Get the original HEMCO_Config.rc file
-            with open("HEMCO_Config.rc", "r") as input_HEMCO_file:
-                input_HEMCO_geos = input_HEMCO_file.readlines()
             # Work on the emission and Met. year from input variables
             MetYear = inputs.MetYear
             EmisYear = inputs.EmisYear
             MetYear = get_HEMCO_year_from_var(MetYear, n_time, start_time)
             EmisYear = get_HEMCO_year_from_var(EmisYear, n_time, start_time)
-            # Update MetYear, EmisYear, ...  variables
-            new_HEMCO_input = create_new_HEMCO_input_file(input_HEMCO_geos,
-                                                          MetYear=MetYear,
-                                                          EmisYear=EmisYear)
-
-            with open(HEMCO_input_file_location, 'w') as output_file:
-                output_file.writelines(new_HEMCO_input)
+            # Update MetYear, EmisYear, ...  variables (once per variant)
+            HEMCO_years = (MetYear, EmisYear)
+            if HEMCO_years not in HEMCO_store_files:
+                new_HEMCO_input = create_new_HEMCO_input_file(
+                    input_HEMCO_geos, MetYear=MetYear, EmisYear=EmisYear)
+                HEMCO_store_files[HEMCO_years] = write_content_addressed_file(
+                    ''.join(new_HEMCO_input), HEMCO_store_dir,
+                    suffix=filename)
+            # Link the chunk's file to the stored variant
+            link_file(HEMCO_store_files[HEMCO_years],
+                      HEMCO_input_file_location)
 
         start_time = time
     return
@@ -556,6 +941,81 @@ def get_HEMCO_year_from_var(HEMCO_Year_var, n_time, start_time):
         pass
 
 
+def get_chunk_input_files(times, run_dir='.', inputs=None):
+    """
+    Get the met and emission files (from HEMCO_Config.rc) each chunk reads
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the list of files of each chunk by start time
+     - The MetYear and EmisYear of each chunk are used if managing the
+     HEMCO_Config.rc files, otherwise the simulated year
+    """
+    HEMCO_config = HEMCOConfig.from_file(
+        get_run_input_file(run_dir, "HEMCO_Config.rc"),
+        switches=inputs.hemco_switches)
+    chunk_files = {}
+    for n_time, (start_time, end_time) in enumerate(zip(times[:-1],
+                                                        times[1:])):
+        MetYear = None
+        EmisYear = None
+        if inputs.manage_hemco_files:
+            MetYear = get_HEMCO_year_from_var(inputs.MetYear, n_time+1,
+                                              start_time)
+            EmisYear = get_HEMCO_year_from_var(inputs.EmisYear, n_time+1,
+                                               start_time)
+        chunk_files[start_time] = HEMCO_config.get_chunk_files(
+            start_time, end_time, met_year=MetYear, emis_year=EmisYear,
+            tokens=inputs.hemco_tokens)
+    return chunk_files
+
+
+def check_input_files_available(times, run_dir='.', inputs=None):
+    """
+    Make sure the met and emission files of every chunk exist
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Fails before anything is submitted, rather than a chunk crashing after
+     waiting in the queue (and breaking the chain of jobs after it)
+    """
+    chunk_files = get_chunk_input_files(times, run_dir=run_dir, inputs=inputs)
+    missing = get_missing_input_files(
+        chunk_files, index_file=inputs.input_index_file,
+        max_age=float(inputs.input_index_max_age),
+        threads=int(inputs.input_check_threads))
+    AssStr = "Input files are missing for {n_chunks} chunk(s), starting with the chunk from {start_time}:\n{files}"
+    if missing:
+        start_time = sorted(missing)[0]
+        files = missing[start_time]
+        if len(files) > 10:
+            files = files[:10] + ['... and {} more'.format(len(files)-10)]
+        assert False, AssStr.format(n_chunks=len(missing),
+                                    start_time=start_time,
+                                    files='\n'.join(files))
+    return
+
+
 def check_inputs(inputs, debug=False):
     """
     Make sure all the inputs
@@ -576,6 +1036,17 @@ def check_inputs(inputs, debug=False):
     send_email = inputs.send_email
     wall_time = inputs.wall_time
     step = inputs.step
+    use_job_array = inputs.use_job_array
+    submit_jobs_together = inputs.submit_jobs_together
+    resume = inputs.resume
+    predict_resources = inputs.predict_resources
+    stage_to_scratch = inputs.stage_to_scratch
+    prefetch_inputs = inputs.prefetch_inputs
+    check_input_files = inputs.check_input_files
+    feeder = inputs.feeder
+    registry = inputs.registry
+    auto_retry = inputs.auto_retry
+    auto_placement = inputs.auto_placement
     # Earth0 queue names
 #    queue_names = ['run', 'large',]
     # Viking queue names
@@ -585,22 +1056,83 @@ def check_inputs(inputs, debug=False):
     ]
     yes_list = ['yes', 'YES', 'Yes', 'Y', 'y', True, 'true', 'True']
     no_list = ['no', 'NO', 'No', 'N', 'n', False, 'false', 'False']
-    steps = [
-        "12month", "9month", "6month", "3month", "2month", "1month",
-        "month", "fortnight", "2week", "1week", "week",
-        "2day", "1day", "day",
-    ]
+    # Unless chosen, jobs are submitted together, except out of hours as each
+    # job then submits the next one
+    if submit_jobs_together is None:
+        submit_jobs_together = out_of_hours_string not in yes_list
+    steps = list(STEP_DELTAS) + ["auto"]
+    align_chunks_to_months = inputs.align_chunks_to_months
+    # Check scheduler string
+    schedulers = list(SCHEDULER_QUEUE_FILES)
+    AssStr = "Unrecognised scheduler {scheduler}.\ntry one of {schedulers}"
+    assert (inputs.scheduler in schedulers), AssStr.format(
+        scheduler=inputs.scheduler, schedulers=schedulers)
     # Check steps string
     AssStr = "Unrecognised step size {step}.\ntry one of {steps}"
     assert (step in steps), AssStr.format(step=step, steps=steps)
+    # Check segments
+    AssStr = "Unrecognised segment spin-up {spinup}.\ntry one of {steps}"
+    assert (inputs.segment_spinup in STEP_DELTAS), AssStr.format(
+        spinup=inputs.segment_spinup, steps=list(STEP_DELTAS))
+    AssStr = "The number of segments must be at least 1"
+    assert int(inputs.segments) >= 1, AssStr
+    AssStr = "A batch of run directories can not be split into segments"
+    assert (int(inputs.segments) == 1) or not inputs.batch_run_dirs, AssStr
+    # Check the job array size
+    AssStr = "The largest job array (max_array_size, SLURM's MaxArraySize) must be at least 1"
+    assert int(inputs.max_array_size) >= 1, AssStr
+    # Check stage to scratch string
+    AssStr = "Stage to scratch option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (stage_to_scratch in yes_list) or (stage_to_scratch in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check prefetch inputs string
+    AssStr = "Prefetch inputs option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (prefetch_inputs in yes_list) or (prefetch_inputs in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check input files string
+    AssStr = "Check input files option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (check_input_files in yes_list) or \
+        (check_input_files in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check feeder string
+    AssStr = "Feeder option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (feeder in yes_list) or (feeder in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check auto retry string
+    AssStr = "Auto retry option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (auto_retry in yes_list) or (auto_retry in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check registry string
+    AssStr = "Registry option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (registry in yes_list) or (registry in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check align chunks to months string
+    AssStr = "Align chunks to months option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (align_chunks_to_months in yes_list) or \
+        (align_chunks_to_months in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check the steps to simulate
+    if inputs.simulate:
+        for simulate_step in str(inputs.simulate).split(','):
+            AssStr = "Unrecognised step size to simulate {step}.\ntry one of {steps}"
+            assert (simulate_step.strip() in steps), AssStr.format(
+                step=simulate_step, steps=steps)
     # Check Priority string
     AssStr = "Priority not between -1024 and 1023. Received {priority}"
     AssBool = (-1024 <= int(queue_priority) <= 1023)
     assert AssBool, AssStr.format(priority=queue_priority)
-    # Check Queue type string
-    AssStr = "Unrecognised queue type: {queue_name}\n try one of {}"
-    assert (queue_name in queue_names), AssStr.format(queue_name=queue_name,
-                                                      queue_names=queue_names)
+    # Check auto placement string
+    AssStr = "Auto placement option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (auto_placement in yes_list) or (auto_placement in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    AssStr = "Placement needs the load of a SLURM or PBS cluster"
+    AssBool = (inputs.scheduler in ('SLURM', 'PBS')) or \
+        not ((auto_placement in yes_list) or inputs.advise_placement)
+    assert AssBool, AssStr
+    # Check Queue type string (the queue is picked later with auto placement)
+    AssStr = "Unrecognised queue type: {queue_name}\n try one of {queue_names}"
+    assert (queue_name in queue_names) or (auto_placement in yes_list), \
+        AssStr.format(queue_name=queue_name, queue_names=queue_names)
     # Check out-of-hours queue option string
     AssStr = "Unrecognised option for out of hours.\nTry one of: {yes_list} / {no_list}\nThe command given was {run_script_string}"
     AssBool = ((out_of_hours_string in yes_list)
@@ -616,6 +1148,23 @@ def check_inputs(inputs, debug=False):
     AssStr = "Email option is neither yes or no. \nPlease check the settings. \nTry one of: {yes_list} / {no_list}"
     AssBool = (send_email in yes_list) or (send_email in no_list)
     assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check job array string
+    AssStr = "Job array option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (use_job_array in yes_list) or (use_job_array in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check submit jobs together string
+    AssStr = "Submit jobs together option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (submit_jobs_together in yes_list) or \
+        (submit_jobs_together in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check resume string
+    AssStr = "Resume option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (resume in yes_list) or (resume in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
+    # Check predict resources string
+    AssStr = "Predict resources option is neither yes or no. \nTry one of: {yes_list} / {no_list}"
+    AssBool = (predict_resources in yes_list) or (predict_resources in no_list)
+    assert AssBool, AssStr.format(yes_list=yes_list, no_list=no_list)
 
     # Create the logicals - run the script?
     if run_script_string in yes_list:
@@ -633,6 +1182,108 @@ def check_inputs(inputs, debug=False):
         inputs.send_email = True
     elif send_email in no_list:
         inputs.send_email = False
+    # Create the logicals - Submit as a SLURM job array?
+    if use_job_array in yes_list:
+        inputs.use_job_array = True
+    elif use_job_array in no_list:
+        inputs.use_job_array = False
+    # Create the logicals - Submit the jobs together?
+    if submit_jobs_together in yes_list:
+        inputs.submit_jobs_together = True
+    elif submit_jobs_together in no_list:
+        inputs.submit_jobs_together = False
+    # Create the logicals - Only schedule the chunks still to run?
+    if resume in yes_list:
+        inputs.resume = True
+    elif resume in no_list:
+        inputs.resume = False
+    # Create the logicals - Size the chunks from history?
+    if predict_resources in yes_list:
+        inputs.predict_resources = True
+    elif predict_resources in no_list:
+        inputs.predict_resources = False
+    # Create the logicals - Run the chunks in node-local scratch?
+    if stage_to_scratch in yes_list:
+        inputs.stage_to_scratch = True
+    elif stage_to_scratch in no_list:
+        inputs.stage_to_scratch = False
+    # Create the logicals - Warm each chunk's inputs before it starts?
+    if prefetch_inputs in yes_list:
+        inputs.prefetch_inputs = True
+    elif prefetch_inputs in no_list:
+        inputs.prefetch_inputs = False
+    # Create the logicals - Check the input files exist before submitting?
+    if check_input_files in yes_list:
+        inputs.check_input_files = True
+    elif check_input_files in no_list:
+        inputs.check_input_files = False
+    # Create the logicals - Pick the partitions from the cluster's load?
+    if auto_placement in yes_list:
+        inputs.auto_placement = True
+    elif auto_placement in no_list:
+        inputs.auto_placement = False
+    # Create the logicals - Submit the chunks from the feeder's queue?
+    if feeder in yes_list:
+        inputs.feeder = True
+    elif feeder in no_list:
+        inputs.feeder = False
+    # Create the logicals - Resubmit chunks that fail?
+    if auto_retry in yes_list:
+        inputs.auto_retry = True
+    elif auto_retry in no_list:
+        inputs.auto_retry = False
+    # Create the logicals - Record the runs in the campaign registry?
+    if registry in yes_list:
+        inputs.registry = True
+    elif registry in no_list:
+        inputs.registry = False
+    # Create the logicals - End the "auto" chunks on the 1st of a month?
+    if align_chunks_to_months in yes_list:
+        inputs.align_chunks_to_months = True
+    elif align_chunks_to_months in no_list:
+        inputs.align_chunks_to_months = False
+    # Out of hours jobs each submit the next job when they finish, so it
+    # can be given the start of the next window
+    if inputs.out_of_hours:
+        get_working_hours(inputs.working_hours)
+        AssStr = "Out of hours jobs call the next job in the sequence, so can not be submitted together or as a job array.\nSet submit_jobs_together and use_job_array to no"
+        assert not ((inputs.scheduler == 'SLURM') and (
+            inputs.use_job_array or inputs.submit_jobs_together)), AssStr
+    # Each chunk's job submits its own retry job, so not as a job array
+    if inputs.auto_retry:
+        AssStr = "Failed chunks can only be retried with SLURM"
+        assert inputs.scheduler == 'SLURM', AssStr
+        AssStr = "Failed chunks are retried by their own job, so can not be submitted as a job array.\nSet use_job_array to no"
+        assert not inputs.use_job_array, AssStr
+    # Jobs are monitored through the scheduler's accounting
+    if inputs.monitor:
+        AssStr = "The jobs can only be monitored (--status or --watch) with SLURM or PBS"
+        assert inputs.scheduler in MONITOR_COMMANDS, AssStr
+    # The members of a clone are scheduled as a batch of their own
+    AssStr = "A clone can not be combined with a batch, segments or a spin-up"
+    assert not (inputs.clone and (inputs.batch_run_dirs or inputs.spinup_dir
+                                  or int(inputs.segments) > 1)), AssStr
+    # The whole graph of a spin-up and its branches is submitted at once
+    if inputs.spinup_dir:
+        AssStr = "A spin-up can only be shared by a batch of run directories (--batch=) with SLURM"
+        assert inputs.batch_run_dirs and (inputs.scheduler == 'SLURM'), \
+            AssStr
+        AssStr = "A spin-up can not be shared out of hours or with the feeder"
+        assert not (inputs.out_of_hours or inputs.feeder), AssStr
+        AssStr = "The graph of a spin-up is submitted together, so can not be a job array.\nSet submit_jobs_together to yes and use_job_array to no"
+        assert inputs.submit_jobs_together and not inputs.use_job_array, \
+            AssStr
+    # The feeder submits every chunk itself, each depending on the last
+    if inputs.feeder:
+        AssStr = "The feeder can only be used with SLURM"
+        assert inputs.scheduler == 'SLURM', AssStr
+        # Chunks are fed before the one before them finishes, so a window
+        # found at feed time would not hold when they start
+        AssStr = "The feeder can not be used out of hours"
+        assert not inputs.out_of_hours, AssStr
+        AssStr = "The feeder submits each chunk after the one before, so can not submit a job array.\nSet submit_jobs_together to yes and use_job_array to no"
+        assert inputs.submit_jobs_together and not inputs.use_job_array, \
+            AssStr
     return inputs
 
 
@@ -642,9 +1293,9 @@ def create_new_input_file(start_time, end_time, input_file, inputs=None):
 
     Parameters
     -------
-    inputs (GC_Job class): Class containing various inputs like a dictionary
     start_time (str): Start of GEOS-Chem run in format YYYYMMSS
     end_time (str): End of GEOS-Chem run in format YYYYMMSS
+    input_file (list or InputGeos): Lines of the input file (or parsed file)
     inputs (GC_Job class): Class containing various inputs like a dictionary
 
     Returns
@@ -654,25 +1305,13 @@ def create_new_input_file(start_time, end_time, input_file, inputs=None):
     Notes
     -------
      - Return list is the output file as a list of strings
+     - Pass an InputGeos to avoid parsing the file again for every chunk
     """
-    new_lines = []
-    # Change the lines that need changing by reading their start date
-    for line in input_file:
-        if line.startswith("Start YYYYMMDD"):
-            newline = line[:26] + str(start_time) + line[34:]
-            # Confirm the run starts on the first of the time
-        elif line.startswith("End   YYYYMMDD"):
-            newline = line[:26] + str(end_time) + line[34:]
-        # Force CSPEC on
-        elif line.startswith("Read and save CSPEC_FULL:"):
-            newline = line[:26] + 'T\n'
-        # Make sure write at end on a 3
-        elif line.startswith("Schedule output for"):
-            newline = update_output_line(line, end_time, inputs=inputs)
-        else:
-            newline = line
-        new_lines.append(newline)
-    return new_lines
+    if not isinstance(input_file, InputGeos):
+        input_file = InputGeos(input_file)
+    output_on_1st_of_month = get_output_on_1st_of_month(inputs)
+    return input_file.create_lines(
+        start_time, end_time, output_on_1st_of_month=output_on_1st_of_month)
 
 
 def create_new_HEMCO_input_file(input_file, EmisYear="2016", MetYear="2016",
@@ -719,310 +1358,565 @@ def create_new_HEMCO_input_file(input_file, EmisYear="2016", MetYear="2016",
     return new_lines
 
 
-def create_PBS_queue_files(times, inputs=None, debug=False):
+# Queue script settings for each scheduler
+SCHEDULER_QUEUE_FILES = {
+    'PBS': {
+        'template': 'PBS_queue_script_template',
+        'queue_dir': 'PBS_queue_files',
+        'extension': '.pbs',
+    },
+    'SLURM': {
+        'template': 'SLURM_queue_script_template',
+        'queue_dir': 'SLURM_queue_files',
+        'extension': '.sbatch',
+    },
+    'local': {
+        'template': 'local_queue_script_template',
+        'queue_dir': 'local_queue_files',
+        'extension': '.sh',
+    },
+}
+
+
+def get_queue_file_variables(inputs):
     """
-    Create the queue files for a PBS managed queue (York's earth0 HPC)
+    Get the queue script template variables that are the same for all chunks
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (dict)
+    """
+    return {
+        'auto_retry': inputs.auto_retry,
+        'cpus_need': inputs.cpus_need,
+        'email_address': inputs.email_address,
+        'email_setting': inputs.email_setting,
+        'local_geos_command': inputs.local_geos_command,
+        'manage_hemco_files': inputs.manage_hemco_files,
+        'memory_need': inputs.memory_need,
+        'out_of_hours': inputs.out_of_hours,
+        'postprocess': bool(inputs.postprocess_command),
+        'queue_name': inputs.queue_name,
+        'queue_priority': inputs.queue_priority,
+        'scratch_dir': inputs.scratch_dir,
+        'stage_to_scratch': inputs.stage_to_scratch,
+        'wall_time': inputs.wall_time,
+    }
+
+
+def write_scratch_staging_script(queue_dir):
+    """
+    Write the script that stages chunks to (and from) node-local scratch
+
+    Parameters
+    -------
+    queue_dir (str): Directory of the queue files to write the script in
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is the name of the script (within queue_dir)
+    """
+    script_name = 'stage_scratch.sh'
+    script_location = os.path.join(queue_dir, script_name)
+    with open(script_location, 'w') as script:
+        script.write(load_template('scratch_staging_script').render({}))
+    st = os.stat(script_location)
+    os.chmod(script_location, st.st_mode | stat.S_IEXEC)
+    return script_name
+
+
+def create_retry_files(inputs=None, run_dir='.'):
+    """
+    Create the job that retries a failed chunk and the settings it uses
 
     Parameters
     -------
     inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory to create the files in
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Each chunk's job submits the retry job (SLURM_queue_files/retry.sbatch)
+     to run if it fails, which runs retry.py
+     - Out of hours, the chunk is resubmitted with the start of the next
+     window, as for the chunks themselves
+    """
+    _dir = os.path.join(run_dir, 'SLURM_queue_files')
+    for required_dir in (_dir, os.path.join(run_dir, 'queue_output')):
+        if not os.path.exists(required_dir):
+            os.makedirs(required_dir)
+    policy = {
+        'begin_option': get_queue_begin_option(inputs, scheduler='SLURM'),
+        'max_retries': inputs.max_retries,
+        'max_wall_time': inputs.max_wall_time,
+        'memory_factor': inputs.retry_memory_factor,
+        'wall_time_factor': inputs.retry_wall_time_factor,
+    }
+    with open(os.path.join(run_dir, RETRY_POLICY_FILE), 'w') as policy_file:
+        json.dump(policy, policy_file, indent=1, sort_keys=True)
+    variables = {
+        # job name can only be 15 characters (and differ from the chunks')
+        'job_name': ('rt' + inputs.job_name)[:14],
+        'python': sys.executable,
+        'queue_name': inputs.queue_name,
+        'retry_script': os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'retry.py'),
+    }
+    retry_file_location = os.path.join(_dir, 'retry.sbatch')
+    with open(retry_file_location, 'w') as retry_file:
+        retry_file.write(
+            load_template('SLURM_retry_script_template').render(variables))
+    st = os.stat(retry_file_location)
+    os.chmod(retry_file_location, st.st_mode | stat.S_IEXEC)
+    return
+
+
+# Prefetch job settings for each scheduler
+SCHEDULER_PREFETCH_FILES = {
+    'PBS': {
+        'template': 'PBS_prefetch_script_template',
+        'extension': '.prefetch.pbs',
+    },
+    'SLURM': {
+        'template': 'SLURM_prefetch_script_template',
+        'extension': '.prefetch.sbatch',
+    },
+}
+
+
+def create_prefetch_files(times, inputs=None, run_dir='.', scheduler=None):
+    """
+    Create the jobs that warm each chunk's inputs while the last one runs
+
+    Parameters
+    -------
     times (list): list of string times in the format YYYYMMDD
-    debug (bool): Print debugging output to the screen
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory to create the files in
+    scheduler (str): Scheduler to create the files for (default: inputs')
 
     Returns
     -------
     (None)
+
+    Notes
+    -------
+     - Each chunk (after the 1st) gets a list of the files it reads and a
+     small job to read them. The job is submitted when the chunk before it
+     starts (see create_queue_files, create_SLURM_array_queue_files and
+     create_SLURM_run_script2submit_together)
     """
-    # Create local variables
-    queue_name = inputs.queue_name
-    job_name = inputs.job_name
-    queue_priority = inputs.queue_priority
-    out_of_hours = inputs.out_of_hours
-    wall_time = inputs.wall_time
-    send_email = inputs.send_email
-    email_address = inputs.email_address
-    email_setting = inputs.email_setting
-    memory_need = inputs.memory_need
-    cpus_need = inputs.cpus_need
+    if scheduler is None:
+        scheduler = inputs.scheduler
+    settings = SCHEDULER_PREFETCH_FILES[scheduler]
+    queue_dir = SCHEDULER_QUEUE_FILES[scheduler]['queue_dir']
+    _dir = os.path.join(run_dir, queue_dir)
+    for required_dir in (_dir, os.path.join(run_dir, 'queue_output')):
+        if not os.path.exists(required_dir):
+            os.makedirs(required_dir)
+    template = load_template(settings['template'])
+    variables = {
+        'prefetch_wall_time': inputs.prefetch_wall_time,
+        'queue_name': inputs.queue_name,
+    }
+    chunk_files = get_chunk_input_files(times, run_dir=run_dir, inputs=inputs)
+    for start_time in times[1:-1]:
+        file_list = os.path.join(queue_dir, start_time + '.prefetch.txt')
+        with open(os.path.join(run_dir, file_list), 'w') as files:
+            files.write(''.join(i + '\n' for i in chunk_files[start_time]))
+        variables['start_time'] = start_time
+        variables['file_list'] = file_list
+        # job name can only be 15 characters (and differ from the chunk's)
+        variables['job_name'] = ('pf' + inputs.job_name + start_time)[:14]
+        prefetch_file_location = os.path.join(
+            _dir, start_time + settings['extension'])
+        with open(prefetch_file_location, 'w') as prefetch_file:
+            prefetch_file.write(template.render(variables))
+        st = os.stat(prefetch_file_location)
+        os.chmod(prefetch_file_location, st.st_mode | stat.S_IEXEC)
+    return
 
-    # Create folder queue files
-    _dir = os.path.dirname("PBS_queue_files/")
-    if not os.path.exists(_dir):
-        os.makedirs(_dir)
 
-    # Modify the input files to have the correct start months
-    for time in times:
-        end_time = time
-        if time == times[0]:
-            start_time = time
-            continue
+# Post-processing job settings for each scheduler
+SCHEDULER_POSTPROCESS_FILES = {
+    'PBS': {
+        'template': 'PBS_postprocess_script_template',
+        'extension': '.post.pbs',
+    },
+    'SLURM': {
+        'template': 'SLURM_postprocess_script_template',
+        'extension': '.post.sbatch',
+    },
+    'local': {
+        'template': 'local_postprocess_script_template',
+        'extension': '.post.sh',
+    },
+}
+
+
+def create_postprocess_files(times, inputs=None, run_dir='.', scheduler=None):
+    """
+    Create the jobs that post-process each chunk's output
 
-        # Make the out of hours string if only running out of hours
-        if out_of_hours:
-            out_of_hours_string = (
-                """
- if ! ( $out_of_hours_overide ); then
-    if $out_of_hours ; then
-       if [ $(date +%u) -lt 6 ]  && [ $(date +%H) -gt 8 ] && [ $(date +%H) -lt 17 ] ; then
-          job_number=$(qsub -a 1810 PBS_queue_files/{start_time}.pbs)
-          echo $job_number
-          echo qdel $job_number > exit_geos.sh
-          echo "Tried running in work hours but we don't want to. Will try again at 1800. The time we attempted to run was:">>logs/log.log
-          echo $(date)>>logs/log.log
-          exit 1
-       fi
-    fi
- fi
- """
-            ).format(start_time=start_time)
-        else:
-            out_of_hours_string = "\n"
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory to create the files in
+    scheduler (str): Scheduler to create the files for (default: inputs')
 
-        # Set up email if its the final run and email = True
-        # TODO - add an option to always send email when run finishes?
-        # or if run finishes without a success code?
-        if send_email and (time == times[-1]):
-            email_string = (
-                """
-#PBS -m {email_setting}
-#PBS -M {email_address}
-"""
-            ).format(email_setting=email_setting,
-                     email_address=email_address)
-        else:
-            email_string = "\n"
-        # Setup queue file string
-        templates_dir = '{}/templates/'.format(os.path.dirname(__file__))
-        script_template_file = 'PBS_queue_script_template'
-        script_template = os.path.join(templates_dir, script_template_file)
-        with open(script_template, 'r') as template_file:
-            queue_file_string = [i for i in template_file]
-        queue_file_string = (''.join(queue_file_string))
-        # Add all the variables to the string
-        queue_file_string = queue_file_string.format(
-            queue_name=queue_name,
-            # job name can only be 15 characters
-            job_name=(job_name + start_time)[:14],
-            start_time=start_time,
-            wall_time=wall_time,
-            memory_need=memory_need,
-            cpus_need=cpus_need,
-            queue_priority=queue_priority,
-            email_string=email_string,
-            out_of_hours_string=out_of_hours_string,
-            end_time=end_time
-        )
-        # Write the queue file string
-        queue_file_location = os.path.join(_dir, (start_time + ".pbs"))
-        queue_file = open(queue_file_location, 'w')
-        queue_file.write(queue_file_string)
-        # If this is the final month then run an extra command
-        if time == times[-1]:
-            run_completion_script()
-        queue_file.close()
-        # Change the permissions so it is executable
-        st = os.stat(queue_file_location)
-        os.chmod(queue_file_location, st.st_mode | stat.S_IEXEC)
-        # Now update the start_time variable
-        start_time = time
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Each chunk's job submits its post-processing job when GEOS-Chem
+     completes, so it only runs after a successful chunk (like afterok) and
+     runs alongside the next chunk rather than in the chunk's allocation
+     - The command is run in the run directory with START_TIME, END_TIME and
+     FINAL_CHUNK ("yes"/"no") set for the chunk
+    """
+    if scheduler is None:
+        scheduler = inputs.scheduler
+    settings = SCHEDULER_POSTPROCESS_FILES[scheduler]
+    _dir = os.path.join(run_dir, SCHEDULER_QUEUE_FILES[scheduler]['queue_dir'])
+    for required_dir in (_dir, os.path.join(run_dir, 'queue_output')):
+        if not os.path.exists(required_dir):
+            os.makedirs(required_dir)
+    template = load_template(settings['template'])
+    variables = {
+        'postprocess_command': inputs.postprocess_command,
+        'postprocess_wall_time': inputs.postprocess_wall_time,
+        'queue_name': inputs.queue_name,
+    }
+    for start_time, end_time in zip(times[:-1], times[1:]):
+        variables['start_time'] = start_time
+        variables['end_time'] = end_time
+        variables['final_chunk'] = 'yes' if end_time == times[-1] else 'no'
+        # job name can only be 15 characters (and differ from the chunk's)
+        variables['job_name'] = ('pp' + inputs.job_name + start_time)[:14]
+        postprocess_file_location = os.path.join(
+            _dir, start_time + settings['extension'])
+        with open(postprocess_file_location, 'w') as postprocess_file:
+            postprocess_file.write(template.render(variables))
+        st = os.stat(postprocess_file_location)
+        os.chmod(postprocess_file_location, st.st_mode | stat.S_IEXEC)
     return
 
 
-def create_SLURM_queue_files(times, inputs=None, debug=False):
+def get_queue_begin_option(inputs, scheduler=None):
     """
-    Create the queue files for a SLURM managed queue (e.g. York's viking HPC)
+    Get the option to submit jobs with so they start out of hours
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    scheduler (str): Scheduler the jobs are submitted to (default: inputs')
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Empty if jobs can start at any time
+    """
+    if scheduler is None:
+        scheduler = inputs.scheduler
+    if not inputs.out_of_hours or (scheduler not in BEGIN_OPTIONS):
+        return ''
+    return get_begin_option(scheduler,
+                            SCHEDULER_QUEUE_FILES[scheduler]['queue_dir'])
+
+
+def create_queue_files(times, inputs=None, debug=False, run_dir='.',
+                       scheduler=None):
+    """
+    Create the queue files for each chunk of the run for a scheduler
 
     Parameters
     -------
     inputs (GC_Job class): Class containing various inputs like a dictionary
     times (list): list of string times in the format YYYYMMDD
     debug (bool): Print debugging output to the screen
+    run_dir (str): GEOS-Chem run directory to create the queue files in
+    scheduler (str): Scheduler to create the files for (default: inputs')
 
     Returns
     -------
     (None)
+
+    Notes
+    -------
+     - The template is compiled once (per process), so each chunk only needs
+     its dates etc. substituted in
     """
-    # Create local variables
-    cpus_need = inputs.cpus_need
-    email_address = inputs.email_address
-    email_setting = inputs.email_setting
+    if scheduler is None:
+        scheduler = inputs.scheduler
+    settings = SCHEDULER_QUEUE_FILES[scheduler]
     job_name = inputs.job_name
-    manage_hemco_files = inputs.manage_hemco_files
-    memory_need = inputs.memory_need
-    out_of_hours = inputs.out_of_hours
-    queue_name = inputs.queue_name
-    queue_priority = inputs.queue_priority
     send_email = inputs.send_email
     submit_jobs_together = inputs.submit_jobs_together
-    wall_time = inputs.wall_time
+    # PBS jobs always call the next job in the sequence
+    if scheduler == 'PBS':
+        submit_jobs_together = False
+    # Local chunks are run in order by the local executor
+    elif scheduler == 'local':
+        submit_jobs_together = True
 
     # Print received settings to debug:
     if debug:
-        print('scheduler:', inputs.scheduler)
-        print('cpus_need:', cpus_need)
-        print('email_address:', email_address)
-        print('email_setting:', email_setting)
-        print('job_name:', job_name)
-        print('manage_hemco_files:', manage_hemco_files)
-        print('memory_need:', memory_need)
-        print('out_of_hours:', out_of_hours)
-        print('queue_name:', queue_name)
-        print('queue_priority:', queue_priority)
+        print('scheduler:', scheduler)
+        for key, value in sorted(get_queue_file_variables(inputs).items()):
+            print('{}: {}'.format(key, value))
         print('send_email:', send_email)
         print('submit_jobs_together:', submit_jobs_together)
-        print('wall_time:', wall_time)
 
     # Create folder queue files
-    _dir = os.path.dirname("SLURM_queue_files/")
+    _dir = os.path.join(run_dir, settings['queue_dir'])
     if not os.path.exists(_dir):
         os.makedirs(_dir)
 
-    # Setup variables to hold various Text options
-    # ... hardwired capitalised variables for
-    slurm_capital_variables = """# CHANGE TO GEOS-Chem run directory, assuming job was submitted from there:
-cd \"${SLURM_SUBMIT_DIR}\" || exit 1
-
-# Set OpenMP thread count to number of cores requested for job:
-export OMP_NUM_THREADS=\"${SLURM_CPUS_PER_TASK}\""""
+    # Get the compiled template and the variables the same for every chunk
+    template = load_template(settings['template'])
+    variables = get_queue_file_variables(inputs)
+    # Start the next job in the next out of hours window
+    variables['begin_option'] = get_queue_begin_option(inputs, scheduler)
+    if variables['begin_option']:
+        write_out_of_hours_files(_dir, inputs, scheduler)
+    # Run the chunks in node-local scratch if requested
+    if inputs.stage_to_scratch:
+        variables['stage_script'] = os.path.join(
+            settings['queue_dir'], write_scratch_staging_script(_dir))
+    # Create the jobs that warm the inputs of the chunks if requested
+    if inputs.prefetch_inputs and (scheduler in SCHEDULER_PREFETCH_FILES):
+        create_prefetch_files(times, inputs=inputs, run_dir=run_dir,
+                              scheduler=scheduler)
+    # Create the jobs that post-process the chunks' output if requested
+    if inputs.postprocess_command:
+        create_postprocess_files(times, inputs=inputs, run_dir=run_dir,
+                                 scheduler=scheduler)
+    # Create the job that retries failed chunks if requested
+    if inputs.auto_retry and (scheduler == 'SLURM'):
+        create_retry_files(inputs=inputs, run_dir=run_dir)
+    # Size each chunk's wall time and memory from history if requested
+    resources = {}
+    if inputs.predict_resources:
+        resources = predict_chunk_resources(times, run_dir=run_dir,
+                                            inputs=inputs)
+    # Pick each chunk's partition from the load of the cluster if requested
+    if inputs.auto_placement:
+        resources = place_chunks(times, resources, inputs=inputs)
 
     # Modify the input files to have the correct start months
-    for time in times:
-        end_time = time
-        if time == times[0]:
-            start_time = time
-            continue
-
-        # Make the out of hours string if only running out of hours
-        # TODO - set this up with SLURM
-        if out_of_hours:
-            out_of_hours_string = "\n"
-        else:
-            out_of_hours_string = "\n"
+    for start_time, end_time in zip(times[:-1], times[1:]):
+        final_chunk = (end_time == times[-1])
+        variables['start_time'] = start_time
+        variables['end_time'] = end_time
+        variables['restart_file'] = inputs.restart_file_template.format(
+            date=start_time)
+        # job name can only be 15 characters
+        variables['job_name'] = (job_name + start_time)[:14]
         # Set up email if its the final run and email = True
         # TODO - add an option to always send email when run finishes?
         # or if run finishes without a success code?
-        if send_email and (time == times[-1]):
-            email_address2use = email_address
-        else:
-            email_address2use = "TEST@TEST.com"
-        # Setup final lines for submission script - call the next on or stop?
-        if time == times[-1]:
-            submit_next_job = 'False'
-        else:
-            submit_next_job = 'True'
-        # If submitting jobs to queue together (dependently), then override
-        if submit_jobs_together:
-            submit_next_job = 'False'
-
-        # Setup queue file string
-        templates_dir = '{}/templates/'.format(os.path.dirname(__file__))
-        script_template_file = 'SLURM_queue_script_template'
-
-        script_template = os.path.join(templates_dir, script_template_file)
-        with open(script_template, 'r') as template_file:
-            queue_file_string = [i for i in template_file]
-        queue_file_string = (''.join(queue_file_string))
-        # If debugging, print loop to screen by date
-        if debug:
-            print('times: {}'.format(times))
-            print('time: {} of n={} '.format(time, len(times)))
-            print('time == times[-1]: {}'.format((time == times[-1])))
-            print('start_time, {} end_time: {}'.format(start_time, end_time))
-            print('send_email: {}'.format(send_email))
-            print('email_address: {}'.format(email_address2use))
-            print('templates_dir: {}'.format(templates_dir))
-        # Setup lines to manage HEMCO files(s) if this was requested
-        if manage_hemco_files:
-            HEMCO_file_lines = """
-    rm -f HEMCO_Config.rc
-    ln -s input_files/{start_time}.HEMCO_Config.rc HEMCO_Config.rc\n
-     """
-            HEMCO_file_lines = HEMCO_file_lines.format(start_time=start_time)
-        else:
-            HEMCO_file_lines = "\n"
-        # Add all the variables to the string
-        queue_file_string = queue_file_string.format(
-            queue_name=queue_name,
-            # job name can only be 15 characters
-            job_name=(job_name + start_time)[:14],
-            start_time=start_time,
-            wall_time=wall_time,
-            memory_need=memory_need,
-            submit_jobs_together=submit_jobs_together,
-            cpus_need=cpus_need,
-            queue_priority=queue_priority,
-            out_of_hours_string=out_of_hours_string,
-            end_time=end_time,
-            email_address=email_address2use,
-            slurm_capital_variables=slurm_capital_variables,
-            HEMCO_file_lines=HEMCO_file_lines,
-            submit_next_job=submit_next_job,
-        )
+        variables['send_email'] = send_email and final_chunk
+        # Call the next job at the end, unless submitting jobs together
+        variables['submit_next_job'] = not (final_chunk or
+                                            submit_jobs_together)
+        # Jobs that call the next job also submit its prefetch job
+        variables['prefetch_next'] = inputs.prefetch_inputs and \
+            variables['submit_next_job'] and \
+            (scheduler in SCHEDULER_PREFETCH_FILES)
+        variables.update(resources.get(start_time, {}))
+        queue_file_string = template.render(variables)
+
         # Write the queue file to disk
-        queue_file_location = os.path.join(_dir, (start_time + ".sbatch"))
+        queue_file_location = os.path.join(
+            _dir, (start_time + settings['extension']))
         if debug:
+            print('start_time, {} end_time: {}'.format(start_time, end_time))
             print('queue_file_location: {}'.format(queue_file_location))
-            print('queue_file_string: {}'.format(queue_file_string))
         queue_file = open(queue_file_location, 'w')
         queue_file.write(queue_file_string)
-        # If this is the final month then run an extra command
-        if time == times[-1]:
-            run_completion_script()
         queue_file.close()
         # Change the permissions so it is executable
         st = os.stat(queue_file_location)
         os.chmod(queue_file_location, st.st_mode | stat.S_IEXEC)
-        # Now update the start_time variable
-        start_time = time
     return
 
 
-def create_PBS_run_script(time):
+def create_PBS_queue_files(times, inputs=None, debug=False, run_dir='.'):
     """
-    Create the script that can set the 1st scheduled job running
+    Create the queue files for a PBS managed queue (York's earth0 HPC)
 
     Parameters
     -------
-    time (str): string time to run job script for in the format YYYYMMDD
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    times (list): list of string times in the format YYYYMMDD
+    debug (bool): Print debugging output to the screen
+    run_dir (str): GEOS-Chem run directory to create the queue files in
 
     Returns
     -------
     (None)
     """
-    FileName = 'run_geos_PBS.sh'
-    run_script = open(FileName, 'w')
-    run_script_string = ("""
-#!/bin/bash
-qsub PBS_queue_files/{time}.pbs
-     """)
-    run_script.write(run_script_string.format(time=time))
-    run_script.close()
-    # Change the permissions so it is executable
-    st = os.stat(FileName)
-    os.chmod(FileName, st.st_mode | stat.S_IEXEC)
+    create_queue_files(times, inputs=inputs, debug=debug, run_dir=run_dir,
+                       scheduler='PBS')
     return
 
 
-def create_SLURM_run_script(time):
+def create_SLURM_queue_files(times, inputs=None, debug=False, run_dir='.'):
     """
-    Create the script that can set the 1st scheduled job running
+    Create the queue files for a SLURM managed queue (e.g. York's viking HPC)
 
     Parameters
     -------
-    time (str): string time to run job script for in the format YYYYMMDD
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    times (list): list of string times in the format YYYYMMDD
+    debug (bool): Print debugging output to the screen
+    run_dir (str): GEOS-Chem run directory to create the queue files in
 
     Returns
     -------
     (None)
     """
-    FileName = 'run_geos_SLURM.sh'
-    run_script = open(FileName, 'w')
-    run_script_string = ("""
+    create_queue_files(times, inputs=inputs, debug=debug, run_dir=run_dir,
+                       scheduler='SLURM')
+    return
+
+
+def create_SLURM_array_queue_files(times, inputs=None, debug=False,
+                                   run_dir='.'):
+    """
+    Create a single SLURM job array script and chunk table for all the chunks
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    times (list): list of string times in the format YYYYMMDD
+    debug (bool): Print debugging output to the screen
+    run_dir (str): GEOS-Chem run directory to create the queue files in
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Each array task reads its start and end dates from the chunk table
+     (SLURM_queue_files/chunk_table.txt) using SLURM_ARRAY_TASK_ID, so only two
+     files are written and one sbatch call is needed however many chunks
+    """
+    # Create folder queue files
+    _dir = os.path.join(run_dir, "SLURM_queue_files")
+    if not os.path.exists(_dir):
+        os.makedirs(_dir)
+
+    # Write the chunk table - one line of "index start_time end_time" per chunk
+    chunk_table_file = "SLURM_queue_files/chunk_table.txt"
+    chunk_table_location = os.path.join(run_dir, chunk_table_file)
+    chunk_lines = ["{} {} {}\n".format(n_time, start_time, end_time)
+                   for n_time, (start_time, end_time)
+                   in enumerate(zip(times[:-1], times[1:]))]
+    with open(chunk_table_location, 'w') as chunk_table:
+        chunk_table.writelines(chunk_lines)
+
+    # Only the array as a whole sends an email
+    variables = get_queue_file_variables(inputs)
+    # All tasks share a wall time, so size it for the longest chunk
+    if inputs.predict_resources:
+        resources = predict_chunk_resources(times, run_dir=run_dir,
+                                            inputs=inputs)
+        if resources:
+            variables.update(max(
+                resources.values(),
+                key=lambda i: wall_time_to_seconds(i['wall_time'])))
+    # Pick the array's partition from the load of the cluster if requested
+    if inputs.auto_placement:
+        variables['queue_name'] = place_chunks(
+            times[:1] + times[-1:], {times[0]: {
+                'wall_time': variables['wall_time']}},
+            inputs=inputs)[times[0]]['queue_name']
+    variables['job_name'] = inputs.job_name[:14]
+    variables['send_email'] = inputs.send_email
+    # Task IDs must be below MaxArraySize, so longer runs are split
+    variables['last_task_id'] = min(len(chunk_lines),
+                                    int(inputs.max_array_size))-1
+    variables['chunk_table'] = chunk_table_file
+    # Each task's restart file is named from its start time at run time
+    variables['restart_file'] = inputs.restart_file_template.format(
+        date="${start_time}")
+    if inputs.stage_to_scratch:
+        variables['stage_script'] = os.path.join(
+            "SLURM_queue_files", write_scratch_staging_script(_dir))
+    # Each task submits the job that warms the next chunk's inputs
+    variables['prefetch_next'] = inputs.prefetch_inputs
+    if inputs.prefetch_inputs:
+        create_prefetch_files(times, inputs=inputs, run_dir=run_dir,
+                              scheduler='SLURM')
+    if inputs.postprocess_command:
+        create_postprocess_files(times, inputs=inputs, run_dir=run_dir,
+                                 scheduler='SLURM')
+    queue_file_string = load_template(
+        'SLURM_array_queue_script_template').render(variables)
+
+    # Write the queue file to disk
+    queue_file_location = os.path.join(_dir, "array.sbatch")
+    if debug:
+        print('queue_file_location: {}'.format(queue_file_location))
+        print('n_chunks: {}'.format(len(chunk_lines)))
+    with open(queue_file_location, 'w') as queue_file:
+        queue_file.write(queue_file_string)
+    # Change the permissions so it is executable
+    st = os.stat(queue_file_location)
+    os.chmod(queue_file_location, st.st_mode | stat.S_IEXEC)
+    return
+
+
+def create_PBS_run_script(time, run_dir='.', dependency=None,
+                          begin_option=''):
+    """
+    Create the script that can set the 1st scheduled job running
+
+    Parameters
+    -------
+    time (str): string time to run job script for in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory to create the run script in
+    dependency (str): ID of a job that must complete before the 1st job
+    begin_option (str): Option to start the job out of hours (or '')
+
+    Returns
+    -------
+    (None)
+    """
+    FileName = os.path.join(run_dir, 'run_geos_PBS.sh')
+    run_script = open(FileName, 'w')
+    run_script_string = ("""
 #!/bin/bash
-job_number=$(sbatch SLURM_queue_files/{time}.sbatch)
+job_number=$(qsub {begin_option}{dependency_string}PBS_queue_files/{time}.pbs)
 echo "$job_number"
+echo "$job_number {time}" >> submitted_jobs.txt
      """)
-    run_script.write(run_script_string.format(time=time))
+    dependency_string = ''
+    if dependency:
+        dependency_string = '-W depend=afterok:{} '.format(dependency)
+    run_script.write(run_script_string.format(
+        time=time, dependency_string=dependency_string,
+        begin_option=begin_option))
     run_script.close()
     # Change the permissions so it is executable
     st = os.stat(FileName)
@@ -1030,34 +1924,88 @@ echo "$job_number"
     return
 
 
-def create_SLURM_run_script2submit_together(times):
+def create_SLURM_run_script(time, run_dir='.', dependency=None,
+                            begin_option=''):
     """
     Create the script that can set the 1st scheduled job running
 
     Parameters
     -------
     time (str): string time to run job script for in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory to create the run script in
+    dependency (str): ID of a job that must complete before the 1st job
+    begin_option (str): Option to start the job out of hours (or '')
 
     Returns
     -------
     (None)
     """
-    print(times)
-    FileName = 'run_geos_SLURM_queue_all_jobs.sh'
+    FileName = os.path.join(run_dir, 'run_geos_SLURM.sh')
+    run_script = open(FileName, 'w')
+    run_script_string = ("""
+#!/bin/bash
+job_number=$(sbatch --parsable {begin_option}{dependency_string}SLURM_queue_files/{time}.sbatch)
+echo "$job_number"
+echo "$job_number {time}" >> submitted_jobs.txt
+     """)
+    dependency_string = ''
+    if dependency:
+        dependency_string = '--dependency=afterok:{} '.format(dependency)
+    run_script.write(run_script_string.format(
+        time=time, dependency_string=dependency_string,
+        begin_option=begin_option))
+    run_script.close()
+    # Change the permissions so it is executable
+    st = os.stat(FileName)
+    os.chmod(FileName, st.st_mode | stat.S_IEXEC)
+    return
+
+
+def create_SLURM_run_script2submit_together(times, run_dir='.', debug=False,
+                                            dependency=None, prefetch=False):
+    """
+    Create the script that submits all the jobs, each dependent on the last
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory to create the run script in
+    debug (bool): Print debugging output to the screen
+    dependency (str): ID of a job that must complete before the 1st job
+    prefetch (bool): Also submit the prefetch jobs, each starting with the
+    chunk before its own
+
+    Returns
+    -------
+    (None)
+    """
+    if debug:
+        print(times)
+    FileName = os.path.join(run_dir, 'run_geos_SLURM_queue_all_jobs.sh')
     run_script = open(FileName, 'w')
     Line0 = "#!/bin/bash \n"
     Line1 = """job_num_{time}=$(sbatch --parsable SLURM_queue_files/{time}.sbatch) \n"""
     Line2 = """echo "$job_num_{time}" \n"""
+    # Record the jobs submitted (see monitor.py)
+    Line5 = """echo "$job_num_{time} {time}" >> submitted_jobs.txt \n"""
     Line3 = """job_num_{time2}=$(sbatch --parsable --dependency=afterok:"$job_num_{time1}" SLURM_queue_files/{time2}.sbatch) \n"""
+    Line4 = """sbatch --parsable --dependency=after:"$job_num_{time1}" SLURM_queue_files/{time2}.prefetch.sbatch \n"""
+    if dependency:
+        Line1 = """job_num_{time}=$(sbatch --parsable --dependency=afterok:{dependency} SLURM_queue_files/{time}.sbatch) \n"""
     for n_time, time in enumerate(times[:-1]):
         #
         if time == times[0]:
             run_script.write(Line0)
-            run_script.write(Line1.format(time=time))
+            run_script.write(Line1.format(time=time, dependency=dependency))
             run_script.write(Line2.format(time=time))
+            run_script.write(Line5.format(time=time))
         else:
             run_script.write(Line3.format(time1=times[n_time-1], time2=time))
             run_script.write(Line2.format(time=time))
+            run_script.write(Line5.format(time=time))
+            if prefetch:
+                run_script.write(Line4.format(time1=times[n_time-1],
+                                              time2=time))
     run_script.close()
     # Change the permissions so it is executable
     st = os.stat(FileName)
@@ -1065,21 +2013,849 @@ def create_SLURM_run_script2submit_together(times):
     return
 
 
-def run_job_script(run_script, filename="run_geos_SLURM.sh"):
+def create_SLURM_array_run_script(times, run_dir='.', max_array_size=1001):
+    """
+    Create the script that submits the SLURM job array of all the chunks
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory to create the run script in
+    max_array_size (int): SLURM's MaxArraySize
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - If there are more chunks than max_array_size, they are submitted as
+     several arrays, each depending on the one before (afterok)
+    """
+    FileName = os.path.join(run_dir, 'run_geos_SLURM_array.sh')
+    run_script = open(FileName, 'w')
+    Line0 = "#!/bin/bash\n"
+    Line1 = """job_number=$(sbatch --parsable {dependency_string}--array=0-{last_task_id}%1 SLURM_queue_files/array.sbatch {first_chunk_id})\n"""
+    Line2 = """echo "$job_number"\n"""
+    # Record the array task of each chunk (see monitor.py)
+    Line3 = """awk -v job="$job_number" -v first={first_chunk_id} -v last={last_chunk_id} '$1 >= first && $1 <= last {{ print job "_" ($1 - first), $2 }}' SLURM_queue_files/chunk_table.txt >> submitted_jobs.txt\n"""
+    run_script.write(Line0)
+    n_chunks = len(times)-1
+    max_array_size = int(max_array_size)
+    for first_chunk_id in range(0, n_chunks, max_array_size):
+        last_chunk_id = min(first_chunk_id+max_array_size, n_chunks)-1
+        dependency_string = ''
+        if first_chunk_id > 0:
+            dependency_string = '--dependency=afterok:"$job_number" '
+        run_script.write(Line1.format(
+            dependency_string=dependency_string,
+            last_task_id=last_chunk_id-first_chunk_id,
+            first_chunk_id=first_chunk_id))
+        run_script.write(Line2)
+        run_script.write(Line3.format(first_chunk_id=first_chunk_id,
+                                      last_chunk_id=last_chunk_id))
+    run_script.close()
+    # Change the permissions so it is executable
+    st = os.stat(FileName)
+    os.chmod(FileName, st.st_mode | stat.S_IEXEC)
+    return
+
+
+def create_local_run_script(times, run_dir='.'):
+    """
+    Create the script that runs the chunks on this machine (scheduler "local")
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory to create the run script in
+
+    Returns
+    -------
+    (None)
+    """
+    # The local executor reads the chunks to run from a list
+    write_local_chunk_list(times, run_dir=run_dir)
+    executor = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'local_executor.py')
+    FileName = os.path.join(run_dir, 'run_geos_local.sh')
+    run_script = open(FileName, 'w')
+    run_script_string = ("""#!/bin/bash
+"{python}" "{executor}" .
+""").format(python=sys.executable, executor=executor)
+    run_script.write(run_script_string)
+    run_script.close()
+    # Change the permissions so it is executable
+    st = os.stat(FileName)
+    os.chmod(FileName, st.st_mode | stat.S_IEXEC)
+    return
+
+
+def get_local_run_error(results):
+    """
+    Get the error (for the summary) of the first local chunk that failed
+    """
+    for result in results:
+        if result['exit_code'] != 0:
+            return "Chunk {} failed with exit code {} (see {})".format(
+                result['start_time'], result['exit_code'],
+                result['log_file'])
+    return None
+
+
+def run_job_script(run_script, filename="run_geos_SLURM.sh", run_dir='.'):
     """
     Call the scheduler run script with a subprocess command
+
+    Parameters
+    -------
+    run_script (bool): Run the script (if False, nothing is done)
+    filename (str): Name of the run script within the run directory
+    run_dir (str): GEOS-Chem run directory to run the script from
+
+    Returns
+    -------
+    (None)
     """
     if run_script:
-        subprocess.call(["bash", filename])
+        subprocess.call(["bash", filename], cwd=run_dir)
     return
 
 
-def run_completion_script():
+def schedule_run_directory(run_dir='.', inputs=None, debug=False,
+                           verbose=True, feed=True):
     """
-    Run a script when the final job finishes
+    Create the input files and queue scripts for a run directory (and submit)
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory to schedule
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    debug (bool): Print debugging output to the screen
+    verbose (bool): Print the start and end dates to the screen
+    feed (bool): Run the feeder once the chunks are added to its queue (if
+    using the feeder)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary summarises the run directory scheduled
+    """
+    # Check the start and end dates are compatible with the script
+    start_date, end_date = get_start_and_end_dates(run_dir=run_dir,
+                                                   verbose=verbose)
+
+    # Calculate the list of times to run the model for
+    times = list_of_times_to_run(start_date, end_date, inputs,
+                                 run_dir=run_dir)
+    # Keep the planned chunks so a resumed run uses the same ones
+    if inputs.step == 'auto':
+        save_chunk_plan(times, run_dir=run_dir)
+
+    # Add any finished chunks of this run to the history to size chunks from
+    if inputs.predict_resources:
+        collect_run_directory_history(times, run_dir=run_dir, inputs=inputs)
+
+    # Only schedule the chunks still to run if resuming
+    dependency = None
+    if inputs.resume:
+        times, dependency = get_times_to_resume_run_directory(
+            times, run_dir=run_dir, inputs=inputs, verbose=verbose)
+        if len(times) < 2:
+            return {
+                'run_dir': run_dir,
+                'start_date': start_date,
+                'end_date': end_date,
+                'n_chunks': 0,
+                'times': [],
+                'dependency': dependency,
+                'run_script': None,
+                'submitted': False,
+                'error': None,
+            }
+
+    # Make sure the input data exists before anything is submitted
+    if inputs.check_input_files:
+        check_input_files_available(times, run_dir=run_dir, inputs=inputs)
+
+    # Make a backup of the input.geos file
+    backup_the_input_files(inputs=inputs, run_dir=run_dir)
+
+    # Create the individual time input files
+    create_the_input_files(times, inputs=inputs, run_dir=run_dir)
+
+    # Create the files required by the specific scheduler
+    if inputs.scheduler == 'PBS':
+        # Create the PBS queue files
+        create_PBS_queue_files(times, inputs=inputs, debug=debug,
+                               run_dir=run_dir)
+        # Create the PSB run script
+        create_PBS_run_script(times[0], run_dir=run_dir,
+                              dependency=dependency,
+                              begin_option=get_queue_begin_option(inputs))
+        filename = "run_geos_PBS.sh"
+    elif (inputs.scheduler == 'SLURM') and (inputs.feeder):
+        # Create the SLURM queue files
+        create_SLURM_queue_files(times, inputs=inputs, debug=debug,
+                                 run_dir=run_dir)
+        # Add the chunks to the feeder's queue (submitted by run_feeder)
+        if inputs.run_script:
+            add_feeder_chunks(inputs.feeder_state_file, run_dir, times,
+                              dependency=dependency,
+                              begin_option=get_queue_begin_option(inputs))
+        filename = inputs.feeder_state_file
+    elif (inputs.scheduler == 'SLURM') and (inputs.use_job_array):
+        # Create the single SLURM job array script and its chunk table
+        create_SLURM_array_queue_files(times, inputs=inputs, debug=debug,
+                                       run_dir=run_dir)
+        # Create the SLURM run script
+        create_SLURM_array_run_script(times, run_dir=run_dir,
+                                      max_array_size=inputs.max_array_size)
+        filename = "run_geos_SLURM_array.sh"
+    elif (inputs.scheduler == 'SLURM') and (not inputs.submit_jobs_together):
+        # Create the SLURM queue files
+        create_SLURM_queue_files(times, inputs=inputs, debug=debug,
+                                 run_dir=run_dir)
+        # Create the SLURM run script
+        create_SLURM_run_script(times[0], run_dir=run_dir,
+                                dependency=dependency,
+                                begin_option=get_queue_begin_option(inputs))
+        filename = "run_geos_SLURM.sh"
+    elif (inputs.scheduler == 'SLURM') and (inputs.submit_jobs_together):
+        # Create the SLURM queue files
+        create_SLURM_queue_files(times, inputs=inputs, debug=debug,
+                                 run_dir=run_dir)
+        # Create the SLURM run script
+        create_SLURM_run_script2submit_together(
+            times, run_dir=run_dir, debug=debug, dependency=dependency,
+            prefetch=inputs.prefetch_inputs)
+        filename = "run_geos_SLURM_queue_all_jobs.sh"
+    elif inputs.scheduler == 'local':
+        # Create the scripts for each chunk
+        create_queue_files(times, inputs=inputs, debug=debug,
+                           run_dir=run_dir, scheduler='local')
+        # Create the local run script
+        create_local_run_script(times, run_dir=run_dir)
+        filename = "run_geos_local.sh"
+
+    # Record the run and its chunks in the campaign registry
+    if inputs.registry:
+        settings = SCHEDULER_QUEUE_FILES[inputs.scheduler]
+        register_run_directory(times, run_dir=run_dir, inputs=inputs,
+                               queue_dir=settings['queue_dir'],
+                               extension=settings['extension'])
+
+    # Run the chunks here if using the local "scheduler"
+    error = None
+    if (inputs.scheduler == 'local') and inputs.run_script:
+        results = run_local_chains([run_dir])
+        if verbose:
+            print_local_summary(results)
+        error = get_local_run_error(results)
+    # Or feed the chunks to the queue as slots free up
+    elif inputs.feeder and inputs.run_script and feed:
+        run_feeder(inputs.feeder_state_file, inputs=inputs, verbose=verbose)
+    # Otherwise send the script to the queue if requested
+    elif not inputs.feeder:
+        run_job_script(inputs.run_script, filename=filename, run_dir=run_dir)
+
+    return {
+        'run_dir': run_dir,
+        'start_date': start_date,
+        'end_date': end_date,
+        'n_chunks': len(times)-1,
+        'times': times,
+        'dependency': dependency,
+        'run_script': filename,
+        'submitted': inputs.run_script,
+        'error': error,
+    }
+
+
+def get_times_to_resume_run_directory(times, run_dir='.', inputs=None,
+                                      queue_output=None, verbose=True):
+    """
+    Get the times of the chunks of a run directory that still need submitting
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    queue_output (str): Output of the queue status command (default: run it)
+    verbose (bool): Print the chunks found to the screen
+
+    Returns
+    -------
+    (tuple)
 
     Notes
     -------
-     - For example, this could be a clean up script or a post-processing script
+     - Returned tuple is the list of times to run and the ID of a queued job
+     the first of these should depend on (or None)
+     - If the chunks call the next one themselves and one is queued, the chain
+     will continue by itself, so there is nothing to submit
     """
+    completed = get_completed_chunks(times, run_dir=run_dir, inputs=inputs)
+    queued = get_queued_chunks(times, run_dir=run_dir, inputs=inputs,
+                               queue_output=queue_output)
+    times_to_resume, dependency = get_times_to_resume(times, completed,
+                                                      queued)
+    if verbose:
+        print("Completed chunks: {}".format(len(completed)))
+        print("Queued or running chunks: {}".format(len(queued)))
+        print("Chunks to submit: {}".format(len(times_to_resume)-1))
+    self_chaining = (inputs.scheduler == 'PBS') or \
+        (not inputs.submit_jobs_together and not inputs.use_job_array)
+    if dependency and self_chaining:
+        return times_to_resume[:1], None
+    return times_to_resume, dependency
+
+
+def monitor_run_directories(run_dirs, inputs=None, verbose=True):
+    """
+    Show the state of the jobs of run directories (--status and --watch)
+
+    Parameters
+    -------
+    run_dirs (list or str): Run directories and/or glob patterns to monitor
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    verbose (bool): Print the state of the chunks after each poll
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - All the jobs are polled together, see monitor.py
+    """
+    run_chunks = {run_dir: get_scheduled_chunks(run_dir)
+                  for run_dir in get_batch_run_dirs(run_dirs)}
+    return run_monitor(run_chunks, scheduler=inputs.scheduler,
+                       command=inputs.monitor_command,
+                       interval=float(inputs.monitor_interval),
+                       max_interval=float(inputs.monitor_max_interval),
+                       once=(inputs.monitor == 'status'), verbose=verbose)
+
+
+def analyse_run_directories_logs(run_dirs, inputs=None, verbose=True):
+    """
+    Report the throughput of the chunks of run directories from their logs
+
+    Parameters
+    -------
+    run_dirs (list or str): Run directories and/or glob patterns to analyse
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    verbose (bool): Print the throughput of each chunk
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - The run directories are one campaign, so regressions are flagged
+     against all of their chunks
+     - Chunks timed from their logs are added to the history store
+    """
+    chunks = []
+    for run_dir in get_batch_run_dirs(run_dirs):
+        run_chunks = analyse_run_directory_logs(run_dir, inputs=inputs)
+        record_log_history(run_chunks, run_dir=run_dir, inputs=inputs)
+        chunks += run_chunks
+    chunks = flag_regressions(chunks,
+                              threshold=float(inputs.regression_threshold))
+    if verbose:
+        print_log_analysis(chunks)
+    return chunks
+
+
+def schedule_segments(run_dir='.', inputs=None, debug=False):
+    """
+    Split a run into segments that run at the same time, and schedule them
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory to split
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the summary of each segment (see
+     schedule_run_directories)
+     - Each segment is scheduled as a run directory of its own (in
+     segments/<start>/), so all the segments are submitted together
+     - The segments' output is joined with --stitch-segments once they finish
+    """
+    start_date, end_date = get_start_and_end_dates(run_dir=run_dir)
+    segments = create_segment_directories(
+        start_date, end_date, int(inputs.segments),
+        STEP_DELTAS[inputs.segment_spinup], run_dir=run_dir,
+        restart_file=inputs.segment_restart_file,
+        restart_file_template=inputs.restart_file_template)
+    segment_inputs = copy.deepcopy(inputs)
+    segment_inputs.segments = 1
+    results = schedule_run_directories(
+        [i['segment_dir'] for i in segments], inputs=segment_inputs,
+        processes=inputs.batch_processes, debug=debug)
+    print_batch_summary(results)
+    return results
+
+
+def edit_member_input_files(member_dir, edits, debug=False):
+    """
+    Edit the input.geos and HEMCO_Config.rc of a member of an ensemble
+
+    Parameters
+    -------
+    member_dir (str): Run directory of the member
+    edits (dict): Edits of the member (see clone.get_clone_members)
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - input.geos is edited with InputGeos (as create_new_input_file) and
+     the years in HEMCO_Config.rc with create_new_HEMCO_input_file
+    """
+    input_geos_edits = dict(edits.get('input.geos') or {})
+    if input_geos_edits:
+        filename = os.path.join(member_dir, 'input.geos')
+        input_geos = InputGeos.from_file(filename)
+        lines = list(input_geos.lines)
+        if 'start_date' in input_geos_edits:
+            input_geos.set_date(lines, input_geos.start_index,
+                                input_geos_edits.pop('start_date'))
+        if 'end_date' in input_geos_edits:
+            input_geos.set_date(lines, input_geos.end_index,
+                                input_geos_edits.pop('end_date'))
+        for label, value in input_geos_edits.items():
+            input_geos.set_setting(lines, label, value)
+        with open(filename, 'w') as input_file:
+            input_file.writelines(lines)
+    hemco_edits = dict(edits.get('HEMCO_Config.rc') or {})
+    if hemco_edits:
+        filename = os.path.join(member_dir, 'HEMCO_Config.rc')
+        with open(filename, 'r') as input_file:
+            lines = input_file.readlines()
+        years = {}
+        for name in ('EmisYear', 'MetYear'):
+            if name in hemco_edits:
+                years[name] = hemco_edits.pop(name)
+        if years:
+            # Keep the year that is not edited
+            settings = HEMCOConfig(lines).settings
+            years.setdefault('EmisYear', settings.get(
+                'EmisYear', settings.get('Emission year')))
+            years.setdefault('MetYear', settings.get('MetYear'))
+            lines = create_new_HEMCO_input_file(lines, debug=debug, **years)
+        if hemco_edits:
+            lines = set_HEMCO_settings(lines, hemco_edits)
+        with open(filename, 'w') as input_file:
+            input_file.writelines(lines)
+    return
+
+
+def simulate_chunking_strategies(run_dir='.', inputs=None, steps=None,
+                                 n_chains=1, accounting_output=None,
+                                 verbose=True):
+    """
+    Simulate a run with each step (chunking strategy) to compare them
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory to simulate
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    steps (str or list): Steps to compare (default: inputs.simulate)
+    n_chains (int): Number of run directories like this run at the same time
+    accounting_output (str): Output of the queue wait command (default:
+    inputs.simulation_accounting_file, or run it)
+    verbose (bool): Print the summary to the screen
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the summary of each step (see
+     simulate.simulate_strategy)
+     - The chunks of each step are planned with list_of_times_to_run, and
+     run at the throughput used to plan "auto" chunks
+    """
+    if steps is None:
+        steps = inputs.simulate
+    if isinstance(steps, str):
+        steps = [i.strip() for i in steps.split(',')]
+    simulated_days_per_hour = get_simulated_days_per_hour(run_dir=run_dir,
+                                                          inputs=inputs)
+    AssStr = "No throughput to simulate with, set simulated_days_per_hour in settings.json"
+    assert simulated_days_per_hour, AssStr
+    if inputs.simulation_queue_wait is not None:
+        mean_wait = float(inputs.simulation_queue_wait) * 3600.
+        def queue_wait(rng):
+            return rng.expovariate(1. / mean_wait) if mean_wait else 0.
+    else:
+        if (accounting_output is None) and inputs.simulation_accounting_file:
+            with open(inputs.simulation_accounting_file, 'r') as accounting:
+                accounting_output = accounting.read()
+        waits = get_queue_waits(inputs=inputs,
+                                accounting_output=accounting_output)
+        AssStr = "No past queue waits found, set simulation_queue_wait"
+        assert waits, AssStr
+        def queue_wait(rng):
+            return rng.choice(waits)
+    start_date, end_date = get_start_and_end_dates(run_dir=run_dir,
+                                                   verbose=False)
+    summaries = {}
+    for step in steps:
+        step_inputs = copy.deepcopy(inputs)
+        step_inputs.step = step
+        times = list_of_times_to_run(start_date, end_date, step_inputs,
+                                     run_dir=run_dir)
+        summaries[step] = simulate_strategy(
+            times, simulated_days_per_hour, queue_wait, inputs=inputs,
+            n_chains=n_chains)
+    if verbose:
+        print_simulation_summary(summaries)
+    return summaries
+
+
+def clone_run_directories(template_dir='.', clone=None, inputs=None,
+                          debug=False):
+    """
+    Clone a run directory into the members of an ensemble, and schedule them
+
+    Parameters
+    -------
+    template_dir (str): GEOS-Chem run directory to clone
+    clone (str): Number of members, or a JSON file of the members' edits
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the summary of each member (see
+     schedule_run_directories)
+     - The members are created in inputs.clone_dir, sharing the template's
+     large files (see clone.py), and scheduled as a batch with their
+     "settings" as overrides
+    """
+    members = get_clone_members(clone, template_dir=template_dir)
+    member_dirs = []
+    overrides = {}
+    template_start, _ = get_start_and_end_dates(run_dir=template_dir,
+                                                verbose=False)
+    for name, edits in members.items():
+        member_dir = os.path.join(inputs.clone_dir, name)
+        start_time = (edits.get('input.geos') or {}).get('start_date',
+                                                         template_start)
+        counts = clone_run_directory(
+            template_dir, member_dir,
+            restart_file_template=inputs.restart_file_template,
+            start_time=start_time)
+        if debug:
+            print("Cloned {}: {}".format(member_dir, counts))
+        edit_member_input_files(member_dir, edits, debug=debug)
+        member_dirs.append(member_dir)
+        if edits.get('settings'):
+            overrides[member_dir] = edits['settings']
+    clone_inputs = copy.deepcopy(inputs)
+    clone_inputs.clone = None
+    results = schedule_run_directories(member_dirs, inputs=clone_inputs,
+                                       overrides=overrides,
+                                       processes=inputs.batch_processes,
+                                       debug=debug)
+    print_batch_summary(results)
+    return results
+
+
+def schedule_campaign_dag(spinup_dir, run_dirs, inputs=None, overrides=None,
+                          processes=None, debug=False):
+    """
+    Schedule a spin-up and the run directories that start from it as a graph
+
+    Parameters
+    -------
+    spinup_dir (str): GEOS-Chem run directory of the spin-up
+    run_dirs (list or str): Run directories (branches) and/or glob patterns
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    overrides (dict or str): Settings per run directory (or a JSON file)
+    processes (int): Number of processes to use (default: number of CPUs)
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the summary of the spin-up and each branch (see
+     schedule_run_directories)
+     - Each branch must start at the end of the spin-up. Its initial restart
+     is linked to the spin-up's final restart, and its 1st chunk depends on
+     the spin-up's last chunk
+     - When resuming, chunks already completed or queued are left out of the
+     graph, and the 1st chunk left of each run depends on its queued chunk
+     - The graph is submitted in one pass by run_geos_dag.sh, so the spin-up
+     is only run once and every branch starts as soon as it finishes
+    """
+    spinup_dir = os.path.realpath(spinup_dir)
+    branch_dirs = [i for i in get_batch_run_dirs(run_dirs)
+                   if os.path.realpath(i) != spinup_dir]
+    plan_inputs = copy.deepcopy(inputs)
+    plan_inputs.run_script_string = "no"
+    results = schedule_run_directories([spinup_dir] + branch_dirs,
+                                       inputs=plan_inputs,
+                                       overrides=overrides,
+                                       processes=processes, debug=debug)
+    if any(i['error'] for i in results):
+        print("Not submitting the graph, as not every run directory could "
+              "be scheduled")
+        return results
+    spinup = results[0]
+    spinup_restart = os.path.join(spinup_dir, inputs.restart_file_template
+                                  .format(date=spinup['end_date']))
+    branches = {}
+    dependencies = {spinup_dir: spinup['dependency']}
+    for result in results[1:]:
+        AssStr = "The branch {} starts on {}, not at the end of the spin-up ({})"
+        assert result['start_date'] == spinup['end_date'], AssStr.format(
+            result['run_dir'], result['start_date'], spinup['end_date'])
+        # A branch resumed after its 1st chunk has already used the restart
+        if result['times'][:1] == [result['start_date']]:
+            link_restart_handoff(spinup_restart, result['run_dir'],
+                                 result['start_date'],
+                                 inputs.restart_file_template)
+        branches[result['run_dir']] = result['times']
+        dependencies[result['run_dir']] = result['dependency']
+    filename = "run_geos_dag.sh"
+    write_dag_run_script(
+        plan_campaign_dag(spinup_dir, spinup['times'], branches,
+                          dependencies=dependencies),
+        filename=filename, prefetch=inputs.prefetch_inputs)
+    run_job_script(inputs.run_script, filename=filename)
+    for result in results:
+        result['run_script'] = filename
+        result['submitted'] = inputs.run_script
+    return results
+
+
+def get_batch_run_dirs(batch_run_dirs):
+    """
+    Expand a list, glob or comma separated string into GEOS-Chem run directories
+
+    Parameters
+    -------
+    batch_run_dirs (list or str): Run directories and/or glob patterns
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Only directories containing an input.geos file are returned
+    """
+    if isinstance(batch_run_dirs, str):
+        batch_run_dirs = batch_run_dirs.split(',')
+    run_dirs = []
+    for pattern in batch_run_dirs:
+        pattern = os.path.expanduser(pattern.strip())
+        for run_dir in sorted(glob.glob(pattern)):
+            run_dir = os.path.normpath(run_dir)
+            input_geos = os.path.join(run_dir, 'input.geos')
+            if os.path.isfile(input_geos) and (run_dir not in run_dirs):
+                run_dirs.append(run_dir)
+    return run_dirs
+
+
+def get_batch_overrides(batch_overrides, run_dir):
+    """
+    Get the settings to override for a run directory in a batch
+
+    Parameters
+    -------
+    batch_overrides (dict or str): Settings per run directory (or a JSON file)
+    run_dir (str): GEOS-Chem run directory to get the settings for
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Run directories can be given by their path or just their name
+    """
+    if not batch_overrides:
+        return {}
+    if isinstance(batch_overrides, str):
+        with open(batch_overrides, 'r') as overrides_file:
+            batch_overrides = json.load(overrides_file)
+    for key in (os.path.normpath(run_dir), os.path.abspath(run_dir),
+                os.path.basename(os.path.normpath(run_dir))):
+        for name, overrides in batch_overrides.items():
+            if os.path.normpath(os.path.expanduser(name)) == key:
+                return overrides
+    return {}
+
+
+def schedule_batch_member(run_dir, inputs, overrides=None, debug=False):
+    """
+    Schedule a single run directory of a batch (used by the process pool)
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory to schedule
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    overrides (dict): Settings to override for this run directory
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (dict)
+    """
+    inputs = copy.deepcopy(inputs)
+    inputs.update(overrides or {})
+    try:
+        inputs = check_inputs(inputs, debug=debug)
+        return schedule_run_directory(run_dir, inputs=inputs, debug=debug,
+                                      verbose=False, feed=False)
+    except Exception as error:
+        return {
+            'run_dir': run_dir,
+            'start_date': None,
+            'end_date': None,
+            'n_chunks': 0,
+            'times': [],
+            'dependency': None,
+            'run_script': None,
+            'submitted': False,
+            'error': '{}: {}'.format(type(error).__name__, error),
+        }
+
+
+def schedule_run_directories(run_dirs, inputs=None, overrides=None,
+                             processes=None, debug=False):
+    """
+    Schedule many run directories in parallel on a process pool
+
+    Parameters
+    -------
+    run_dirs (list or str): Run directories and/or glob patterns to schedule
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    overrides (dict or str): Settings per run directory (or a JSON file)
+    processes (int): Number of processes to use (default: number of CPUs)
+    debug (bool): Print debugging output to the screen
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - settings.json is only read once (for inputs) and shared by all the run
+     directories, with any per run directory overrides applied on top
+     - A failure in one run directory does not stop the rest of the batch
+     - With scheduler "local", the chunks are run once every run directory is
+     scheduled, with the chains of all the run directories sharing one pool
+     - With the feeder, the chunks of all the run directories are fed to the
+     queue once every run directory is scheduled
+    """
+    run_dirs = get_batch_run_dirs(run_dirs)
+    run_locally = (inputs.scheduler == 'local') and inputs.run_script
+    if run_locally:
+        inputs = copy.deepcopy(inputs)
+        inputs.run_script_string = "no"
+    if isinstance(overrides, str):
+        with open(overrides, 'r') as overrides_file:
+            overrides = json.load(overrides_file)
+    tasks = [(run_dir, inputs, get_batch_overrides(overrides, run_dir), debug)
+             for run_dir in run_dirs]
+    if not tasks:
+        return []
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(schedule_batch_member, tasks)
+    if run_locally:
+        run_local_batch(results, inputs)
+    if inputs.feeder and inputs.run_script:
+        run_feeder(inputs.feeder_state_file, inputs=inputs)
+    return results
+
+
+def run_local_batch(results, inputs):
+    """
+    Run the chunks of the run directories of a batch on this machine
+
+    Parameters
+    -------
+    results (list): Dictionaries returned by schedule_batch_member
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - The summaries of the run directories are updated with the outcome
+    """
+    run_dirs = [i['run_dir'] for i in results if not i['error']]
+    processes = inputs.local_processes
+    if not processes:
+        processes = get_local_processes(inputs.cpus_need)
+    local_results = run_local_chains(run_dirs, processes=processes)
+    print_local_summary(local_results)
+    for result in results:
+        if result['run_dir'] in run_dirs:
+            result['submitted'] = True
+            result['error'] = get_local_run_error(
+                [i for i in local_results if i['run_dir'] == result['run_dir']])
+    return
+
+
+def print_batch_summary(results):
+    """
+    Print a single summary of the run directories scheduled in a batch
+
+    Parameters
+    -------
+    results (list): Dictionaries returned by schedule_run_directories
+
+    Returns
+    -------
+    (None)
+    """
+    n_failed = len([i for i in results if i['error']])
+    print("Scheduled {} of {} run directories ({} failed)".format(
+        len(results)-n_failed, len(results), n_failed))
+    PrtStr = "{:<40} {:>8} {:>8} {:>6}  {}"
+    print(PrtStr.format('run_dir', 'start', 'end', 'chunks', 'status'))
+    for result in results:
+        if result['error']:
+            status = 'FAILED - {}'.format(result['error'])
+        elif result['submitted']:
+            status = 'submitted ({})'.format(result['run_script'])
+        else:
+            status = 'created {}'.format(result['run_script'])
+        print(PrtStr.format(result['run_dir'], str(result['start_date']),
+                            str(result['end_date']), result['n_chunks'],
+                            status))
     return
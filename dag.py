@@ -0,0 +1,221 @@
+"""
+Graphs of dependent chunks across run directories for geos-chem-schedule
+
+Notes
+-------
+ - Nodes are chunks (from any run directory) and edges are restart hand-offs:
+ a chunk only starts once every chunk it has an edge from has completed
+ (--dependency=afterok)
+ - The usual campaign is one spin-up run followed by many ensemble members
+ (branches) that all start from the spin-up's final restart, so the spin-up
+ is only run once and every branch starts as soon as it finishes
+ - The whole graph is submitted in one pass by a single script, in
+ topological order, so each job's dependencies are already submitted
+"""
+import os
+import stat
+
+from monitor import SUBMITTED_JOBS_FILE
+from feeder import PREFETCH_EXTENSION
+
+
+def add_chain(dag, run_dir, times, queue_dir='SLURM_queue_files',
+              extension='.sbatch', dependency=None):
+    """
+    Add the chunks of a run directory to a graph, each after the one before
+
+    Parameters
+    -------
+    dag (dict): Graph of "nodes" (by ID) and "edges" (parent, child)
+    run_dir (str): GEOS-Chem run directory of the chunks
+    times (list): list of string times in the format YYYYMMDD
+    queue_dir (str): Directory of the queue files within the run directory
+    extension (str): Extension of the queue files
+    dependency (str): ID of a job outside the graph that must complete
+    before the 1st chunk (e.g. a chunk already queued when resuming)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the IDs of the nodes added, in order
+     - Each node's "dependencies" are the jobs outside the graph it waits for
+    """
+    node_ids = []
+    for start_time in times[:-1]:
+        node_id = 'n{}'.format(len(dag['nodes']))
+        dag['nodes'][node_id] = {
+            'run_dir': os.path.realpath(run_dir),
+            'start_time': start_time,
+            'queue_file': os.path.join(queue_dir, start_time + extension),
+            'dependencies': [dependency] if dependency and not node_ids
+            else [],
+        }
+        if node_ids:
+            dag['edges'].append((node_ids[-1], node_id))
+        node_ids.append(node_id)
+    return node_ids
+
+
+def plan_campaign_dag(spinup_dir, spinup_times, branches, dependencies=None):
+    """
+    Plan the graph of a spin-up followed by parallel branches
+
+    Parameters
+    -------
+    spinup_dir (str): GEOS-Chem run directory of the spin-up
+    spinup_times (list): Times of the spin-up's chunks (format YYYYMMDD)
+    branches (dict): Times of the chunks of each branch, by run directory
+    dependencies (dict): ID of a job outside the graph that the 1st chunk of
+    a run directory must wait for (or None), by run directory
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the graph's "nodes" (by ID) and "edges"
+     - The 1st chunk of every branch depends on the last chunk of the spin-up,
+     unless the branch has already started (resumed)
+     - If none of the spin-up is left to submit (resumed), the branches
+     instead wait for its dependency (its last chunk, if still queued)
+    """
+    dependencies = dependencies or {}
+    dag = {'nodes': {}, 'edges': []}
+    spinup_nodes = add_chain(dag, spinup_dir, spinup_times,
+                             dependency=dependencies.get(spinup_dir))
+    for run_dir, times in sorted(branches.items()):
+        branch_nodes = add_chain(dag, run_dir, times,
+                                 dependency=dependencies.get(run_dir))
+        if not branch_nodes:
+            continue
+        if spinup_nodes and (times[0] == spinup_times[-1]):
+            dag['edges'].append((spinup_nodes[-1], branch_nodes[0]))
+        elif (not spinup_nodes) and dependencies.get(spinup_dir):
+            dag['nodes'][branch_nodes[0]]['dependencies'].append(
+                dependencies[spinup_dir])
+    return dag
+
+
+def get_topological_order(dag):
+    """
+    Get the IDs of the nodes of a graph with every node after its parents
+
+    Notes
+    -------
+     - Kahn's algorithm, taking nodes in the order they were added when there
+     is a choice
+    """
+    parents = {node_id: set() for node_id in dag['nodes']}
+    children = {node_id: [] for node_id in dag['nodes']}
+    for parent, child in dag['edges']:
+        parents[child].add(parent)
+        children[parent].append(child)
+    ready = [i for i in dag['nodes'] if not parents[i]]
+    order = []
+    while ready:
+        node_id = ready.pop(0)
+        order.append(node_id)
+        for child in children[node_id]:
+            parents[child].discard(node_id)
+            if not parents[child]:
+                ready.append(child)
+    AssStr = "The graph of chunks has a cycle, so can not be submitted"
+    assert len(order) == len(dag['nodes']), AssStr
+    return order
+
+
+def link_restart_handoff(restart_file, run_dir, start_time,
+                         restart_file_template):
+    """
+    Link a branch's initial restart file to the restart it starts from
+
+    Parameters
+    -------
+    restart_file (str): Restart file to start from (e.g. the spin-up's last)
+    run_dir (str): GEOS-Chem run directory of the branch
+    start_time (str): Start of the branch in the format YYYYMMDD
+    restart_file_template (str): Name of restart files ({date} is replaced)
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is the location of the link
+     - The restart file will not exist until the spin-up has finished
+     - A restart file already in the branch is kept as <name>.orig
+    """
+    link = os.path.join(run_dir,
+                        restart_file_template.format(date=start_time))
+    if os.path.islink(link):
+        os.remove(link)
+    elif os.path.exists(link):
+        os.rename(link, link + '.orig')
+    os.symlink(os.path.abspath(restart_file), link)
+    return link
+
+
+def write_dag_run_script(dag, filename='run_geos_dag.sh', prefetch=False):
+    """
+    Write the script that submits every chunk of a graph in one pass
+
+    Parameters
+    -------
+    dag (dict): Graph of "nodes" (by ID) and "edges" (parent, child)
+    filename (str): Location of the script
+    prefetch (bool): Also submit the chunks' prefetch jobs
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - A chunk's prefetch job (<start>.prefetch.sbatch, if made) starts with
+     the chunk before it in its run directory (--dependency=after)
+    """
+    parents = {node_id: [] for node_id in dag['nodes']}
+    for parent, child in dag['edges']:
+        parents[child].append(parent)
+    lines = ["#!/bin/bash\n"]
+    for node_id in get_topological_order(dag):
+        node = dag['nodes'][node_id]
+        job_ids = ['"$job_{}"'.format(i) for i in parents[node_id]] + \
+            node.get('dependencies', [])
+        dependency = ''
+        if job_ids:
+            dependency = '--dependency=afterok:{} '.format(':'.join(job_ids))
+        prefetch_file = os.path.splitext(node['queue_file'])[0] + \
+            PREFETCH_EXTENSION
+        if not (prefetch and os.path.isfile(
+                os.path.join(node['run_dir'], prefetch_file))):
+            prefetch_file = None
+        for parent in parents[node_id]:
+            if prefetch_file and \
+                    (dag['nodes'][parent]['run_dir'] == node['run_dir']):
+                lines.append(
+                    'prefetch_{node_id}=$(cd "{run_dir}" && sbatch '
+                    '--parsable --dependency=after:"$job_{parent}" '
+                    '{prefetch_file})\n'.format(
+                        node_id=node_id, run_dir=node['run_dir'],
+                        parent=parent, prefetch_file=prefetch_file))
+        lines.append(
+            'job_{node_id}=$(cd "{run_dir}" && sbatch --parsable '
+            '{dependency}{queue_file})\n'.format(
+                node_id=node_id, dependency=dependency, **node))
+        lines.append('echo "$job_{node_id}"\n'.format(node_id=node_id))
+        # Record the jobs submitted (see monitor.py)
+        lines.append('echo "$job_{node_id} {start_time}" >> "{jobs_file}"\n'
+                     .format(node_id=node_id, start_time=node['start_time'],
+                             jobs_file=os.path.join(node['run_dir'],
+                                                    SUBMITTED_JOBS_FILE)))
+    with open(filename, 'w') as run_script:
+        run_script.writelines(lines)
+    st = os.stat(filename)
+    os.chmod(filename, st.st_mode | stat.S_IEXEC)
+    return
@@ -0,0 +1,400 @@
+"""
+Submission feeder for geos-chem-schedule
+
+Notes
+-------
+ - Rather than submitting every chunk of every run directory at once (which
+ can hit the scheduler's per user limit, e.g. SLURM's MaxSubmitJobs), the
+ chunks are kept in a local queue and submitted as slots free up
+ - The queue is persisted (a JSON file) after every submission, so a feeder
+ that is stopped (e.g. by a login node restart) can carry on with --feed
+ - Each chunk depends (afterok) on the chunk before it in its run directory.
+ Chunks are submitted in turn from each run directory, so all the run
+ directories make progress
+"""
+import os
+import json
+import time
+import fcntl
+import contextlib
+import subprocess
+
+from utils import is_GEOS_Chem_log_complete
+from resume import COMPLETED_LOG_FILES
+from monitor import load_submitted_jobs
+
+# Commands to submit a chunk and to list the user's queued or running jobs
+FEEDER_COMMANDS = {
+    'submit': 'sbatch --parsable {options}{queue_file}',
+    'active': 'squeue -h -u "$USER" -o %i',
+}
+DEPENDENCY_OPTION = '--dependency=afterok:{job_id} '
+# A chunk's prefetch job starts with the chunk before it (see core.py)
+PREFETCH_DEPENDENCY_OPTION = '--dependency=after:{job_id} '
+PREFETCH_EXTENSION = '.prefetch.sbatch'
+
+
+def load_feeder_state(state_file):
+    """
+    Load the feeder's queue of chunks (empty if there is no state file)
+
+    Parameters
+    -------
+    state_file (str): Location of the feeder state (JSON)
+
+    Returns
+    -------
+    (dict)
+    """
+    if not os.path.isfile(state_file):
+        return {'chunks': []}
+    with open(state_file, 'r') as state:
+        return json.load(state)
+
+
+def save_feeder_state(state, state_file):
+    """
+    Save the feeder's queue of chunks
+
+    Parameters
+    -------
+    state (dict): Feeder state (see load_feeder_state)
+    state_file (str): Location of the feeder state (JSON)
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Written to a temporary file and then moved into place, so the state is
+     never left half written
+    """
+    state_dir = os.path.dirname(state_file)
+    if state_dir and not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    temporary_file = state_file + '.tmp'
+    with open(temporary_file, 'w') as state_output:
+        json.dump(state, state_output, indent=1, sort_keys=True)
+    os.replace(temporary_file, state_file)
+    return
+
+
+@contextlib.contextmanager
+def lock_feeder_state(state_file):
+    """
+    Hold a lock on the feeder state, so only one process changes it at a time
+    """
+    state_dir = os.path.dirname(state_file)
+    if state_dir and not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    with open(state_file + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def add_feeder_chunks(state_file, run_dir, times,
+                      queue_dir='SLURM_queue_files', extension='.sbatch',
+                      dependency=None, begin_option=''):
+    """
+    Add the chunks of a run directory to the feeder's queue
+
+    Parameters
+    -------
+    state_file (str): Location of the feeder state (JSON)
+    run_dir (str): GEOS-Chem run directory of the chunks
+    times (list): list of string times in the format YYYYMMDD
+    queue_dir (str): Directory of the queue files within the run directory
+    extension (str): Extension of the queue files
+    dependency (str): ID of a job that must complete before the 1st chunk
+    begin_option (str): Option to start the jobs out of hours (or '')
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Chunks of the run directory not yet submitted are replaced (e.g. if it
+     is scheduled again)
+     - Safe to call from many processes at once (e.g. a batch)
+    """
+    run_dir = os.path.realpath(run_dir)
+    with lock_feeder_state(state_file):
+        state = load_feeder_state(state_file)
+        state['chunks'] = [i for i in state['chunks']
+                           if (i['run_dir'] != run_dir) or i['job_id']]
+        for n_time, start_time in enumerate(times[:-1]):
+            state['chunks'].append({
+                'run_dir': run_dir,
+                'start_time': start_time,
+                'queue_file': os.path.join(queue_dir, start_time + extension),
+                'dependency': dependency if n_time == 0 else None,
+                'begin_option': begin_option,
+                'job_id': None,
+                'blocked': False,
+            })
+        save_feeder_state(state, state_file)
+    return state
+
+
+def get_active_jobs(active_command=None):
+    """
+    Get the IDs of the user's queued or running jobs
+
+    Parameters
+    -------
+    active_command (str): Command to list the job IDs (default: squeue)
+
+    Returns
+    -------
+    (set)
+    """
+    output = subprocess.run(
+        active_command or FEEDER_COMMANDS['active'], shell=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(i.strip() for i in output.splitlines() if i.strip())
+
+
+def get_pending_chunks(state):
+    """
+    Get the chunks still to submit that are not blocked
+    """
+    return [i for i in state['chunks']
+            if (not i['job_id']) and (not i['blocked'])]
+
+
+def get_chunk_dependency(chunk, previous, active):
+    """
+    Get the job a chunk must depend on
+
+    Parameters
+    -------
+    chunk (dict): Chunk to submit
+    previous (dict): Chunk before it in its run directory (or None)
+    active (set): IDs of the user's queued or running jobs
+
+    Returns
+    -------
+    (tuple)
+
+    Notes
+    -------
+     - Returned tuple is whether the chunk can be submitted and the job ID it
+     depends on (or None)
+     - If the chunk before has already finished, this chunk only runs if it
+     completed (its log ends with the GEOS-Chem end banner)
+     - If the chunk before was resubmitted (e.g. by --auto-retry), its latest
+     job in submitted_jobs.txt replaces the one the feeder submitted
+    """
+    if previous is None:
+        return True, chunk['dependency']
+    if not previous['job_id']:
+        return False, None
+    latest_job_id = load_submitted_jobs(previous['run_dir']).get(
+        previous['start_time'])
+    if latest_job_id:
+        previous['job_id'] = latest_job_id
+    if previous['job_id'] in active:
+        return True, previous['job_id']
+    log_file = os.path.join(previous['run_dir'], COMPLETED_LOG_FILES[
+        'SLURM'].format(start_time=previous['start_time']))
+    if is_GEOS_Chem_log_complete(log_file):
+        return True, None
+    chunk['blocked'] = True
+    return False, None
+
+
+def submit_chunk(chunk, dependency=None, submit_command=None,
+                 dependency_option=DEPENDENCY_OPTION):
+    """
+    Submit a chunk to the scheduler
+
+    Parameters
+    -------
+    chunk (dict): Chunk to submit
+    dependency (str): ID of a job that must complete before the chunk
+    submit_command (str): Command to submit with (default: sbatch)
+    dependency_option (str): Option to depend on the job with
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is the job ID, or None if the submission failed (e.g.
+     the user's limit was reached)
+    """
+    options = chunk['begin_option']
+    if dependency:
+        options += dependency_option.format(job_id=dependency)
+    command = (submit_command or FEEDER_COMMANDS['submit']).format(
+        options=options, queue_file=chunk['queue_file'])
+    result = subprocess.run(command, shell=True, cwd=chunk['run_dir'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    job_id = result.stdout.strip().split(';')[0]
+    if result.returncode != 0 or not job_id:
+        print("Could not submit {} ({}): {}".format(
+            chunk['queue_file'], chunk['run_dir'], result.stderr.strip()))
+        return None
+    return job_id
+
+
+def submit_prefetch(chunk, next_chunk, job_id, submit_command=None):
+    """
+    Submit the prefetch job of the chunk after one just submitted
+
+    Parameters
+    -------
+    chunk (dict): Chunk just submitted
+    next_chunk (dict): Chunk after it in its run directory
+    job_id (str): ID of the job of the chunk just submitted
+    submit_command (str): Command to submit with (default: sbatch)
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is the prefetch job's ID, or None if the next chunk
+     has no prefetch job (see core.create_prefetch_files) or it could not be
+     submitted
+     - The prefetch job starts with the chunk, so the next chunk's inputs are
+     warmed while it runs
+    """
+    prefetch_file = os.path.splitext(next_chunk['queue_file'])[0] + \
+        PREFETCH_EXTENSION
+    if not os.path.isfile(os.path.join(chunk['run_dir'], prefetch_file)):
+        return None
+    prefetch_chunk = {'run_dir': chunk['run_dir'],
+                      'queue_file': prefetch_file, 'begin_option': ''}
+    return submit_chunk(prefetch_chunk, dependency=job_id,
+                        submit_command=submit_command,
+                        dependency_option=PREFETCH_DEPENDENCY_OPTION)
+
+
+def feed_once(state_file, inputs=None):
+    """
+    Submit chunks from the feeder's queue until the user's limit is reached
+
+    Parameters
+    -------
+    state_file (str): Location of the feeder state (JSON)
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (int)
+
+    Notes
+    -------
+     - Returned integer is the number of chunks submitted
+     - All of the user's queued or running jobs count towards the limit
+     (inputs.feeder_max_jobs), as for the scheduler's MaxSubmitJobs
+     - The next chunk of each run directory is submitted in turn
+     - With inputs.prefetch_inputs, each chunk's prefetch job is submitted
+     with the chunk before it
+     - The state is locked, so two feeders never submit the same chunk
+    """
+    with lock_feeder_state(state_file):
+        state = load_feeder_state(state_file)
+        active = get_active_jobs(inputs.feeder_active_command)
+        slots = int(inputs.feeder_max_jobs) - len(active)
+        chains = {}
+        for chunk in state['chunks']:
+            chains.setdefault(chunk['run_dir'], []).append(chunk)
+        n_submitted = 0
+        while slots > 0:
+            submitted_this_round = False
+            for chain in chains.values():
+                if slots <= 0:
+                    break
+                pending = [n for n, i in enumerate(chain)
+                           if (not i['job_id']) and (not i['blocked'])]
+                if not pending:
+                    continue
+                chunk = chain[pending[0]]
+                previous = chain[pending[0]-1] if pending[0] > 0 else None
+                ready, dependency = get_chunk_dependency(chunk, previous,
+                                                         active)
+                # Nothing after a failed chunk can run
+                if chunk['blocked']:
+                    for later_chunk in chain[pending[0]:]:
+                        later_chunk['blocked'] = True
+                if not ready:
+                    continue
+                job_id = submit_chunk(
+                    chunk, dependency=dependency,
+                    submit_command=inputs.feeder_submit_command)
+                if job_id is None:
+                    # Probably at the limit, so try again next time
+                    slots = 0
+                    break
+                chunk['job_id'] = job_id
+                active.add(job_id)
+                slots -= 1
+                n_submitted += 1
+                submitted_this_round = True
+                # Record the jobs submitted (see monitor.py)
+                submitted_jobs_file = os.path.join(chunk['run_dir'],
+                                                   'submitted_jobs.txt')
+                with open(submitted_jobs_file, 'a') as submitted_jobs:
+                    submitted_jobs.write('{} {}\n'.format(
+                        job_id, chunk['start_time']))
+                if inputs.prefetch_inputs and (pending[0]+1 < len(chain)):
+                    prefetch_job_id = submit_prefetch(
+                        chunk, chain[pending[0]+1], job_id,
+                        submit_command=inputs.feeder_submit_command)
+                    if prefetch_job_id:
+                        active.add(prefetch_job_id)
+                        slots -= 1
+                save_feeder_state(state, state_file)
+            if not submitted_this_round:
+                break
+        # Keep any chains found to be blocked
+        save_feeder_state(state, state_file)
+    return n_submitted
+
+
+def run_feeder(state_file, inputs=None, verbose=True):
+    """
+    Keep submitting chunks from the feeder's queue until all are submitted
+
+    Parameters
+    -------
+    state_file (str): Location of the feeder state (JSON)
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    verbose (bool): Print the progress to the screen
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the final feeder state
+     - Run directories whose chunk failed are blocked and left unsubmitted
+    """
+    while True:
+        n_submitted = feed_once(state_file, inputs=inputs)
+        state = load_feeder_state(state_file)
+        pending = get_pending_chunks(state)
+        if verbose:
+            print("{}: submitted {} chunks, {} waiting".format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), n_submitted,
+                len(pending)))
+        if not pending:
+            break
+        time.sleep(float(inputs.feeder_interval))
+    blocked = set(i['run_dir'] for i in state['chunks'] if i['blocked'])
+    if verbose and blocked:
+        print("A chunk failed, so the rest of these were not submitted:")
+        for run_dir in sorted(blocked):
+            print("  {}".format(run_dir))
+    return state
@@ -25,9 +25,16 @@ from dateutil.relativedelta import relativedelta
 import pytest
 
 # Import the functions called here for now...
-from core import GC_Job, get_arguments, check_inputs, get_start_and_end_dates, list_of_times_to_run, backup_the_input_files, create_the_input_files, run_job_script
-from core import create_PBS_queue_files, create_PBS_run_script
-from core import create_SLURM_queue_files, create_SLURM_run_script, create_SLURM_run_script2submit_together
+from core import GC_Job, get_arguments, check_inputs, schedule_run_directory
+from core import schedule_run_directories, print_batch_summary
+from core import monitor_run_directories, analyse_run_directories_logs
+from core import schedule_segments, schedule_campaign_dag
+from core import clone_run_directories, simulate_chunking_strategies
+from placement import load_cluster_state, advise_placement
+from placement import print_placement_advice
+from feeder import run_feeder
+from registry import sync_registry, print_registry_report
+from segments import stitch_segments
 
 # Master debug switch for the main driver
 DEBUG = False
@@ -46,41 +53,78 @@ def main(debug=DEBUG):
     # Check all the inputs are valid
     inputs = check_inputs(inputs, debug=DEBUG)
 
-    # Check the start and end dates are compatible with the script
-    start_date, end_date = get_start_and_end_dates()
-
-    # Calculate the list of times to run the model for
-    times = list_of_times_to_run(start_date, end_date, inputs)
-
-    # Make a backup of the input.geos file
-    backup_the_input_files(inputs=inputs)
-
-    # Create the individual time input files
-    create_the_input_files(times, inputs=inputs)
-
-    # Create the files required by the specific scheduler
-    if inputs.scheduler == 'PBS':
-        # Create the PBS queue files
-        create_PBS_queue_files(times, inputs=inputs, debug=DEBUG)
-        # Create the PSB run script
-        create_PBS_run_script(time)
-        # Send the script to the queue if requested
-        run_job_script(inputs.run_script, filename="run_geos_PBS.sh")
-    elif (inputs.scheduler == 'SLURM') and (not inputs.submit_jobs_together):
-        # Create the SLURM queue files
-        create_SLURM_queue_files(times, inputs=inputs, debug=DEBUG)
-        # Create the SLURM run script
-        create_SLURM_run_script(time)
-        # Send the script to the queue if requested
-        run_job_script(inputs.run_script, filename="run_geos_SLURM.sh")
-    elif (inputs.scheduler == 'SLURM') and (inputs.submit_jobs_together):
-        # Create the SLURM queue files
-        create_SLURM_queue_files(times, inputs=inputs, debug=DEBUG)
-        # Create the SLURM run script
-        create_SLURM_run_script2submit_together(times)
-        # Send the script to the queue if requested
-        filename = "run_geos_SLURM_queue_all_jobs.sh"
-        run_job_script(inputs.run_script, filename=filename)
+    # Only show the state of the submitted jobs if requested
+    if inputs.monitor:
+        monitor_run_directories(inputs.batch_run_dirs or ['.'], inputs=inputs)
+        return
+
+    # Only report the throughput of the chunks from their logs if requested
+    if inputs.analyse_logs:
+        analyse_run_directories_logs(inputs.batch_run_dirs or ['.'],
+                                     inputs=inputs)
+        return
+
+    # Only report the state of the registered runs if requested
+    if inputs.registry_report:
+        sync_registry(inputs=inputs)
+        print_registry_report(inputs=inputs)
+        return
+
+    # Only show the expected start in each partition if requested
+    if inputs.advise_placement:
+        print_placement_advice(advise_placement(
+            inputs.wall_time, inputs.cpus_need, load_cluster_state(
+                inputs.scheduler, capture_dir=inputs.placement_capture_dir)))
+        return
+
+    # Only compare the steps by simulating the run if requested
+    if inputs.simulate:
+        simulate_chunking_strategies('.', inputs=inputs)
+        return
+
+    # Only carry on submitting from the feeder's queue if requested
+    if inputs.feed:
+        run_feeder(inputs.feeder_state_file, inputs=inputs)
+        return
+
+    # Only link the output of the segments of a run together if requested
+    if inputs.stitch_segments:
+        linked = stitch_segments('.')
+        print("Linked {} output files into OutputDir".format(len(linked)))
+        return
+
+    # Split the run into segments that run at the same time if requested
+    if int(inputs.segments) > 1:
+        schedule_segments('.', inputs=inputs, debug=DEBUG)
+        return
+
+    # Clone the run directory into an ensemble and schedule it if requested
+    if inputs.clone:
+        clone_run_directories('.', inputs.clone, inputs=inputs, debug=DEBUG)
+        return
+
+    # Schedule a spin-up and the batch that starts from it as one graph
+    if inputs.spinup_dir:
+        results = schedule_campaign_dag(inputs.spinup_dir,
+                                        inputs.batch_run_dirs, inputs=inputs,
+                                        overrides=inputs.batch_overrides,
+                                        processes=inputs.batch_processes,
+                                        debug=DEBUG)
+        print_batch_summary(results)
+        return
+
+    # Schedule many run directories at once if a batch was requested
+    if inputs.batch_run_dirs:
+        results = schedule_run_directories(inputs.batch_run_dirs,
+                                           inputs=inputs,
+                                           overrides=inputs.batch_overrides,
+                                           processes=inputs.batch_processes,
+                                           debug=DEBUG)
+        print_batch_summary(results)
+        return
+
+    # Otherwise create the input files and queue scripts (and submit) here
+    schedule_run_directory('.', inputs=inputs, debug=DEBUG)
 
 
 if __name__ == '__main__':
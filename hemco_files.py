@@ -0,0 +1,248 @@
+"""
+Parse a HEMCO_Config.rc file and resolve the data files each chunk reads
+
+Notes
+-------
+ - Settings (e.g. "ROOT: /path/to/data") are used to fill in the $TOKENS of
+ the file names, along with the date tokens ($YYYY, $MM, $DD, $HH)
+ - Data are skipped if their extension is off, or they are within a
+ (((NAME ... )))NAME bracket that is switched off
+ - The year used for a chunk's emissions (or meteorology) is the EmisYear
+ (or MetYear) if one is set, otherwise the simulated year. Dates are then
+ limited to the range in the data's time attribute (e.g. 1980-2010/1-12/1/0),
+ as HEMCO does for data that are not cycled
+"""
+import re
+import datetime
+
+# Sections that are not lists of data
+SETTINGS_SECTION = 'SETTINGS'
+SWITCHES_SECTION = 'EXTENSION SWITCHES'
+# Sections whose 1st column is a scale factor (or mask) ID, not an ExtNr
+SCALE_FACTOR_SECTIONS = ('SCALE FACTORS', 'MASKS')
+# Date tokens filled in for each chunk
+DATE_TOKENS = ('YYYY', 'MM', 'DD', 'HH')
+SECTION_RE = re.compile(r'^#+\s*BEGIN SECTION\s+(.+?)\s*#*$')
+TOKEN_RE = re.compile(r'\$(\w+)')
+
+
+class HEMCOConfig:
+    """
+    A HEMCO_Config.rc file, parsed into its settings, switches and data
+
+    Attributes
+    -------
+        settings: Values of the settings (e.g. "ROOT") by name
+        extensions: Whether each extension (by number and name) is on
+        switches: Whether each extension option (e.g. "CEDS") is on
+        data: A dictionary (name, source_file, source_time, section,
+        met) for each data entry that is switched on
+    """
+
+    def __init__(self, lines, switches=None):
+        self.settings = {}
+        self.extensions = {}
+        self.switches = {}
+        self.data = []
+        section = None
+        entries = []
+        brackets = []
+        for line in lines:
+            match = SECTION_RE.match(line.strip())
+            if match:
+                section = match.group(1).upper()
+                continue
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if section == SETTINGS_SECTION:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    self.settings[name.strip()] = value.strip()
+            elif section == SWITCHES_SECTION:
+                self.read_switch(line)
+            elif line.startswith('((('):
+                brackets.append(line[3:].strip())
+            elif line.startswith(')))'):
+                if brackets:
+                    brackets.pop()
+            else:
+                fields = line.split()
+                if len(fields) >= 5:
+                    entries.append((section, list(brackets), fields))
+        # Switches can be forced on or off (e.g. brackets for the met fields)
+        self.switches.update(switches or {})
+        for section, entry_brackets, fields in entries:
+            if all(self.is_switched_on(i) for i in entry_brackets) and \
+                    self.is_extension_on(section, fields[0]) and \
+                    self.is_file(fields[2]):
+                self.data.append({
+                    'name': fields[1],
+                    'source_file': fields[2],
+                    'source_time': fields[4],
+                    'section': section,
+                    'met': ('$MET' in fields[2]) or
+                    ('MET' in (section or '')),
+                })
+        return
+
+    @classmethod
+    def from_file(cls, filename='HEMCO_Config.rc', switches=None):
+        """
+        Read and parse a HEMCO_Config.rc file
+        """
+        with open(filename, 'r') as input_file:
+            return cls(input_file.readlines(), switches=switches)
+
+    def read_switch(self, line):
+        """
+        Read an extension (e.g. "0 Base : on *") or option (e.g. "--> CEDS :
+        true") line of the extension switches section
+        """
+        if ':' not in line:
+            return
+        name, value = [i.strip() for i in line.split(':', 1)]
+        value = (value.split() or [''])[0].lower()
+        if name.startswith('-->'):
+            self.switches[name[3:].strip()] = value in ('true', 'on')
+        else:
+            fields = name.split()
+            is_on = (value == 'on')
+            for field in fields:
+                self.extensions[field] = is_on
+            # An extension's name can also be used as a bracket
+            self.switches.setdefault(fields[-1], is_on)
+        return
+
+    def is_switched_on(self, bracket):
+        """
+        Is the data within a bracket (e.g. "CEDS" or ".not.CEDS") used?
+
+        Notes
+        -------
+         - Unknown brackets are taken to be on
+        """
+        if bracket.startswith('.not.'):
+            return not self.switches.get(bracket[5:], False)
+        return self.switches.get(bracket, True)
+
+    def is_extension_on(self, section, ext_nr):
+        """
+        Is the extension (by number) of a data entry on?
+        """
+        if section in SCALE_FACTOR_SECTIONS:
+            return True
+        return self.extensions.get(ext_nr, True)
+
+    @staticmethod
+    def is_file(source_file):
+        """
+        Is the source of a data entry a file (rather than a value or "-")?
+        """
+        return ('/' in source_file) or ('$' in source_file) or \
+            source_file.endswith('.nc')
+
+    def get_chunk_files(self, start_time, end_time, met_year=None,
+                        emis_year=None, tokens=None):
+        """
+        Get the files a chunk reads
+
+        Parameters
+        -------
+        start_time (str): Start of the chunk in the format YYYYMMDD
+        end_time (str): End of the chunk in the format YYYYMMDD
+        met_year (int): Year of the meteorology (default: simulated year)
+        emis_year (int): Year of the emissions (default: simulated year)
+        tokens (dict): Values of tokens not set in the settings (e.g. "RES")
+
+        Returns
+        -------
+        (list)
+
+        Notes
+        -------
+         - Files with tokens that could not be filled in are left with their
+         "$" so they can be spotted
+        """
+        values = dict(self.settings)
+        values.update(tokens or {})
+        start_datetime = datetime.datetime.strptime(start_time, "%Y%m%d")
+        end_datetime = datetime.datetime.strptime(end_time, "%Y%m%d")
+        days = [start_datetime + datetime.timedelta(days=i) for i in
+                range(max((end_datetime - start_datetime).days, 1))]
+        files = set()
+        for data in self.data:
+            source_file = fill_tokens(data['source_file'], values)
+            if not any('$'+i in source_file for i in DATE_TOKENS):
+                files.add(source_file)
+                continue
+            year = met_year if data['met'] else emis_year
+            hourly = '$HH' in source_file
+            for day in days:
+                dates = get_data_dates(day, data['source_time'], year)
+                for date in (dates if hourly else dates[:1]):
+                    files.add(fill_tokens(source_file, {
+                        'YYYY': '{:04d}'.format(date[0]),
+                        'MM': '{:02d}'.format(date[1]),
+                        'DD': '{:02d}'.format(date[2]),
+                        'HH': '{:02d}'.format(date[3]),
+                    }))
+        return sorted(files)
+
+
+def fill_tokens(source_file, values, max_depth=5):
+    """
+    Fill in the $TOKENS of a file name (settings can refer to other settings)
+    """
+    for n_depth in range(max_depth):
+        filled = TOKEN_RE.sub(lambda i: values.get(i.group(1), i.group(0)),
+                              source_file)
+        if filled == source_file:
+            break
+        source_file = filled
+    return source_file
+
+
+def get_time_range(field, default):
+    """
+    Get the (first, last) values of a time attribute field (e.g. "1-12")
+
+    Notes
+    -------
+     - All values ("*") or none ("-") use the default range
+    """
+    values = [int(i) for i in re.findall(r'\d+', field)]
+    if not values:
+        return default
+    return min(values), max(values)
+
+
+def get_data_dates(day, source_time, year=None):
+    """
+    Get the (year, month, day, hour) dates of the data read for a day
+
+    Parameters
+    -------
+    day (datetime.datetime): Simulated day
+    source_time (str): Time attribute of the data (e.g. 1980-2010/1-12/1/0)
+    year (int): Year to read (default: the simulated year)
+
+    Returns
+    -------
+    (list)
+    """
+    fields = (source_time.split('/') + ['*']*4)[:4]
+    year = year or day.year
+    ranges = [
+        get_time_range(fields[0], (year, year)),
+        get_time_range(fields[1], (day.month, day.month)),
+        get_time_range(fields[2], (day.day, day.day)),
+        get_time_range(fields[3], (0, 0)),
+    ]
+
+    def clamp(value, value_range):
+        return min(max(value, value_range[0]), value_range[1])
+
+    date = (clamp(year, ranges[0]), clamp(day.month, ranges[1]),
+            clamp(day.day, ranges[2]))
+    return [date + (hour,) for hour in range(ranges[3][0], ranges[3][1]+1)]
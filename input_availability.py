@@ -0,0 +1,129 @@
+"""
+Check the input data of a run are available before it is submitted
+
+Notes
+-------
+ - Every met and emission file the chunks read (see hemco_files.py) is
+ checked with os.stat in bulk on a thread pool, as the checks are IO bound
+ - Files found are cached in an index (a JSON file), so checking many run
+ directories that read the same data (e.g. ensemble members) is cheap.
+ Missing files are always checked again
+"""
+import os
+import json
+import time
+import tempfile
+import concurrent.futures
+
+
+def stat_file(filename):
+    """
+    Get the size of a file (or None if it does not exist)
+    """
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        return None
+
+
+def load_input_index(index_file):
+    """
+    Load the index of the files found by earlier checks
+    """
+    if not index_file or not os.path.isfile(index_file):
+        return {}
+    try:
+        with open(index_file, 'r') as index:
+            return json.load(index)
+    except ValueError:
+        return {}
+
+
+def save_input_index(index, index_file):
+    """
+    Save the index of files found, merging in other processes' entries
+
+    Notes
+    -------
+     - Written to a temporary file then moved into place, so a reader never
+     sees a partly written index
+    """
+    index_dir = os.path.dirname(index_file)
+    if index_dir and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    merged = load_input_index(index_file)
+    merged.update(index)
+    file_descriptor, temp_file = tempfile.mkstemp(dir=index_dir or '.')
+    with os.fdopen(file_descriptor, 'w') as index_temp:
+        json.dump(merged, index_temp)
+    os.replace(temp_file, index_file)
+    return
+
+
+def build_input_index(files, index_file=None, max_age=24., threads=32):
+    """
+    Find which files exist, using the cached index where it is recent
+
+    Parameters
+    -------
+    files (list): Files to check
+    index_file (str): Location of the cached index (None=no cache)
+    max_age (float): Hours a file found is trusted for without checking again
+    threads (int): Number of threads to check the files with
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is whether each file exists
+    """
+    now = time.time()
+    index = load_input_index(index_file)
+    to_check = [i for i in set(files)
+                if (i not in index) or (now - index[i]['checked'] >
+                                        max_age * 3600.)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        sizes = dict(zip(to_check, pool.map(stat_file, to_check)))
+    new_entries = {i: {'size': size, 'checked': now}
+                   for i, size in sizes.items() if size is not None}
+    index.update(new_entries)
+    if index_file and new_entries:
+        save_input_index(new_entries, index_file)
+    return {i: (i in index) and (sizes.get(i, 0) is not None)
+            for i in files}
+
+
+def get_missing_input_files(chunk_files, index_file=None, max_age=24.,
+                            threads=32):
+    """
+    Get the files that are missing (or could not be resolved) for each chunk
+
+    Parameters
+    -------
+    chunk_files (dict): Files each chunk reads by start time
+    index_file (str): Location of the cached index (None=no cache)
+    max_age (float): Hours a file found is trusted for without checking again
+    threads (int): Number of threads to check the files with
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary only has the chunks with missing files
+     - Files with tokens that could not be filled in ("$") count as missing
+    """
+    files = [i for files in chunk_files.values() for i in files
+             if '$' not in i]
+    exists = build_input_index(files, index_file=index_file,
+                               max_age=max_age, threads=threads)
+    missing = {}
+    for start_time in sorted(chunk_files):
+        chunk_missing = [i for i in chunk_files[start_time]
+                         if not exists.get(i, False)]
+        if chunk_missing:
+            missing[start_time] = chunk_missing
+    return missing
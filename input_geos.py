@@ -0,0 +1,190 @@
+"""
+Indexed model of a GEOS-Chem input.geos file for geos-chem-schedule
+"""
+import calendar
+
+
+class InputGeos:
+    """
+    An input.geos file parsed once, with the positions of the lines to change
+
+    Attributes
+    -------
+        lines: Lines of the original input.geos file
+        start_index: Index of the "Start YYYYMMDD" line
+        end_index: Index of the "End   YYYYMMDD" line
+        cspec_index: Index of the "Read and save CSPEC_FULL" line
+        output_indices: Indices of the "Schedule output for" lines, by month
+        (e.g. "JAN")
+        buffer: Lines shared by every chunk's file, with the CSPEC flag set and
+        the "Schedule output for" lines zeroed
+
+    Notes
+    -------
+     - Each chunk's file is made by patching only the start/end date lines and
+     "Schedule output for" lines of the shared buffer
+    """
+    # Column span of the YYYYMMDD dates and start of the CSPEC flag
+    DATE_SPAN = (26, 34)
+    CSPEC_COLUMN = 26
+    # Column of the 1st day in the "Schedule output for" lines
+    OUTPUT_COLUMN = 26
+    # Column span of the month name in the "Schedule output for" lines
+    MONTH_SPAN = (20, 23)
+    # Month names (as used in input.geos) by month number
+    MONTH_NAMES = [i[0:3].upper() for i in calendar.month_name]
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.start_index = None
+        self.end_index = None
+        self.cspec_index = None
+        self.output_indices = {}
+        self.buffer = list(self.lines)
+        for n_line, line in enumerate(self.lines):
+            if line.startswith("Start YYYYMMDD"):
+                self.start_index = n_line
+            elif line.startswith("End   YYYYMMDD"):
+                self.end_index = n_line
+            # Force CSPEC on
+            elif line.startswith("Read and save CSPEC_FULL:"):
+                self.cspec_index = n_line
+                self.buffer[n_line] = line[:self.CSPEC_COLUMN] + 'T\n'
+            # Replace all instances of 3 with 0 so only the final day is a 3
+            elif line.startswith("Schedule output for"):
+                month_name = line[self.MONTH_SPAN[0]:self.MONTH_SPAN[1]]
+                self.output_indices.setdefault(month_name, []).append(n_line)
+                self.buffer[n_line] = line.replace('3', '0')
+        return
+
+    @classmethod
+    def from_file(cls, filename='input.geos'):
+        """
+        Read and parse an input.geos file
+
+        Parameters
+        -------
+        filename (str): Location of the input.geos file
+
+        Returns
+        -------
+        (InputGeos)
+        """
+        with open(filename, 'r') as input_file:
+            return cls(input_file.readlines())
+
+    def get_date(self, index):
+        """
+        Get the YYYYMMDD date from the line at an index
+        """
+        return self.lines[index][self.DATE_SPAN[0]:self.DATE_SPAN[1]]
+
+    @property
+    def start_date(self):
+        return self.get_date(self.start_index)
+
+    @property
+    def end_date(self):
+        return self.get_date(self.end_index)
+
+    def set_date(self, lines, index, date):
+        """
+        Patch the YYYYMMDD date into the line at an index
+        """
+        line = self.lines[index]
+        lines[index] = line[:self.DATE_SPAN[0]] + str(date) + \
+            line[self.DATE_SPAN[1]:]
+        return
+
+    def create_lines(self, start_time, end_time,
+                     output_on_1st_of_month=False):
+        """
+        Create the lines of the input.geos file for a chunk
+
+        Parameters
+        -------
+        start_time (str): Start of GEOS-Chem run in format YYYYMMDD
+        end_time (str): End of GEOS-Chem run in format YYYYMMDD
+        output_on_1st_of_month (bool): Write output in every month's line
+
+        Returns
+        -------
+        (list)
+        """
+        lines = list(self.buffer)
+        if self.start_index is not None:
+            self.set_date(lines, self.start_index, start_time)
+        if self.end_index is not None:
+            self.set_date(lines, self.end_index, end_time)
+        # Make sure write at end on a 3
+        if output_on_1st_of_month:
+            output_indices = [i for indices in self.output_indices.values()
+                              for i in indices]
+        else:
+            month_name = self.MONTH_NAMES[int(end_time[4:6])]
+            output_indices = self.output_indices.get(month_name, [])
+        _position = self.OUTPUT_COLUMN + int(end_time[6:8])
+        for n_line in output_indices:
+            line = lines[n_line]
+            lines[n_line] = line[:_position-1] + '3' + line[_position:]
+        return lines
+
+    def create_file_string(self, start_time, end_time,
+                           output_on_1st_of_month=False):
+        """
+        Create the contents of the input.geos file for a chunk (see
+        create_lines)
+        """
+        return ''.join(self.create_lines(
+            start_time, end_time,
+            output_on_1st_of_month=output_on_1st_of_month))
+
+    def get_setting(self, label):
+        """
+        Get the value of a setting (e.g. "Grid resolution") from its line
+
+        Parameters
+        -------
+        label (str): Start of the setting's line (before the colon)
+
+        Returns
+        -------
+        (str)
+
+        Notes
+        -------
+         - Returns None if no line starts with the label
+        """
+        for line in self.lines:
+            if line.startswith(label) and (':' in line):
+                return line.split(':', 1)[1].strip()
+        return None
+
+    def set_setting(self, lines, label, value):
+        """
+        Patch the value of a setting (e.g. "Turn on chemistry?") into its line
+
+        Parameters
+        -------
+        lines (list): Lines to patch (e.g. a copy of the lines)
+        label (str): Start of the setting's line (before the colon)
+        value (str): New value of the setting
+
+        Returns
+        -------
+        (None)
+
+        Notes
+        -------
+         - The value starts in the same column as the line's old value
+        """
+        indices = [n for n, line in enumerate(self.lines)
+                   if line.startswith(label) and (':' in line)]
+        AssStr = "No setting starting with {} in input.geos"
+        assert indices, AssStr.format(label)
+        line = self.lines[indices[0]]
+        colon = line.index(':') + 1
+        padding = len(line[colon:]) - len(line[colon:].lstrip(' '))
+        lines[indices[0]] = line[:colon] + ' '*max(padding, 1) + str(value) + \
+            '\n'
+        return
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Run the chunks of GEOS-Chem runs without a batch scheduler (scheduler "local")
+
+Notes
+-------
+ - The chunks of each run directory are a chain, run one after another, and a
+ failed chunk stops the rest of its chain
+ - Chains (e.g. independent ensemble members) run in parallel on a process
+ pool, sized so the chunks running at once fit on the available cores
+ - The output of each chunk's script is captured in
+ queue_output/YYYYMMDD.local.log, and its exit code returned
+ - Also usable directly: "python local_executor.py <run_dir> [<run_dir> ...]"
+"""
+import os
+import sys
+import multiprocessing
+import subprocess
+
+# Files (relative to the run directory) used by the local scheduler
+LOCAL_CHUNK_LIST = 'local_queue_files/chunks.txt'
+LOCAL_QUEUE_FILE = 'local_queue_files/{start_time}.sh'
+LOCAL_OUTPUT_FILE = 'queue_output/{start_time}.local.log'
+
+
+def get_local_processes(cpus_need):
+    """
+    Get the number of chunks that can run at once on this machine
+
+    Parameters
+    -------
+    cpus_need (str or int): Number of CPUs each chunk uses
+
+    Returns
+    -------
+    (int)
+    """
+    return max(multiprocessing.cpu_count() // int(cpus_need), 1)
+
+
+def write_local_chunk_list(times, run_dir='.'):
+    """
+    Write the start times of the chunks to run, in order, for the executor
+    """
+    chunk_list = os.path.join(run_dir, LOCAL_CHUNK_LIST)
+    if not os.path.exists(os.path.dirname(chunk_list)):
+        os.makedirs(os.path.dirname(chunk_list))
+    with open(chunk_list, 'w') as chunks:
+        chunks.write('\n'.join(times[:-1]) + '\n')
+    return
+
+
+def read_local_chunk_list(run_dir='.'):
+    """
+    Read the start times of the chunks to run (see write_local_chunk_list)
+    """
+    with open(os.path.join(run_dir, LOCAL_CHUNK_LIST), 'r') as chunks:
+        return [i.strip() for i in chunks if i.strip()]
+
+
+def run_local_chunk(run_dir, start_time):
+    """
+    Run the script of a single chunk, capturing its output
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+    start_time (str): Start time of the chunk in the format YYYYMMDD
+
+    Returns
+    -------
+    (dict)
+    """
+    log_file = os.path.join(run_dir,
+                            LOCAL_OUTPUT_FILE.format(start_time=start_time))
+    if not os.path.exists(os.path.dirname(log_file)):
+        os.makedirs(os.path.dirname(log_file))
+    queue_file = LOCAL_QUEUE_FILE.format(start_time=start_time)
+    with open(log_file, 'w') as output:
+        exit_code = subprocess.call(['bash', queue_file], cwd=run_dir,
+                                    stdout=output, stderr=subprocess.STDOUT)
+    return {
+        'run_dir': run_dir,
+        'start_time': start_time,
+        'exit_code': exit_code,
+        'log_file': log_file,
+    }
+
+
+def run_local_chain(run_dir):
+    """
+    Run the chunks of a run directory in order, stopping at the first failure
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Chunks not run after a failure have an exit code of None
+    """
+    results = []
+    failed = False
+    for start_time in read_local_chunk_list(run_dir):
+        if failed:
+            results.append({
+                'run_dir': run_dir,
+                'start_time': start_time,
+                'exit_code': None,
+                'log_file': None,
+            })
+            continue
+        result = run_local_chunk(run_dir, start_time)
+        failed = (result['exit_code'] != 0)
+        results.append(result)
+    return results
+
+
+def run_local_chains(run_dirs, processes=None):
+    """
+    Run the chunks of many run directories, with the chains in parallel
+
+    Parameters
+    -------
+    run_dirs (list): GEOS-Chem run directories to run
+    processes (int): Number of chains to run at once (default: number of CPUs)
+
+    Returns
+    -------
+    (list)
+    """
+    if len(run_dirs) == 1 or processes == 1:
+        chains = [run_local_chain(run_dir) for run_dir in run_dirs]
+    else:
+        with multiprocessing.Pool(processes=processes) as pool:
+            chains = pool.map(run_local_chain, run_dirs)
+    return [result for chain in chains for result in chain]
+
+
+def print_local_summary(results):
+    """
+    Print the exit code and log of each chunk run locally
+    """
+    n_failed = len([i for i in results if i['exit_code'] != 0])
+    print("Ran {} of {} chunks ({} failed or not run)".format(
+        len(results)-n_failed, len(results), n_failed))
+    PrtStr = "{:<40} {:>8} {:>9}  {}"
+    print(PrtStr.format('run_dir', 'start', 'exit_code', 'log'))
+    for result in results:
+        print(PrtStr.format(result['run_dir'], result['start_time'],
+                            str(result['exit_code']), str(result['log_file'])))
+    return
+
+
+def main(run_dirs, processes=None):
+    """
+    Run the chunks of run directories scheduled with scheduler "local"
+    """
+    results = run_local_chains(run_dirs, processes=processes)
+    print_local_summary(results)
+    return int(any(i['exit_code'] != 0 for i in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:] or ['.']))
@@ -0,0 +1,248 @@
+"""
+Throughput analytics from the GEOS-Chem logs of a run (--analyse-logs)
+
+Notes
+-------
+ - The logs of completed chunks (OutputDir/YYYYMMDD.geos.log, or logs/ for
+ PBS) are memory mapped, and only the parts needed are searched (the last
+ "---> DATE:" line, the timers and the end banner), as logs can be hundreds
+ of MB
+ - The wall time of a chunk is from the "GEOS-Chem" timer if the run wrote
+ its timers, otherwise from the history store (see resource_history.py)
+ - A chunk is flagged as a regression if its simulated days per hour is
+ more than a threshold below the median of the campaign
+"""
+import os
+import re
+import mmap
+import datetime
+
+from utils import GEOS_CHEM_END_BANNER
+from input_geos import InputGeos
+from resume import COMPLETED_LOG_FILES
+from resource_history import load_history, save_history_records
+from resource_history import get_history_key, get_number_of_days
+
+DATE_MARKER = b'---> DATE:'
+DATE_RE = re.compile(rb'---> DATE:\s*(\d{4})/(\d{2})/(\d{2})\s+\w+:\s*(\d{2}):(\d{2})')
+TIMERS_MARKER = b'G E O S - C H E M   T I M E R S'
+TIMER_RE = re.compile(r'^\s*(.+?)\s*:\s*[\d\-:.]+\s+([\d.]+)\s*$')
+
+
+def read_log(log_file):
+    """
+    Get the last simulated time, timers and completion state from a log
+
+    Parameters
+    -------
+    log_file (str): Location of the GEOS-Chem log
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the "last_date" (datetime or None), "timers"
+     (seconds by timer name) and "complete" (bool) of the log
+    """
+    log = {'last_date': None, 'timers': {}, 'complete': False}
+    if os.path.getsize(log_file) == 0:
+        return log
+    with open(log_file, 'rb') as log_handle:
+        with mmap.mmap(log_handle.fileno(), 0,
+                       access=mmap.ACCESS_READ) as log_map:
+            position = log_map.rfind(DATE_MARKER)
+            if position >= 0:
+                match = DATE_RE.match(log_map[position:position+80])
+                if match:
+                    log['last_date'] = datetime.datetime(
+                        *[int(i) for i in match.groups()])
+            position = log_map.rfind(TIMERS_MARKER)
+            if position >= 0:
+                for line in log_map[position:].decode(
+                        errors='replace').splitlines()[1:]:
+                    match = TIMER_RE.match(line)
+                    if match:
+                        log['timers'][match.group(1)] = float(match.group(2))
+            tail = log_map[max(len(log_map)-4096, 0):]
+            lines = tail.decode(errors='replace').rstrip().splitlines()
+            log['complete'] = bool(lines) and \
+                (lines[-1].strip() == GEOS_CHEM_END_BANNER)
+    return log
+
+
+def get_chunk_end_time(start_time, run_dir='.'):
+    """
+    Get the end time of a chunk from its input.geos (or None)
+    """
+    input_file = os.path.join(run_dir, 'input_files',
+                              start_time + '.input.geos')
+    if not os.path.isfile(input_file):
+        return None
+    return InputGeos.from_file(input_file).end_date
+
+
+def analyse_run_directory_logs(run_dir='.', inputs=None, history=None):
+    """
+    Get the throughput of each chunk of a run directory from its logs
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    history (list): Records of the history store (default: load the store)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list has a dictionary for each chunk, with its simulated days,
+     wall time, simulated days per hour and core hours per simulated year
+    """
+    if history is None:
+        history = load_history(inputs.history_file)
+    real_run_dir = os.path.realpath(run_dir)
+    elapsed = {i['start_time']: i for i in history
+               if i.get('run_dir') == real_run_dir}
+    log_template = COMPLETED_LOG_FILES.get(inputs.scheduler,
+                                           COMPLETED_LOG_FILES['SLURM'])
+    log_dir = os.path.join(run_dir, os.path.dirname(log_template))
+    if not os.path.isdir(log_dir):
+        return []
+    chunks = []
+    for filename in sorted(os.listdir(log_dir)):
+        match = re.match(r'^(\d{8})\.geos\.log$', filename)
+        if not match:
+            continue
+        start_time = match.group(1)
+        log = read_log(os.path.join(log_dir, filename))
+        end_time = get_chunk_end_time(start_time, run_dir=run_dir)
+        if (end_time is None) or not log['complete']:
+            if log['last_date'] is not None:
+                end_time = log['last_date'].strftime("%Y%m%d")
+        n_days = get_number_of_days(start_time, end_time) if end_time else 0
+        wall_seconds = log['timers'].get('GEOS-Chem')
+        cpus = int(inputs.cpus_need)
+        if start_time in elapsed:
+            cpus = elapsed[start_time].get('cpus', cpus)
+            if wall_seconds is None:
+                wall_seconds = elapsed[start_time]['elapsed_seconds']
+        chunk = {
+            'run_dir': run_dir,
+            'start_time': start_time,
+            'end_time': end_time,
+            'complete': log['complete'],
+            'n_days': n_days,
+            'wall_seconds': wall_seconds,
+            'cpus': cpus,
+            'days_per_hour': None,
+            'core_hours_per_year': None,
+            'regression': False,
+        }
+        if wall_seconds and n_days:
+            chunk['days_per_hour'] = n_days / (wall_seconds / 3600.)
+            chunk['core_hours_per_year'] = \
+                wall_seconds / 3600. * cpus * 365.25 / n_days
+        chunks.append(chunk)
+    return chunks
+
+
+def get_median(values):
+    """
+    Get the median of a list of values
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle-1] + values[middle]) / 2.
+
+
+def flag_regressions(chunks, threshold=0.2):
+    """
+    Flag the chunks of a campaign that are slower than the rest
+
+    Parameters
+    -------
+    chunks (list): Chunks from analyse_run_directory_logs (of any runs)
+    threshold (float): Fraction below the median days per hour to flag
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Only complete chunks are compared
+    """
+    rates = [i['days_per_hour'] for i in chunks
+             if i['complete'] and i['days_per_hour']]
+    if not rates:
+        return chunks
+    median = get_median(rates)
+    for chunk in chunks:
+        chunk['regression'] = bool(chunk['complete'] and
+                                   chunk['days_per_hour'] and
+                                   (chunk['days_per_hour'] <
+                                    median * (1 - threshold)))
+    return chunks
+
+
+def record_log_history(chunks, run_dir='.', inputs=None):
+    """
+    Add the complete chunks timed from their logs to the history store
+
+    Notes
+    -------
+     - So chunk sizes can be predicted from logs when there is no accounting
+     (e.g. the local scheduler)
+     - The logs do not give the memory used, so "max_rss_mb" is None
+     - Returned list is the records added to the history store
+    """
+    key = get_history_key(run_dir, inputs)
+    real_run_dir = os.path.realpath(run_dir)
+    # Chunks already recorded (e.g. from the accounting) are not added again
+    recorded = set(i['start_time'] for i in load_history(inputs.history_file)
+                   if i.get('run_dir') == real_run_dir)
+    records = []
+    for chunk in chunks:
+        if not (chunk['complete'] and chunk['wall_seconds']):
+            continue
+        if chunk['start_time'] in recorded:
+            continue
+        record = dict(key)
+        record.update({
+            'job_id': 'log:{}:{}'.format(real_run_dir, chunk['start_time']),
+            'scheduler': inputs.scheduler,
+            'run_dir': real_run_dir,
+            'start_time': chunk['start_time'],
+            'end_time': chunk['end_time'],
+            'n_days': chunk['n_days'],
+            'elapsed_seconds': chunk['wall_seconds'],
+            'max_rss_mb': None,
+            'cpus': chunk['cpus'],
+        })
+        records.append(record)
+    return save_history_records(records, inputs.history_file)
+
+
+def print_log_analysis(chunks):
+    """
+    Print the throughput of each chunk (and flag any regressions)
+    """
+    PrtStr = "{:<40} {:>8} {:>8} {:>8} {:>6} {:>10} {:>12}  {}"
+    print(PrtStr.format('run_dir', 'start', 'end', 'complete', 'days',
+                        'days/hour', 'core-h/year', 'flag'))
+    for chunk in chunks:
+        rate = chunk['days_per_hour']
+        cost = chunk['core_hours_per_year']
+        print(PrtStr.format(
+            chunk['run_dir'], chunk['start_time'], str(chunk['end_time']),
+            str(chunk['complete']), chunk['n_days'],
+            '{:.2f}'.format(rate) if rate else '-',
+            '{:.0f}'.format(cost) if cost else '-',
+            'REGRESSION' if chunk['regression'] else ''))
+    return
@@ -0,0 +1,338 @@
+"""
+Monitor the jobs submitted for GEOS-Chem runs (--status and --watch)
+
+Notes
+-------
+ - The job scripts record the ID of each job they submit, with its chunk's
+ start time, in submitted_jobs.txt in the run directory
+ - All the jobs of all the run directories watched are polled with one
+ batched call per interval (sacct -j for SLURM, qstat -x -f for PBS) on an
+ asyncio loop, so slurmctld is not asked about each job separately
+ - The poll interval backs off (doubles, up to a maximum) while nothing
+ changes, and goes back to the start when something does
+ - The command can be set (inputs.monitor_command), e.g. to a fake scheduler
+"""
+import os
+import glob
+import time
+import asyncio
+
+from utils import parse_qstat_jobs
+
+# Where the job scripts record the jobs they submit
+SUBMITTED_JOBS_FILE = 'submitted_jobs.txt'
+# Commands to get the state of a list of jobs ({job_ids} is replaced)
+MONITOR_COMMANDS = {
+    'PBS': 'qstat -x -f {job_ids}',
+    'SLURM': 'sacct -n -P -X -o JobID,State -j {job_ids}',
+}
+# What separates the job IDs in each command (qstat takes a list of IDs)
+MONITOR_JOB_ID_SEPARATORS = {
+    'PBS': ' ',
+    'SLURM': ',',
+}
+# States after which a job will not change
+FINISHED_STATES = ('COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT',
+                   'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'BOOT_FAIL',
+                   'DEADLINE')
+# States of a chunk with no job the scheduler is known to be running
+STALLED_STATES = ('NOT SUBMITTED', 'UNKNOWN')
+# Polls a watch waits for a stalled run to change before giving up
+MAX_STALLED_POLLS = 3
+# Names of the PBS job states (job_state in qstat -f)
+PBS_STATES = {
+    'Q': 'PENDING',
+    'H': 'HELD',
+    'W': 'PENDING',
+    'R': 'RUNNING',
+    'E': 'RUNNING',
+    'B': 'RUNNING',
+}
+
+
+def get_scheduled_chunks(run_dir='.'):
+    """
+    Get the start times of the chunks created for a run directory
+
+    Notes
+    -------
+     - Found from the chunks' input files (input_files/YYYYMMDD.input.geos)
+    """
+    input_files = glob.glob(os.path.join(run_dir, 'input_files',
+                                         '*.input.geos'))
+    return sorted(os.path.basename(i).split('.')[0] for i in input_files)
+
+
+def load_submitted_jobs(run_dir='.'):
+    """
+    Load the jobs submitted for a run directory
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the ID of the latest job of each chunk by start
+     time (a resubmitted chunk replaces the earlier job)
+    """
+    jobs = {}
+    jobs_file = os.path.join(run_dir, SUBMITTED_JOBS_FILE)
+    if not os.path.isfile(jobs_file):
+        return jobs
+    with open(jobs_file, 'r') as submitted_jobs:
+        for line in submitted_jobs:
+            fields = line.split()
+            if len(fields) >= 2:
+                # sbatch --parsable can also give the cluster (ID;cluster)
+                jobs[fields[1]] = fields[0].split(';')[0]
+    return jobs
+
+
+def load_submitted_job_ids(run_dir='.'):
+    """
+    Load the chunk of every job submitted for a run directory
+
+    Notes
+    -------
+     - Returned dictionary is the start time of each job's chunk by job ID,
+     including jobs replaced by a resubmission (see load_submitted_jobs)
+    """
+    jobs = {}
+    jobs_file = os.path.join(run_dir, SUBMITTED_JOBS_FILE)
+    if not os.path.isfile(jobs_file):
+        return jobs
+    with open(jobs_file, 'r') as submitted_jobs:
+        for line in submitted_jobs:
+            fields = line.split()
+            if len(fields) >= 2:
+                jobs[fields[0].split(';')[0]] = fields[1]
+    return jobs
+
+
+def parse_sacct_states(sacct_output):
+    """
+    Parse sacct -P -o JobID,State into the state of each job ID
+    """
+    states = {}
+    for line in sacct_output.splitlines():
+        fields = line.strip().split('|')
+        if (len(fields) < 2) or ('.' in fields[0]):
+            continue
+        # e.g. "CANCELLED by 1234"
+        states[fields[0]] = fields[1].split()[0] if fields[1] else 'UNKNOWN'
+    return states
+
+
+def parse_qstat_states(qstat_output):
+    """
+    Parse qstat -x -f into the state of each job ID (named as for SLURM)
+    """
+    states = {}
+    for job in parse_qstat_jobs(qstat_output):
+        state = job.get('job_state')
+        if state == 'F':
+            state = 'COMPLETED'
+            if job.get('Exit_status', '0') != '0':
+                state = 'FAILED'
+        else:
+            state = PBS_STATES.get(state, state)
+        states[job['id']] = state
+        # qstat can give the full ID (e.g. "123.server") for "123"
+        states.setdefault(job['id'].split('.')[0], state)
+    return states
+
+
+async def poll_job_states(job_ids, scheduler='SLURM', command=None):
+    """
+    Get the state of every job with one call of the monitor command
+
+    Parameters
+    -------
+    job_ids (list): IDs of the jobs
+    scheduler (str): Scheduler the jobs were submitted to
+    command (str): Command to use, with {job_ids} (default: sacct/qstat)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - A command that fails is an error, rather than every job being
+     UNKNOWN. qstat also fails if any job has left its history, so for PBS
+     it is only an error if no job's state was given
+    """
+    if not job_ids:
+        return {}
+    if command is None:
+        command = MONITOR_COMMANDS[scheduler]
+    command = command.format(
+        job_ids=MONITOR_JOB_ID_SEPARATORS[scheduler].join(job_ids))
+    process = await asyncio.create_subprocess_shell(
+        command, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+    output, errors = await process.communicate()
+    output = output.decode(errors='replace')
+    if scheduler == 'PBS':
+        states = parse_qstat_states(output)
+    else:
+        states = parse_sacct_states(output)
+    AssStr = "Could not get the state of the jobs ({} exited with {}): {}"
+    assert (process.returncode == 0) or (scheduler == 'PBS' and states), \
+        AssStr.format(command, process.returncode,
+                      errors.decode(errors='replace').strip())
+    return states
+
+
+def get_chunk_states(chunks, jobs, states):
+    """
+    Get the state of each chunk of a run directory
+
+    Parameters
+    -------
+    chunks (list): Start times of the chunks of the run
+    jobs (dict): ID of the job of each chunk by start time
+    states (dict): State of each job by ID
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is of (start time, job ID, state) for each chunk
+    """
+    chunk_states = []
+    for start_time in chunks:
+        job_id = jobs.get(start_time)
+        if job_id is None:
+            state = 'NOT SUBMITTED'
+        else:
+            # Tasks of a job array are found by the ID of the array
+            state = states.get(job_id, states.get(job_id.split('_')[0],
+                                                  'UNKNOWN'))
+        chunk_states.append((start_time, job_id, state))
+    return chunk_states
+
+
+def print_chunk_states(run_states):
+    """
+    Print the state of each chunk of each run directory
+    """
+    PrtStr = "{:<40} {:>8} {:>12}  {}"
+    print(PrtStr.format('run_dir', 'start', 'job_id', 'state'))
+    for run_dir, chunk_states in run_states.items():
+        for start_time, job_id, state in chunk_states:
+            print(PrtStr.format(run_dir, start_time, str(job_id), state))
+    return
+
+
+def is_run_finished(chunk_states):
+    """
+    Will the chunks of a run not change state any more?
+
+    Notes
+    -------
+     - A run is finished when every chunk has completed, or one has finished
+     without completing (the chunks after it will not be submitted)
+    """
+    for start_time, job_id, state in chunk_states:
+        if state == 'COMPLETED':
+            continue
+        return state in FINISHED_STATES
+    return True
+
+
+def is_run_stalled(chunk_states):
+    """
+    Is a run waiting on chunks that have no job the scheduler knows of?
+
+    Notes
+    -------
+     - e.g. a chain that was never submitted, or whose job has left the
+     scheduler's accounting
+    """
+    unfinished = [i for i in chunk_states if i[2] != 'COMPLETED']
+    return bool(unfinished) and \
+        all(state in STALLED_STATES for _, _, state in unfinished)
+
+
+async def watch_jobs(run_chunks, scheduler='SLURM', command=None,
+                     interval=30., max_interval=600., once=False,
+                     verbose=True):
+    """
+    Poll the jobs of run directories until every run has finished
+
+    Parameters
+    -------
+    run_chunks (dict): Start times of the chunks of each run directory
+    scheduler (str): Scheduler the jobs were submitted to
+    command (str): Command to use, with {job_ids} (default: sacct/qstat)
+    interval (float): Seconds between polls (at the start)
+    max_interval (float): Longest time between polls when backing off
+    once (bool): Only poll once (--status)
+    verbose (bool): Print the state of the chunks after each poll
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the (start time, job ID, state) of each chunk
+     by run directory
+     - Runs with no job left to watch (see is_run_stalled) would never
+     finish, so the watch stops with a warning once every unfinished run has
+     stalled for MAX_STALLED_POLLS polls
+    """
+    wait = interval
+    last_states = None
+    stalled_polls = 0
+    while True:
+        run_jobs = {run_dir: load_submitted_jobs(run_dir)
+                    for run_dir in run_chunks}
+        job_ids = sorted(set(job_id for jobs in run_jobs.values()
+                             for job_id in jobs.values()))
+        states = await poll_job_states(job_ids, scheduler=scheduler,
+                                       command=command)
+        run_states = {run_dir: get_chunk_states(chunks, run_jobs[run_dir],
+                                                states)
+                      for run_dir, chunks in run_chunks.items()}
+        if verbose:
+            print(time.strftime("%Y-%m-%d %H:%M:%S"))
+            print_chunk_states(run_states)
+        if once or all(is_run_finished(i) for i in run_states.values()):
+            return run_states
+        stalled = [run_dir for run_dir, chunk_states in run_states.items()
+                   if is_run_stalled(chunk_states)]
+        unfinished = [run_dir for run_dir, chunk_states in run_states.items()
+                      if not is_run_finished(chunk_states)]
+        stalled_polls = stalled_polls + 1 if stalled == unfinished else 0
+        if stalled_polls >= MAX_STALLED_POLLS:
+            print("Stopped watching, as no job of these is queued or running "
+                  "(chunks NOT SUBMITTED or UNKNOWN):")
+            for run_dir in stalled:
+                print("  {}".format(run_dir))
+            return run_states
+        # Back off while nothing changes
+        if run_states == last_states:
+            wait = min(wait * 2, max_interval)
+        else:
+            wait = interval
+        last_states = run_states
+        await asyncio.sleep(wait)
+
+
+def run_monitor(run_chunks, scheduler='SLURM', command=None, interval=30.,
+                max_interval=600., once=False, verbose=True):
+    """
+    Run watch_jobs on an asyncio loop (see watch_jobs)
+    """
+    return asyncio.run(watch_jobs(
+        run_chunks, scheduler=scheduler, command=command, interval=interval,
+        max_interval=max_interval, once=once, verbose=verbose))
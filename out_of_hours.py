@@ -0,0 +1,247 @@
+"""
+Out of hours scheduling policy for geos-chem-schedule
+
+Notes
+-------
+ - Jobs may start outside of working hours (inputs.working_hours on
+ inputs.working_days), and at any time on the holidays listed in a local
+ calendar file (inputs.holidays_file, one YYYY-MM-DD date per line)
+ - The allowed windows are written to a table in the queue directory, which
+ a small script reads when a job is submitted, to give the scheduler the
+ start of the next window (--begin= for SLURM, -a for PBS). So jobs wait in
+ the queue rather than starting in working hours and resubmitting themselves
+ - The table covers a year. When it has less than OUT_OF_HOURS_MIN_DAYS
+ left, the script writes it again from then (by running this module), so
+ long runs keep starting out of hours
+"""
+import os
+import sys
+import stat
+import types
+import datetime
+
+# Names of the days (as used in inputs.working_days) by ISO weekday - 1
+DAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+# Files (in the queue directory) of the windows and the script that reads them
+WINDOWS_TABLE = 'out_of_hours_windows.txt'
+NEXT_WINDOW_SCRIPT = 'next_out_of_hours.sh'
+# Format of the start time, and the option to submit with, for each scheduler
+BEGIN_FORMATS = {
+    'PBS': '%Y%m%d%H%M',
+    'SLURM': '%Y-%m-%dT%H:%M:%S',
+}
+BEGIN_OPTIONS = {
+    'PBS': '-a "$(bash {script})" ',
+    'SLURM': '--begin="$(bash {script})" ',
+}
+# Days of windows written to the table, and the fewest left before it is
+# written again
+OUT_OF_HOURS_DAYS = 366
+OUT_OF_HOURS_MIN_DAYS = 30
+
+
+def get_working_hours(working_hours):
+    """
+    Get the start and end of working hours from a string (e.g. "08:00-18:00")
+
+    Returns
+    -------
+    (tuple)
+    """
+    start, end = [datetime.datetime.strptime(i.strip(), "%H:%M").time()
+                  for i in working_hours.split('-')]
+    AssStr = "Working hours must end after they start. Received {}"
+    assert start < end, AssStr.format(working_hours)
+    return start, end
+
+
+def load_holidays(holidays_file=None):
+    """
+    Load the dates of the holidays from a local calendar file
+
+    Parameters
+    -------
+    holidays_file (str): File with a YYYY-MM-DD date on each line (text after
+    a "#" is ignored)
+
+    Returns
+    -------
+    (set)
+    """
+    holidays = set()
+    if not holidays_file:
+        return holidays
+    with open(os.path.expanduser(holidays_file), 'r') as calendar_file:
+        for line in calendar_file:
+            line = line.split('#')[0].strip()
+            if line:
+                holidays.add(
+                    datetime.datetime.strptime(line, "%Y-%m-%d").date())
+    return holidays
+
+
+def get_out_of_hours_windows(start, inputs, n_days=OUT_OF_HOURS_DAYS,
+                             holidays=None):
+    """
+    Get the windows in which jobs may start
+
+    Parameters
+    -------
+    start (datetime.datetime): Time to get the windows from
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    n_days (int): Number of days to get the windows for
+    holidays (set): Dates of the holidays (default: load inputs.holidays_file)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is of (start, end) datetimes, with windows that touch
+     (e.g. over a weekend) merged into one
+    """
+    if holidays is None:
+        holidays = load_holidays(inputs.holidays_file)
+    work_start, work_end = get_working_hours(inputs.working_hours)
+    windows = []
+    day = start.date()
+    for n_day in range(n_days):
+        midnight = datetime.datetime.combine(day, datetime.time())
+        next_midnight = midnight + datetime.timedelta(days=1)
+        working_day = (DAY_NAMES[day.weekday()] in inputs.working_days) and \
+            (day not in holidays)
+        if working_day:
+            day_windows = [
+                (midnight, datetime.datetime.combine(day, work_start)),
+                (datetime.datetime.combine(day, work_end), next_midnight),
+            ]
+        else:
+            day_windows = [(midnight, next_midnight)]
+        for window_start, window_end in day_windows:
+            if windows and (windows[-1][1] == window_start):
+                windows[-1] = (windows[-1][0], window_end)
+            else:
+                windows.append((window_start, window_end))
+        day = next_midnight.date()
+    return [(max(i, start), j) for i, j in windows if j > start]
+
+
+def get_next_window_start(moment, windows):
+    """
+    Get the start of the next window (or the moment itself if in a window)
+    """
+    for window_start, window_end in windows:
+        if window_end > moment:
+            return max(window_start, moment)
+    return moment
+
+
+def write_out_of_hours_table(table_file, inputs, now=None):
+    """
+    Write the table of the windows in which jobs may start
+
+    Parameters
+    -------
+    table_file (str): Location of the table
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    now (datetime.datetime): Time to write the windows from (default: now)
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - The table has the start and end (seconds since the epoch) of each
+     window, so only date and awk are needed when a job submits the next one
+     - Written to a temporary file and then moved into place, as jobs may
+     read (or write) it at the same time
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    windows = get_out_of_hours_windows(now, inputs)
+    temporary_file = '{}.{}.tmp'.format(table_file, os.getpid())
+    with open(temporary_file, 'w') as table:
+        for window_start, window_end in windows:
+            table.write("{} {} {} {}\n".format(
+                int(window_start.timestamp()), int(window_end.timestamp()),
+                window_start.strftime("%Y-%m-%dT%H:%M"),
+                window_end.strftime("%Y-%m-%dT%H:%M")))
+    os.replace(temporary_file, table_file)
+    return
+
+
+def write_out_of_hours_files(queue_dir, inputs, scheduler, now=None):
+    """
+    Write the table of windows and the script that reads it at submission
+
+    Parameters
+    -------
+    queue_dir (str): Directory of the queue files
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    scheduler (str): Scheduler to format the start of the window for
+    now (datetime.datetime): Time to write the windows from (default: now)
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - The script writes the table again (with the same working hours, days
+     and holidays) once it has less than OUT_OF_HOURS_MIN_DAYS left
+    """
+    if not os.path.exists(queue_dir):
+        os.makedirs(queue_dir)
+    write_out_of_hours_table(os.path.join(queue_dir, WINDOWS_TABLE), inputs,
+                             now=now)
+    script_name = os.path.join(queue_dir, NEXT_WINDOW_SCRIPT)
+    with open(script_name, 'w') as script:
+        script.write("""#!/bin/bash
+# Print the start of the next out of hours window (now if in one)
+table="$(dirname "$0")/{table}"
+now=$(date +%s)
+# Write the table again from now if it is running out
+if [[ $(awk 'END {{ print $2 + 0 }}' "$table") -lt $(( now + {min_seconds} )) ]]; then
+  "{python}" "{module}" "$table" "{working_hours}" "{working_days}" "{holidays_file}" >&2
+fi
+window_start=$(awk -v now="$now" '$2 > now {{ print ($1 > now ? $1 : now); found = 1; exit }} END {{ if (!found) print now }}' "$table")
+date -d "@$window_start" +{begin_format}
+""".format(table=WINDOWS_TABLE, min_seconds=OUT_OF_HOURS_MIN_DAYS*86400,
+           python=sys.executable, module=os.path.abspath(__file__),
+           working_hours=inputs.working_hours,
+           working_days=','.join(inputs.working_days),
+           holidays_file=os.path.abspath(os.path.expanduser(
+               inputs.holidays_file)) if inputs.holidays_file else '',
+           begin_format=BEGIN_FORMATS[scheduler]))
+    st = os.stat(script_name)
+    os.chmod(script_name, st.st_mode | stat.S_IEXEC)
+    return
+
+
+def get_begin_option(scheduler, queue_dir):
+    """
+    Get the option to submit a job with so it starts in the next window
+
+    Parameters
+    -------
+    scheduler (str): Scheduler the job is submitted to
+    queue_dir (str): Directory of the queue files (relative to the run
+    directory the job is submitted from)
+
+    Returns
+    -------
+    (str)
+    """
+    script = os.path.join(queue_dir, NEXT_WINDOW_SCRIPT)
+    return BEGIN_OPTIONS[scheduler].format(script=script)
+
+
+if __name__ == '__main__':
+    # Run by the next window script to write its table again (see
+    # write_out_of_hours_files): table working_hours working_days holidays
+    table_file, working_hours, working_days, holidays_file = sys.argv[1:5]
+    write_out_of_hours_table(table_file, types.SimpleNamespace(
+        working_hours=working_hours, working_days=working_days.split(','),
+        holidays_file=holidays_file or None))
@@ -0,0 +1,363 @@
+"""
+Pick the partition (queue) to submit to from the live load of the cluster
+
+Notes
+-------
+ - The partitions (time limits, idle CPUs) are read from sinfo and the jobs
+ (expected starts of the pending ones, ends of the running ones) from squeue,
+ or the queues (limits, numbers of jobs) from "qstat -Qf" for PBS
+ - Each partition whose time limit fits a chunk's wall time is a candidate,
+ and the one with the earliest expected completion (start plus wall time)
+ is picked
+ - A job starts now if there are enough idle CPUs and it would end before
+ the next pending job's reservation (SLURM's backfill window). Otherwise it
+ waits behind the pending jobs until enough running jobs end. PBS gives no
+ expected starts, so the wait is guessed from the numbers of queued and
+ running jobs
+ - The command output can be captured to files (see PLACEMENT_COMMANDS) and
+ read instead, e.g. for testing
+"""
+import os
+import math
+import datetime
+import subprocess
+
+from utils import wall_time_to_seconds, seconds_to_wall_time
+
+# Commands to read the cluster's load, and their file in a capture directory
+PLACEMENT_COMMANDS = {
+    'SLURM': {
+        'partitions': ('sinfo -h -o "%R|%l|%a|%C"', 'sinfo.txt'),
+        'jobs': ('squeue -h -o "%P|%T|%S|%e|%C"', 'squeue.txt'),
+    },
+    'PBS': {
+        'partitions': ('qstat -Qf', 'qstat_Qf.txt'),
+    },
+}
+SQUEUE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def parse_time_limit(time_limit):
+    """
+    Parse a time limit (e.g. "2-00:00:00") to seconds (None if unlimited)
+    """
+    time_limit = time_limit.strip()
+    if (not time_limit) or (time_limit.lower() in ('infinite', 'unlimited',
+                                                   'n/a')):
+        return None
+    return wall_time_to_seconds(time_limit)
+
+
+def parse_squeue_time(squeue_time):
+    """
+    Parse a time from squeue (None if it is not known, e.g. "N/A")
+    """
+    try:
+        return datetime.datetime.strptime(squeue_time.strip(),
+                                          SQUEUE_TIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def parse_sinfo_output(sinfo_output):
+    """
+    Parse the output of sinfo (see PLACEMENT_COMMANDS) into partitions
+
+    Parameters
+    -------
+    sinfo_output (str): Output of sinfo
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Each partition is a dictionary of its "name", "max_wall_seconds" (None
+     if unlimited), whether it is "available", and its "idle_cpus" and
+     "total_cpus"
+     - Partitions listed more than once (e.g. by node state) are summed
+    """
+    partitions = {}
+    for line in sinfo_output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 4:
+            continue
+        name = fields[0].strip().rstrip('*')
+        cpus = [int(i) for i in fields[3].split('/')]
+        partition = partitions.setdefault(name, {
+            'name': name,
+            'max_wall_seconds': parse_time_limit(fields[1]),
+            'available': fields[2].strip() == 'up',
+            'idle_cpus': 0,
+            'total_cpus': 0,
+        })
+        partition['idle_cpus'] += cpus[1]
+        partition['total_cpus'] += cpus[3]
+    return list(partitions.values())
+
+
+def parse_squeue_output(squeue_output):
+    """
+    Parse the output of squeue (see PLACEMENT_COMMANDS) into jobs
+
+    Parameters
+    -------
+    squeue_output (str): Output of squeue
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Each job is a dictionary of its "partitions", "state", "start" (the
+     expected start of a pending job), "end" (the expected end of a running
+     job) and "cpus"
+    """
+    jobs = []
+    for line in squeue_output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 5:
+            continue
+        jobs.append({
+            'partitions': fields[0].strip().split(','),
+            'state': fields[1].strip(),
+            'start': parse_squeue_time(fields[2]),
+            'end': parse_squeue_time(fields[3]),
+            'cpus': int(fields[4]),
+        })
+    return jobs
+
+
+def parse_qstat_queues_output(qstat_output):
+    """
+    Parse the output of "qstat -Qf" into partitions (queues)
+
+    Parameters
+    -------
+    qstat_output (str): Output of qstat -Qf
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Each queue is a dictionary of its "name", "max_wall_seconds", whether
+     it is "available" (enabled and started), and its numbers of "queued" and
+     "running" jobs
+    """
+    partitions = []
+    partition = None
+    for line in qstat_output.splitlines():
+        line = line.strip()
+        if line.startswith('Queue:'):
+            partition = {'name': line.split(':', 1)[1].strip(),
+                         'max_wall_seconds': None, 'queued': 0, 'running': 0,
+                         'enabled': True, 'started': True}
+            partitions.append(partition)
+        elif (partition is None) or ('=' not in line):
+            continue
+        else:
+            key, value = [i.strip() for i in line.split('=', 1)]
+            if key == 'resources_max.walltime':
+                partition['max_wall_seconds'] = parse_time_limit(value)
+            elif key in ('enabled', 'started'):
+                partition[key] = value.lower() == 'true'
+            elif key == 'state_count':
+                counts = dict(i.split(':') for i in value.split())
+                partition['queued'] = int(counts.get('Queued', 0))
+                partition['running'] = int(counts.get('Running', 0))
+    for partition in partitions:
+        partition['available'] = partition.pop('enabled') and \
+            partition.pop('started')
+    return partitions
+
+
+def load_cluster_state(scheduler='SLURM', capture_dir=None):
+    """
+    Read the load of the cluster from its commands, or from captured output
+
+    Parameters
+    -------
+    scheduler (str): Scheduler of the cluster ("SLURM" or "PBS")
+    capture_dir (str): Directory of captured command output (default: run
+    the commands)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the "scheduler", its "partitions" and "jobs"
+    """
+    outputs = {}
+    for name, (command, filename) in PLACEMENT_COMMANDS[scheduler].items():
+        if capture_dir:
+            with open(os.path.join(capture_dir, filename), 'r') as capture:
+                outputs[name] = capture.read()
+        else:
+            outputs[name] = subprocess.run(
+                command, shell=True, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout
+    if scheduler == 'PBS':
+        return {'scheduler': scheduler, 'jobs': [],
+                'partitions': parse_qstat_queues_output(
+                    outputs['partitions'])}
+    return {'scheduler': scheduler,
+            'partitions': parse_sinfo_output(outputs['partitions']),
+            'jobs': parse_squeue_output(outputs['jobs'])}
+
+
+def estimate_SLURM_start(partition, jobs, wall_seconds, cpus, now):
+    """
+    Estimate when a job would start in a SLURM partition
+
+    Parameters
+    -------
+    partition (dict): Partition (see parse_sinfo_output)
+    jobs (list): Jobs on the cluster (see parse_squeue_output)
+    wall_seconds (float): Wall time of the job in seconds
+    cpus (int): CPUs the job needs
+    now (datetime.datetime): Time now
+
+    Returns
+    -------
+    (datetime.datetime)
+    """
+    jobs = [i for i in jobs if partition['name'] in i['partitions']]
+    pending = [i for i in jobs if i['state'] == 'PENDING']
+    reserved = sorted(i['start'] for i in pending if i['start'])
+    end = now + datetime.timedelta(seconds=wall_seconds)
+    # Backfill: start now if it ends before the next reservation
+    if (partition['idle_cpus'] >= cpus) and \
+            ((not pending) or (reserved and end <= reserved[0])):
+        return now
+    # Otherwise wait behind the pending jobs until enough CPUs are free
+    start = max([now] + reserved)
+    needed = cpus + sum(i['cpus'] for i in pending) - partition['idle_cpus']
+    running = sorted((i for i in jobs if (i['state'] == 'RUNNING') and
+                      i['end']), key=lambda i: i['end'])
+    for job in running:
+        if needed <= 0:
+            break
+        needed -= job['cpus']
+        start = max(start, job['end'])
+    return start
+
+
+def estimate_PBS_start(partition, wall_seconds, now):
+    """
+    Estimate when a job would start in a PBS queue
+
+    Notes
+    -------
+     - The queued jobs are guessed to run in waves as big as the jobs now
+     running, each as long as this job
+    """
+    if not partition['queued']:
+        return now
+    waves = math.ceil(partition['queued'] / float(max(partition['running'],
+                                                      1)))
+    return now + datetime.timedelta(seconds=waves*wall_seconds)
+
+
+def advise_placement(wall_time, cpus_need, cluster_state, now=None):
+    """
+    Rank the partitions a job fits in by when it would be expected to finish
+
+    Parameters
+    -------
+    wall_time (str): Wall time of the job (e.g. "12:00:00")
+    cpus_need (int): CPUs the job needs
+    cluster_state (dict): Load of the cluster (see load_cluster_state)
+    now (datetime.datetime): Time now (default: the time now)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is a dictionary for each candidate ("partition",
+     "wall_time", "start", "end"), with the earliest end first
+     - Partitions that are down, too short or too small are not candidates
+    """
+    if now is None:
+        now = datetime.datetime.now().replace(microsecond=0)
+    wall_seconds = wall_time_to_seconds(wall_time)
+    advice = []
+    for partition in cluster_state['partitions']:
+        fits = partition['available'] and \
+            ((partition['max_wall_seconds'] is None) or
+             (partition['max_wall_seconds'] >= wall_seconds)) and \
+            (partition.get('total_cpus', cpus_need) >= int(cpus_need))
+        if not fits:
+            continue
+        if cluster_state['scheduler'] == 'PBS':
+            start = estimate_PBS_start(partition, wall_seconds, now)
+        else:
+            start = estimate_SLURM_start(partition, cluster_state['jobs'],
+                                         wall_seconds, int(cpus_need), now)
+        advice.append({
+            'partition': partition['name'],
+            'wall_time': seconds_to_wall_time(wall_seconds),
+            'start': start,
+            'end': start + datetime.timedelta(seconds=wall_seconds),
+        })
+    AssStr = "No partition fits a wall time of {} with {} CPUs"
+    assert advice, AssStr.format(wall_time, cpus_need)
+    return sorted(advice, key=lambda i: (i['end'], i['partition']))
+
+
+def place_chunks(times, resources, inputs=None, cluster_state=None,
+                 now=None):
+    """
+    Pick the partition of each chunk from the load of the cluster
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    resources (dict): Resources of each chunk (e.g. predicted wall time)
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    cluster_state (dict): Load of the cluster (default: load_cluster_state)
+    now (datetime.datetime): Time now (default: the time now)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the resources of each chunk, with its
+     "queue_name" added
+     - Every chunk is placed as if submitted now, as the load is only known
+     now. Chunks that differ only in start time get the same partition
+    """
+    if cluster_state is None:
+        cluster_state = load_cluster_state(
+            inputs.scheduler, capture_dir=inputs.placement_capture_dir)
+    resources = {start_time: dict(resources.get(start_time, {}))
+                 for start_time in times[:-1]}
+    for start_time, chunk_resources in resources.items():
+        wall_time = chunk_resources.get('wall_time', inputs.wall_time)
+        best = advise_placement(wall_time, inputs.cpus_need, cluster_state,
+                                now=now)[0]
+        chunk_resources['queue_name'] = best['partition']
+    return resources
+
+
+def print_placement_advice(advice):
+    """
+    Print the candidate partitions, with the earliest end first
+    """
+    PrtStr = "{:<16} {:>10}  {:<19}  {:<19}"
+    print(PrtStr.format('partition', 'wall_time', 'expected_start',
+                        'expected_end'))
+    for candidate in advice:
+        print(PrtStr.format(candidate['partition'], candidate['wall_time'],
+                            candidate['start'].isoformat(sep=' '),
+                            candidate['end'].isoformat(sep=' ')))
+    return
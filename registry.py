@@ -0,0 +1,337 @@
+"""
+Campaign registry of GEOS-Chem runs for geos-chem-schedule
+
+Notes
+-------
+ - A SQLite database of every run directory scheduled, its chunks (dates and
+ the hashes of the files generated for them), and the jobs submitted for
+ them (state, run time and resource use)
+ - Indexed on state and date, so e.g. the runs with failed chunks or the
+ core hours used this month are a single query rather than a crawl over
+ every run directory
+ - Job states and resource use are brought up to date (sync_registry) with
+ one call of the monitor command and one of the accounting command for all
+ the registered runs
+"""
+import os
+import asyncio
+import hashlib
+import sqlite3
+import datetime
+import subprocess
+
+from monitor import load_submitted_jobs, poll_job_states, FINISHED_STATES
+from resource_history import ACCOUNTING_COMMANDS, parse_sacct_output
+from resource_history import parse_pbs_accounting_output
+
+REGISTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_dir TEXT PRIMARY KEY,
+    job_name TEXT,
+    scheduler TEXT,
+    step TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    run_dir TEXT NOT NULL REFERENCES runs(run_dir),
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    input_hash TEXT,
+    queue_file_hash TEXT,
+    job_id TEXT,
+    state TEXT NOT NULL DEFAULT 'NOT SUBMITTED',
+    PRIMARY KEY (run_dir, start_time)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    run_dir TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    state TEXT,
+    elapsed_seconds REAL,
+    max_rss_mb REAL,
+    cpus INTEGER,
+    end_time TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_state ON chunks (state);
+CREATE INDEX IF NOT EXISTS chunks_start_time ON chunks (start_time);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_end_time ON jobs (end_time);
+CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_dir, start_time);
+"""
+
+
+def connect_registry(registry_file):
+    """
+    Open the registry (creating it if needed)
+
+    Parameters
+    -------
+    registry_file (str): Location of the registry (SQLite database)
+
+    Returns
+    -------
+    (sqlite3.Connection)
+
+    Notes
+    -------
+     - Waits for other processes writing to the registry (e.g. a batch)
+    """
+    registry_file = os.path.expanduser(registry_file)
+    registry_dir = os.path.dirname(registry_file)
+    if registry_dir and not os.path.exists(registry_dir):
+        os.makedirs(registry_dir)
+    connection = sqlite3.connect(registry_file, timeout=60)
+    connection.executescript(REGISTRY_SCHEMA)
+    return connection
+
+
+def get_file_hash(filename):
+    """
+    Get the SHA-1 of a file's contents (None if there is no file)
+
+    Notes
+    -------
+     - The same hash as the content-addressed store (see utils)
+    """
+    if not os.path.isfile(filename):
+        return None
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_now():
+    """
+    Get the time now as a string (ISO 8601, to the second)
+    """
+    return datetime.datetime.now().replace(microsecond=0).isoformat()
+
+
+def register_run_directory(times, run_dir='.', inputs=None, queue_dir=None,
+                           extension=None):
+    """
+    Record a run directory and the chunks scheduled for it in the registry
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    queue_dir (str): Directory of the queue files within the run directory
+    extension (str): Extension of the queue files
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - Chunks scheduled again (e.g. when resuming) are replaced, and keep
+     their last job until a new one is recorded (see sync_registry)
+    """
+    run_dir = os.path.realpath(run_dir)
+    chunks = []
+    for start_time, end_time in zip(times[:-1], times[1:]):
+        input_file = os.path.join(run_dir, 'input_files',
+                                  start_time + '.input.geos')
+        queue_file = os.path.join(run_dir, queue_dir or '',
+                                  start_time + (extension or ''))
+        chunks.append((run_dir, start_time, end_time,
+                       get_file_hash(input_file), get_file_hash(queue_file)))
+    connection = connect_registry(inputs.registry_file)
+    with connection:
+        connection.execute(
+            "INSERT INTO runs (run_dir, job_name, scheduler, step, "
+            "start_date, end_date, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_dir) DO UPDATE SET job_name=excluded.job_name, "
+            "scheduler=excluded.scheduler, step=excluded.step, "
+            "updated_at=excluded.updated_at",
+            (run_dir, inputs.job_name, inputs.scheduler, inputs.step,
+             times[0], times[-1], get_now()))
+        # The run's dates cover every chunk ever scheduled
+        connection.execute(
+            "UPDATE runs SET start_date=MIN(start_date, ?), "
+            "end_date=MAX(end_date, ?) WHERE run_dir=?",
+            (times[0], times[-1], run_dir))
+        connection.executemany(
+            "INSERT INTO chunks (run_dir, start_time, end_time, input_hash, "
+            "queue_file_hash) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_dir, start_time) DO UPDATE SET "
+            "end_time=excluded.end_time, input_hash=excluded.input_hash, "
+            "queue_file_hash=excluded.queue_file_hash", chunks)
+    connection.close()
+    return
+
+
+def parse_end_time(end_time):
+    """
+    Parse the end of a job from sacct (ISO 8601) or qstat (e.g. "Tue Jan 12
+    10:00:00 2021") into ISO 8601 (None if it has not ended)
+    """
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%a %b %d %H:%M:%S %Y'):
+        try:
+            return datetime.datetime.strptime(
+                end_time, time_format).isoformat()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def sync_registry(inputs=None, accounting_output=None):
+    """
+    Bring the jobs of every registered run up to date
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    accounting_output (str): Output of the accounting command (default: run
+    inputs.accounting_command, or sacct/qstat)
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - New jobs are read from each run directory's submitted_jobs.txt
+     - The states of all the jobs not yet finished are polled with one call
+     (inputs.monitor_command, or sacct/qstat), and their run times and memory
+     use are read from the accounting
+    """
+    connection = connect_registry(inputs.registry_file)
+    with connection:
+        run_dirs = [i[0] for i in connection.execute(
+            "SELECT run_dir FROM runs")]
+        for run_dir in run_dirs:
+            for start_time, job_id in load_submitted_jobs(run_dir).items():
+                connection.execute(
+                    "INSERT OR IGNORE INTO jobs (job_id, run_dir, start_time, "
+                    "state) VALUES (?, ?, ?, 'SUBMITTED')",
+                    (job_id, run_dir, start_time))
+                connection.execute(
+                    "UPDATE chunks SET job_id=? WHERE run_dir=? AND "
+                    "start_time=?", (job_id, run_dir, start_time))
+        finished = ','.join('?' * len(FINISHED_STATES))
+        job_ids = [i[0] for i in connection.execute(
+            "SELECT job_id FROM jobs WHERE state NOT IN ({})".format(
+                finished), FINISHED_STATES)]
+        if job_ids:
+            states = asyncio.run(poll_job_states(
+                job_ids, scheduler=inputs.scheduler,
+                command=inputs.monitor_command))
+            if accounting_output is None:
+                accounting_command = inputs.accounting_command
+                if not accounting_command:
+                    accounting_command = ACCOUNTING_COMMANDS[inputs.scheduler]
+                accounting_output = subprocess.run(
+                    accounting_command, shell=True, stdout=subprocess.PIPE,
+                    universal_newlines=True).stdout
+            if inputs.scheduler == 'PBS':
+                accounting = parse_pbs_accounting_output(accounting_output)
+            else:
+                accounting = parse_sacct_output(accounting_output)
+            accounting = {i['job_id']: i for i in accounting}
+            for job_id in job_ids:
+                # Tasks of a job array are found by the ID of the array
+                state = states.get(job_id, states.get(job_id.split('_')[0]))
+                job = accounting.get(job_id, {})
+                connection.execute(
+                    "UPDATE jobs SET state=COALESCE(?, state), "
+                    "elapsed_seconds=COALESCE(?, elapsed_seconds), "
+                    "max_rss_mb=COALESCE(?, max_rss_mb), "
+                    "cpus=COALESCE(?, cpus), "
+                    "end_time=COALESCE(?, end_time) WHERE job_id=?",
+                    (state, job.get('elapsed_seconds'), job.get('max_rss_mb'),
+                     job.get('cpus'), parse_end_time(job.get('end_time')),
+                     job_id))
+        # Each chunk has the state of its latest job
+        connection.execute(
+            "UPDATE chunks SET state=(SELECT state FROM jobs WHERE "
+            "jobs.job_id=chunks.job_id) WHERE job_id IS NOT NULL")
+    connection.close()
+    return
+
+
+def get_failed_chunks(connection):
+    """
+    Get the chunks whose latest job finished without completing
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is of (run directory, start time, job ID, state)
+    """
+    failed = [i for i in FINISHED_STATES if i != 'COMPLETED']
+    return connection.execute(
+        "SELECT run_dir, start_time, job_id, state FROM chunks WHERE state "
+        "IN ({}) ORDER BY run_dir, start_time".format(
+            ','.join('?' * len(failed))), failed).fetchall()
+
+
+def get_chunk_state_counts(connection):
+    """
+    Get the number of chunks in each state
+    """
+    return dict(connection.execute(
+        "SELECT state, COUNT(*) FROM chunks GROUP BY state"))
+
+
+def get_core_hours(connection, since):
+    """
+    Get the core hours used by the jobs that ended since a time
+
+    Parameters
+    -------
+    connection (sqlite3.Connection): Open registry
+    since (datetime.datetime): Count the jobs that ended after this
+
+    Returns
+    -------
+    (float)
+    """
+    core_seconds = connection.execute(
+        "SELECT SUM(elapsed_seconds * cpus) FROM jobs WHERE end_time >= ?",
+        (since.isoformat(),)).fetchone()[0]
+    return (core_seconds or 0.) / 3600.
+
+
+def print_registry_report(inputs=None, now=None):
+    """
+    Print the state of the registered runs and the core hours used
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    now (datetime.datetime): Time now (default: the time now)
+
+    Returns
+    -------
+    (None)
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0,
+                              microsecond=0)
+    connection = connect_registry(inputs.registry_file)
+    n_runs = connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+    print("Registered runs: {}".format(n_runs))
+    for state, n_chunks in sorted(get_chunk_state_counts(connection).items()):
+        print("  {:<16} {:>6} chunks".format(state, n_chunks))
+    print("Core hours this month: {:.1f}".format(
+        get_core_hours(connection, month_start)))
+    failed_chunks = get_failed_chunks(connection)
+    if failed_chunks:
+        print("Failed chunks:")
+        PrtStr = "{:<40} {:>8} {:>12}  {}"
+        print(PrtStr.format('run_dir', 'start', 'job_id', 'state'))
+        for run_dir, start_time, job_id, state in failed_chunks:
+            print(PrtStr.format(run_dir, start_time, job_id, state))
+    connection.close()
+    return
@@ -0,0 +1,360 @@
+"""
+History of chunk run times and memory use for geos-chem-schedule
+
+Notes
+-------
+ - Elapsed time and maximum memory (MaxRSS) of finished chunks are collected
+ from the scheduler's accounting (sacct for SLURM, qstat -x -f for PBS) into a
+ local history store (a JSON lines file)
+ - Records are keyed by grid resolution, simulation (mechanism) and step, and
+ are used to size the wall time and memory of future chunks
+"""
+import os
+import json
+import datetime
+import subprocess
+
+from input_geos import InputGeos
+from utils import wall_time_to_seconds, seconds_to_wall_time
+from utils import memory_to_megabytes, parse_qstat_jobs, get_run_input_file
+from monitor import load_submitted_job_ids
+
+# Commands to get the accounting of the user's jobs
+ACCOUNTING_COMMANDS = {
+    'PBS': 'qstat -x -f -u "$USER"',
+    'SLURM': 'sacct -n -P -u "$USER" -S "$(date -d "-90 days" +%Y-%m-%d)" -o JobID,JobName,WorkDir,Elapsed,MaxRSS,State,AllocCPUS,End',
+}
+
+
+def get_history_key(run_dir='.', inputs=None):
+    """
+    Get the key (resolution, mechanism and step) of a run directory's chunks
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (dict)
+    """
+    input_geos = InputGeos.from_file(get_run_input_file(run_dir,
+                                                        'input.geos'))
+    mechanism = input_geos.get_setting('Simulation name')
+    if mechanism is None:
+        mechanism = input_geos.get_setting('Type of simulation')
+    return {
+        'resolution': input_geos.get_setting('Grid resolution'),
+        'mechanism': mechanism,
+        'step': inputs.step,
+    }
+
+
+def load_history(history_file):
+    """
+    Load the records of the history store
+
+    Parameters
+    -------
+    history_file (str): Location of the history store (JSON lines)
+
+    Returns
+    -------
+    (list)
+    """
+    if not os.path.isfile(history_file):
+        return []
+    with open(history_file, 'r') as history:
+        return [json.loads(line) for line in history if line.strip()]
+
+
+def save_history_records(records, history_file):
+    """
+    Add records to the history store, skipping jobs already recorded
+
+    Parameters
+    -------
+    records (list): Records (dictionaries) to add
+    history_file (str): Location of the history store (JSON lines)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the records that were added
+    """
+    job_ids = set(i['job_id'] for i in load_history(history_file))
+    new_records = [i for i in records if i['job_id'] not in job_ids]
+    if not new_records:
+        return []
+    history_dir = os.path.dirname(history_file)
+    if history_dir and not os.path.exists(history_dir):
+        os.makedirs(history_dir)
+    with open(history_file, 'a') as history:
+        for record in new_records:
+            history.write(json.dumps(record, sort_keys=True) + '\n')
+    return new_records
+
+
+def parse_sacct_output(sacct_output):
+    """
+    Parse sacct -P -o JobID,JobName,WorkDir,Elapsed,MaxRSS,State,AllocCPUS,End
+
+    Parameters
+    -------
+    sacct_output (str): Output of sacct
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list has a dictionary for each job, with the largest MaxRSS of
+     any of the job's steps
+    """
+    jobs = {}
+    for line in sacct_output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 7:
+            continue
+        job_id, job_name, work_dir, elapsed, max_rss, state, cpus = fields[:7]
+        base_job_id = job_id.split('.')[0]
+        if base_job_id == job_id:
+            job = jobs.setdefault(base_job_id, {'max_rss_mb': 0.0})
+            job.update({
+                'job_id': job_id,
+                'job_name': job_name,
+                'work_dir': work_dir,
+                'elapsed_seconds': wall_time_to_seconds(elapsed),
+                'state': state.split()[0] if state else state,
+                'cpus': int(cpus or 1),
+                'end_time': fields[7] if len(fields) > 7 else None,
+            })
+        if max_rss:
+            job = jobs.setdefault(base_job_id, {'max_rss_mb': 0.0})
+            job['max_rss_mb'] = max(job['max_rss_mb'],
+                                    memory_to_megabytes(max_rss))
+    return [i for i in jobs.values() if 'job_id' in i]
+
+
+def parse_pbs_accounting_output(qstat_output):
+    """
+    Parse the output of qstat -x -f into the same form as parse_sacct_output
+
+    Parameters
+    -------
+    qstat_output (str): Output of qstat -x -f
+
+    Returns
+    -------
+    (list)
+    """
+    jobs = []
+    for job in parse_qstat_jobs(qstat_output):
+        if 'resources_used.walltime' not in job:
+            continue
+        variables = dict(i.split('=', 1) for i in
+                         job.get('Variable_List', '').split(',') if '=' in i)
+        state = 'RUNNING'
+        if job.get('job_state') == 'F':
+            state = 'COMPLETED'
+            if job.get('Exit_status', '0') != '0':
+                state = 'FAILED'
+        jobs.append({
+            'job_id': job['id'],
+            'job_name': job.get('Job_Name'),
+            'work_dir': variables.get('PBS_O_WORKDIR'),
+            'elapsed_seconds': wall_time_to_seconds(
+                job['resources_used.walltime']),
+            'max_rss_mb': memory_to_megabytes(
+                job.get('resources_used.mem', '0')),
+            'state': state,
+            'cpus': int(job.get('resources_used.ncpus', 1)),
+            'end_time': job.get('obittime'),
+        })
+    return jobs
+
+
+def collect_run_directory_history(times, run_dir='.', inputs=None,
+                                  accounting_output=None):
+    """
+    Collect the run time and memory use of a run directory's finished chunks
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    accounting_output (str): Output of the accounting command (default: run
+    inputs.accounting_command, or sacct/qstat)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the records added to the history store
+     - Jobs are matched to chunks by their IDs in submitted_jobs.txt (job
+     names are cut to 15 characters, so are not unique) and their working
+     directory
+    """
+    if accounting_output is None:
+        accounting_command = inputs.accounting_command
+        if not accounting_command:
+            accounting_command = ACCOUNTING_COMMANDS[inputs.scheduler]
+        accounting_output = subprocess.run(
+            accounting_command, shell=True, stdout=subprocess.PIPE,
+            universal_newlines=True).stdout
+    if inputs.scheduler == 'PBS':
+        jobs = parse_pbs_accounting_output(accounting_output)
+    else:
+        jobs = parse_sacct_output(accounting_output)
+
+    end_times = dict(zip(times[:-1], times[1:]))
+    job_ids = load_submitted_job_ids(run_dir)
+    key = get_history_key(run_dir, inputs)
+    real_run_dir = os.path.realpath(run_dir)
+    records = []
+    for job in jobs:
+        start_time = job_ids.get(job['job_id'])
+        if job['state'] != 'COMPLETED' or start_time not in end_times:
+            continue
+        if job['work_dir'] and os.path.realpath(job['work_dir']) != \
+                real_run_dir:
+            continue
+        end_time = end_times[start_time]
+        record = dict(key)
+        record.update({
+            'job_id': job['job_id'],
+            'scheduler': inputs.scheduler,
+            'run_dir': real_run_dir,
+            'start_time': start_time,
+            'end_time': end_time,
+            'n_days': get_number_of_days(start_time, end_time),
+            'elapsed_seconds': job['elapsed_seconds'],
+            'max_rss_mb': job['max_rss_mb'],
+            'cpus': job['cpus'],
+        })
+        records.append(record)
+    return save_history_records(records, inputs.history_file)
+
+
+def get_number_of_days(start_time, end_time):
+    """
+    Get the number of days between two times in the format YYYYMMDD
+    """
+    start_datetime = datetime.datetime.strptime(start_time, "%Y%m%d")
+    end_datetime = datetime.datetime.strptime(end_time, "%Y%m%d")
+    return (end_datetime - start_datetime).days
+
+
+def get_quantile(values, quantile):
+    """
+    Get a quantile (0-1) of a list of values, interpolating between them
+    """
+    values = sorted(values)
+    position = (len(values)-1) * quantile
+    lower = int(position)
+    upper = min(lower+1, len(values)-1)
+    return values[lower] + (values[upper]-values[lower]) * (position-lower)
+
+
+def get_history_samples(history, key, min_samples=3):
+    """
+    Get the history records that match a key
+
+    Parameters
+    -------
+    history (list): Records of the history store
+    key (dict): Resolution, mechanism and step of the chunks
+    min_samples (int): Minimum number of records to use
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Records for the same step are used if there are enough of them, if
+     not then records for any step of the same resolution and mechanism
+    """
+    same_run = [i for i in history
+                if (i.get('resolution') == key['resolution'])
+                and (i.get('mechanism') == key['mechanism'])
+                and (i.get('n_days', 0) > 0)]
+    same_step = [i for i in same_run if i.get('step') == key['step']]
+    if len(same_step) >= min_samples:
+        return same_step
+    if len(same_run) >= min_samples:
+        return same_run
+    return []
+
+
+def predict_chunk_resources(times, run_dir='.', inputs=None, history=None):
+    """
+    Predict the wall time and memory each chunk of a run needs from history
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    history (list): Records of the history store (default: load the store)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the "wall_time" and "memory_need" of each chunk
+     by start time, or is empty if there is not enough history
+     - Sized from a quantile (inputs.resource_quantile) of the seconds per
+     simulated day and memory of past chunks, plus a safety margin
+     (inputs.resource_margin)
+     - Chunks predicted to need more than inputs.max_wall_time are rejected,
+     as they would be killed before they finish
+     - If no past chunk has a known memory, memory_need is left as
+     inputs.memory_need
+    """
+    if history is None:
+        history = load_history(inputs.history_file)
+    samples = get_history_samples(history, get_history_key(run_dir, inputs),
+                                  min_samples=inputs.min_history_samples)
+    if not samples:
+        return {}
+    quantile = inputs.resource_quantile
+    margin = 1 + inputs.resource_margin
+    seconds_per_day = get_quantile(
+        [i['elapsed_seconds']/i['n_days'] for i in samples], quantile)
+    max_wall_time = wall_time_to_seconds(inputs.max_wall_time)
+    # Chunks timed from their logs have no memory (None)
+    memories = [i['max_rss_mb'] for i in samples
+                if i.get('max_rss_mb') is not None]
+    memory_need = inputs.memory_need
+    if memories:
+        memory = get_quantile(memories, quantile)
+        # SLURM requests memory per CPU, PBS for the whole job
+        if inputs.scheduler == 'SLURM':
+            memory_per_cpu = memory * margin / int(inputs.cpus_need)
+            memory_need = "{}M".format(int(-(-memory_per_cpu // 1)))
+        else:
+            memory_need = "{}mb".format(int(-(-memory*margin // 1)))
+    resources = {}
+    for start_time, end_time in zip(times[:-1], times[1:]):
+        n_days = get_number_of_days(start_time, end_time)
+        wall_time = seconds_per_day*n_days*margin
+        AssStr = "Chunk {} is predicted to need {}, more than max_wall_time ({}).\nShorten the step or use step=auto"
+        assert wall_time <= max_wall_time, AssStr.format(
+            start_time, seconds_to_wall_time(wall_time),
+            inputs.max_wall_time)
+        resources[start_time] = {
+            'wall_time': seconds_to_wall_time(wall_time),
+            'memory_need': memory_need,
+        }
+    return resources
@@ -0,0 +1,170 @@
+"""
+Resume a broken chain of GEOS-Chem jobs for geos-chem-schedule
+
+Notes
+-------
+ - A chunk has completed if its log (moved to OutputDir/ by the SLURM job, or
+ in logs/ for PBS) ends with the GEOS-Chem end banner, or if the restart file
+ for the chunk's end date exists
+ - Chunks already queued or running are found from the scheduler (squeue or
+ qstat) so they are never submitted twice
+"""
+import os
+import subprocess
+
+from utils import is_GEOS_Chem_log_complete, parse_qstat_jobs
+from monitor import load_submitted_job_ids
+
+# Where each scheduler's job leaves the log of a completed chunk
+COMPLETED_LOG_FILES = {
+    'PBS': 'logs/{start_time}.geos.log',
+    'SLURM': 'OutputDir/{start_time}.geos.log',
+    'local': 'OutputDir/{start_time}.geos.log',
+}
+# Commands to list the user's queued or running jobs
+QUEUE_STATUS_COMMANDS = {
+    'PBS': 'qstat -f -u "$USER"',
+    'SLURM': 'squeue -h -u "$USER" -o "%i|%T|%o"',
+}
+# Queue files (relative to the run directory) by scheduler
+QUEUE_FILES = {
+    'PBS': 'PBS_queue_files/{start_time}.pbs',
+    'SLURM': 'SLURM_queue_files/{start_time}.sbatch',
+}
+
+
+def get_completed_chunks(times, run_dir='.', inputs=None):
+    """
+    Get the start times of the chunks of a run that have completed
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+
+    Returns
+    -------
+    (set)
+    """
+    log_file_template = COMPLETED_LOG_FILES[inputs.scheduler]
+    completed = set()
+    for start_time, end_time in zip(times[:-1], times[1:]):
+        log_file = os.path.join(
+            run_dir, log_file_template.format(start_time=start_time))
+        restart_file = os.path.join(
+            run_dir, inputs.restart_file_template.format(date=end_time))
+        if is_GEOS_Chem_log_complete(log_file) or os.path.isfile(restart_file):
+            completed.add(start_time)
+    return completed
+
+
+def parse_squeue_output(queue_output):
+    """
+    Parse the output of squeue -o "%i|%T|%o" into (job ID, state, script)
+    """
+    jobs = []
+    for line in queue_output.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) == 3:
+            jobs.append(tuple(fields))
+    return jobs
+
+
+def parse_qstat_output(queue_output):
+    """
+    Parse the output of qstat -f into (job ID, state, job name)
+    """
+    return [(job['id'], job.get('job_state'), job.get('Job_Name'))
+            for job in parse_qstat_jobs(queue_output)]
+
+
+def get_queued_chunks(times, run_dir='.', inputs=None, queue_output=None):
+    """
+    Get the chunks of a run that are queued or running
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    queue_output (str): Output of the queue status command (default: run it)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the job ID of each queued chunk by start time
+     - SLURM jobs are matched by their queue file, PBS jobs by their IDs in
+     submitted_jobs.txt (job names are cut to 15 characters, so are not
+     unique)
+     - If a SLURM job array of the run is queued, all chunks are queued
+     - Nothing is ever queued without a scheduler (scheduler "local")
+    """
+    if inputs.scheduler not in QUEUE_STATUS_COMMANDS:
+        return {}
+    if queue_output is None:
+        queue_output = subprocess.run(
+            QUEUE_STATUS_COMMANDS[inputs.scheduler], shell=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    queued = {}
+    if inputs.scheduler == 'SLURM':
+        queue_files = {}
+        for start_time in times[:-1]:
+            queue_file = os.path.join(
+                run_dir, QUEUE_FILES['SLURM'].format(start_time=start_time))
+            queue_files[os.path.realpath(queue_file)] = start_time
+        array_file = os.path.realpath(
+            os.path.join(run_dir, 'SLURM_queue_files/array.sbatch'))
+        for job_id, state, command in parse_squeue_output(queue_output):
+            start_time = queue_files.get(os.path.realpath(command))
+            if start_time:
+                queued[start_time] = job_id
+            # A queued job array will run all the chunks still to run
+            elif os.path.realpath(command) == array_file:
+                queued.update({i: job_id.split('_')[0] for i in times[:-1]})
+    elif inputs.scheduler == 'PBS':
+        job_ids = load_submitted_job_ids(run_dir)
+        for job_id, state, job_name in parse_qstat_output(queue_output):
+            start_time = job_ids.get(job_id)
+            if (state != 'F') and (start_time in times[:-1]):
+                queued[start_time] = job_id
+    return queued
+
+
+def get_times_to_resume(times, completed, queued):
+    """
+    Get the times still to be run and the job these should depend on
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    completed (set): Start times of the chunks that have completed
+    queued (dict): Job IDs of the chunks queued or running by start time
+
+    Returns
+    -------
+    (tuple)
+
+    Notes
+    -------
+     - Returned tuple is the list of times from the first chunk that has
+     neither completed nor been queued (to the end of the run), and the job ID
+     of the queued chunk before it (or None)
+    """
+    n_time = 0
+    while (n_time < len(times)-1) and \
+            ((times[n_time] in completed) or (times[n_time] in queued)):
+        n_time += 1
+    times_to_resume = times[n_time:]
+    # Never duplicate a chunk that is already queued or running
+    queued_later = [i for i in times_to_resume[:-1] if i in queued]
+    AssStr = "Chunks {} are already queued (job IDs {}), but earlier chunks have not run.\nCancel these jobs before resuming."
+    assert not queued_later, AssStr.format(
+        queued_later, [queued[i] for i in queued_later])
+    dependency = None
+    if n_time > 0:
+        dependency = queued.get(times[n_time-1])
+    return times_to_resume, dependency
@@ -0,0 +1,265 @@
+"""
+Retry failed GEOS-Chem chunks for geos-chem-schedule
+
+Notes
+-------
+ - Each chunk's job submits a small retry job that only runs if the chunk
+ fails (--dependency=afternotok), which runs this script
+ - The failure is classified from the scheduler's state of the job and the
+ end of its log: node failure, timeout, out of memory, or a model error
+ - Node failures are resubmitted as they were, timeouts with a longer wall
+ time and out of memory failures with more memory, up to a number of
+ retries per chunk. Model errors (and anything not recognised) are never
+ retried
+ - The chunk after it (if already submitted) is made to depend on the new
+ job, so the chain carries on
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import asyncio
+import subprocess
+
+from utils import wall_time_to_seconds, seconds_to_wall_time
+from utils import memory_to_megabytes
+from monitor import load_submitted_jobs, poll_job_states, SUBMITTED_JOBS_FILE
+
+# Settings (written when the run is scheduled) and attempts of each chunk
+RETRY_POLICY_FILE = 'SLURM_queue_files/retry_policy.json'
+RETRY_STATE_FILE = 'queue_output/{start_time}.retry.json'
+# Commands to resubmit a chunk and to move the next chunk's dependency
+RETRY_COMMANDS = {
+    'submit': 'sbatch --parsable {begin_option}--time={wall_time} --mem-per-cpu={memory_need} {queue_file}',
+    'update': 'scontrol update JobId={job_id} Dependency=afterok:{new_job_id}',
+}
+# Failures from the scheduler's state of the job
+SCHEDULER_FAILURES = {
+    'NODE_FAIL': 'node_fail',
+    'BOOT_FAIL': 'node_fail',
+    'PREEMPTED': 'node_fail',
+    'TIMEOUT': 'timeout',
+    'DEADLINE': 'timeout',
+    'OUT_OF_MEMORY': 'oom',
+    'CANCELLED': 'cancelled',
+}
+# Failures from the end of the log (the first match wins)
+LOG_FAILURES = [
+    (re.compile(r'DUE TO TIME LIMIT'), 'timeout'),
+    (re.compile(r'oom[-_ ]kill|Out Of Memory|Exceeded job memory limit',
+                re.IGNORECASE), 'oom'),
+    (re.compile(r'DUE TO NODE FAILURE|Node failure', re.IGNORECASE),
+     'node_fail'),
+]
+# Failures worth resubmitting
+RETRYABLE_FAILURES = ('node_fail', 'timeout', 'oom')
+
+
+def get_log_tail(log_file, n_bytes=16384):
+    """
+    Get the end of a log file (empty if there is no log)
+    """
+    if not os.path.isfile(log_file):
+        return ''
+    with open(log_file, 'rb') as log:
+        log.seek(max(os.path.getsize(log_file) - n_bytes, 0))
+        return log.read().decode(errors='replace')
+
+
+def classify_failure(state, log_tail):
+    """
+    Classify why a chunk failed
+
+    Parameters
+    -------
+    state (str): Scheduler's state of the job (e.g. "TIMEOUT")
+    log_tail (str): End of the chunk's log
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - One of "node_fail", "timeout", "oom", "cancelled" or "model_error"
+     - The scheduler's state is used if it says why, otherwise the log. A
+     failure that is not recognised is a model error
+    """
+    if state in SCHEDULER_FAILURES:
+        return SCHEDULER_FAILURES[state]
+    for pattern, failure in LOG_FAILURES:
+        if pattern.search(log_tail):
+            return failure
+    return 'model_error'
+
+
+def get_queue_file_resources(queue_file):
+    """
+    Get the wall time and memory (per CPU) requested by a SLURM queue file
+    """
+    resources = {}
+    with open(queue_file, 'r') as queue:
+        for line in queue:
+            if line.startswith('#SBATCH --time='):
+                resources['wall_time'] = line.split('=', 1)[1].strip()
+            elif line.startswith('#SBATCH --mem-per-cpu='):
+                resources['memory_need'] = line.split('=', 1)[1].strip()
+    return resources
+
+
+def get_retry_resources(failure, resources, policy):
+    """
+    Get the wall time and memory to resubmit a chunk with
+
+    Parameters
+    -------
+    failure (str): Why the chunk failed (see classify_failure)
+    resources (dict): "wall_time" and "memory_need" of the failed job
+    policy (dict): Retry settings (see RETRY_POLICY_FILE)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - A timeout gets a longer wall time (up to the maximum wall time), and
+     out of memory gets more memory
+    """
+    resources = dict(resources)
+    if failure == 'timeout':
+        wall_time = wall_time_to_seconds(resources['wall_time']) * \
+            float(policy['wall_time_factor'])
+        wall_time = min(wall_time,
+                        wall_time_to_seconds(policy['max_wall_time']))
+        resources['wall_time'] = seconds_to_wall_time(wall_time)
+    elif failure == 'oom':
+        memory = resources['memory_need']
+        # SLURM memory without a unit is in megabytes
+        if memory.isdigit():
+            memory += 'M'
+        memory = memory_to_megabytes(memory) * float(policy['memory_factor'])
+        resources['memory_need'] = "{}M".format(int(-(-memory // 1)))
+    return resources
+
+
+def load_json(filename, default=None):
+    """
+    Load a JSON file (default if there is no file)
+    """
+    if not os.path.isfile(filename):
+        return default
+    with open(filename, 'r') as json_file:
+        return json.load(json_file)
+
+
+def save_json(contents, filename):
+    """
+    Save a JSON file, moving it into place so it is never half written
+    """
+    with open(filename + '.tmp', 'w') as json_file:
+        json.dump(contents, json_file, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+    return
+
+
+def retry_chunk(start_time, job_id, run_dir='.', state=None):
+    """
+    Resubmit a failed chunk if its failure is worth retrying
+
+    Parameters
+    -------
+    start_time (str): Start of the chunk in the format YYYYMMDD
+    job_id (str): ID of the job of the chunk that failed
+    run_dir (str): GEOS-Chem run directory
+    state (str): Scheduler's state of the job (default: poll sacct)
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the "failure", the number of "attempts" made
+     and the "job_id" of the new job (None if not resubmitted)
+     - The failed log is kept as queue_output/<start>.geos.log.<job ID>
+    """
+    policy = load_json(os.path.join(run_dir, RETRY_POLICY_FILE))
+    queue_file = os.path.join('SLURM_queue_files', start_time + '.sbatch')
+    if state is None:
+        states = asyncio.run(poll_job_states([job_id], scheduler='SLURM'))
+        state = states.get(job_id, 'UNKNOWN')
+    log_file = os.path.join(run_dir, start_time + '.geos.log')
+    failure = classify_failure(state, get_log_tail(log_file))
+    if os.path.isfile(log_file):
+        shutil.copy(log_file, os.path.join(
+            run_dir, 'queue_output',
+            '{}.geos.log.{}'.format(start_time, job_id)))
+
+    state_file = os.path.join(run_dir,
+                              RETRY_STATE_FILE.format(start_time=start_time))
+    retry_state = load_json(state_file, default={'attempts': []})
+    resources = retry_state.get('resources') or get_queue_file_resources(
+        os.path.join(run_dir, queue_file))
+    retry_state['attempts'].append({'job_id': job_id, 'state': state,
+                                    'failure': failure})
+    result = {'failure': failure, 'attempts': len(retry_state['attempts']),
+              'job_id': None}
+    if failure not in RETRYABLE_FAILURES:
+        print("Chunk {} failed ({}), so is not retried".format(
+            start_time, failure))
+    elif len(retry_state['attempts']) > int(policy['max_retries']):
+        print("Chunk {} failed ({}), but has been retried {} times".format(
+            start_time, failure, policy['max_retries']))
+    else:
+        resources = get_retry_resources(failure, resources, policy)
+        # Out of hours runs wait for the next window (see out_of_hours.py)
+        command = RETRY_COMMANDS['submit'].format(
+            queue_file=queue_file,
+            begin_option=policy.get('begin_option', ''), **resources)
+        new_job_id = subprocess.run(
+            command, shell=True, cwd=run_dir, stdout=subprocess.PIPE,
+            universal_newlines=True).stdout.strip().split(';')[0]
+        if new_job_id:
+            print("Chunk {} failed ({}), resubmitted as job {}".format(
+                start_time, failure, new_job_id))
+            result['job_id'] = new_job_id
+            retry_state['resources'] = resources
+            # Move the next chunk (if submitted) onto the new job
+            next_job_id = get_next_chunk_job(start_time, run_dir=run_dir)
+            with open(os.path.join(run_dir, SUBMITTED_JOBS_FILE),
+                      'a') as submitted_jobs:
+                submitted_jobs.write('{} {}\n'.format(new_job_id, start_time))
+            if next_job_id:
+                subprocess.run(RETRY_COMMANDS['update'].format(
+                    job_id=next_job_id, new_job_id=new_job_id), shell=True,
+                    cwd=run_dir)
+    save_json(retry_state, state_file)
+    return result
+
+
+def get_next_chunk_job(start_time, run_dir='.'):
+    """
+    Get the job ID of the chunk after a chunk (None if not yet submitted)
+    """
+    input_files = os.path.join(run_dir, 'input_files')
+    chunks = sorted(i.split('.')[0] for i in os.listdir(input_files)
+                    if i.endswith('.input.geos'))
+    later_chunks = [i for i in chunks if i > start_time]
+    if not later_chunks:
+        return None
+    return load_submitted_jobs(run_dir).get(later_chunks[0])
+
+
+def main():
+    """
+    Retry a failed chunk: retry.py <run directory> <start time> <job ID>
+    """
+    run_dir, start_time, job_id = sys.argv[1:4]
+    retry_chunk(start_time, job_id, run_dir=run_dir)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Parallel-in-time segments of a GEOS-Chem run for geos-chem-schedule
+
+Notes
+-------
+ - A long run is split into independent segments that run at the same time,
+ each in its own directory (segments/<start>/) with its own chain of chunks
+ - Each segment (after the 1st) starts a spin-up period before its own start
+ from an approximate restart (e.g. a climatological one, or the run's
+ initial restart), so its output is only an approximation of a serial run
+ - The output of each segment's spin-up is discarded when the segments are
+ stitched back together in the run directory's OutputDir
+"""
+import os
+import re
+import fnmatch
+import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from input_geos import InputGeos
+from utils import get_run_input_file
+
+SEGMENTS_DIR = 'segments'
+SEGMENTS_MANIFEST = 'segments/segments.txt'
+# Run directory files not shared with the segments (they have their own)
+SEGMENT_OWN_FILES = ['input.geos', 'input.geos.orig', 'OutputDir',
+                     'input_files', 'queue_output', 'logs', SEGMENTS_DIR,
+                     'submitted_jobs.txt', 'feeder_state.json', 'HEMCO.log',
+                     '*_queue_files', 'run_geos_*.sh', '*.log', '*.bpch']
+DATE_RE = re.compile(r'(?<!\d)(\d{8})(?!\d)')
+
+
+def get_segment_times(start_time, end_time, n_segments):
+    """
+    Split a run into segments of (nearly) equal length
+
+    Parameters
+    -------
+    start_time (str): Start of the run in the format YYYYMMDD
+    end_time (str): End of the run in the format YYYYMMDD
+    n_segments (int): Number of segments
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the n_segments+1 boundaries of the segments
+     - Segments start on the 1st of a month if the run does and is long
+     enough, otherwise they are split by days
+    """
+    start = datetime.datetime.strptime(start_time, "%Y%m%d")
+    end = datetime.datetime.strptime(end_time, "%Y%m%d")
+    delta = relativedelta(end, start)
+    n_months = delta.years*12 + delta.months
+    if (start.day == 1) and (end.day == 1) and (n_months >= n_segments):
+        boundaries = [start + relativedelta(
+            months=int(round(i*n_months/float(n_segments))))
+            for i in range(n_segments+1)]
+    else:
+        n_days = (end - start).days
+        AssStr = "Can not split {} days into {} segments"
+        assert n_days >= n_segments, AssStr.format(n_days, n_segments)
+        boundaries = [start + datetime.timedelta(
+            days=int(round(i*n_days/float(n_segments))))
+            for i in range(n_segments+1)]
+    return [i.strftime("%Y%m%d") for i in boundaries]
+
+
+def is_own_file(name):
+    """
+    Is a run directory file one each segment has its own of?
+    """
+    return any(fnmatch.fnmatch(name, i) for i in SEGMENT_OWN_FILES)
+
+
+def create_segment_directory(segment_dir, spinup_time, end_time, run_dir='.',
+                             restart_file=None, restart_file_template=None):
+    """
+    Create the directory of a segment
+
+    Parameters
+    -------
+    segment_dir (str): Directory of the segment
+    spinup_time (str): Start of the segment's run (with its spin-up)
+    end_time (str): End of the segment in the format YYYYMMDD
+    run_dir (str): GEOS-Chem run directory the segment is of
+    restart_file (str): Restart file to start the segment from
+    restart_file_template (str): Name of restart files ({date} is replaced)
+
+    Returns
+    -------
+    (None)
+
+    Notes
+    -------
+     - The run directory's files are linked, other than the input.geos (which
+     has the segment's dates), restart files and outputs
+    """
+    run_dir = os.path.realpath(run_dir)
+    for required_dir in (segment_dir, os.path.join(segment_dir, 'OutputDir')):
+        if not os.path.exists(required_dir):
+            os.makedirs(required_dir)
+    restart_files = restart_file_template.format(date='*')
+    for name in os.listdir(run_dir):
+        if is_own_file(name) or fnmatch.fnmatch(name, restart_files):
+            continue
+        link = os.path.join(segment_dir, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(run_dir, name), link)
+    input_geos = InputGeos.from_file(get_run_input_file(run_dir,
+                                                        'input.geos'))
+    lines = list(input_geos.lines)
+    input_geos.set_date(lines, input_geos.start_index, spinup_time)
+    input_geos.set_date(lines, input_geos.end_index, end_time)
+    with open(os.path.join(segment_dir, 'input.geos'), 'w') as input_file:
+        input_file.writelines(lines)
+    segment_restart_file = os.path.join(
+        segment_dir, restart_file_template.format(date=spinup_time))
+    if os.path.lexists(segment_restart_file):
+        os.remove(segment_restart_file)
+    os.symlink(os.path.realpath(os.path.join(run_dir, restart_file)),
+               segment_restart_file)
+    return
+
+
+def create_segment_directories(start_time, end_time, n_segments, spinup,
+                               run_dir='.', restart_file=None,
+                               restart_file_template=None):
+    """
+    Create the directories of the segments of a run
+
+    Parameters
+    -------
+    start_time (str): Start of the run in the format YYYYMMDD
+    end_time (str): End of the run in the format YYYYMMDD
+    n_segments (int): Number of segments
+    spinup (relativedelta): Spin-up before each segment (after the 1st)
+    run_dir (str): GEOS-Chem run directory to split
+    restart_file (str): Restart file the segments (after the 1st) start from
+    (default: the run's initial restart)
+    restart_file_template (str): Name of restart files ({date} is replaced)
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is a dictionary for each segment ("segment_dir",
+     "spinup_time", "start_time", "end_time")
+     - The segments are listed in SEGMENTS_MANIFEST for stitch_segments
+    """
+    initial_restart = restart_file_template.format(date=start_time)
+    if restart_file is None:
+        restart_file = initial_restart
+    run_start = datetime.datetime.strptime(start_time, "%Y%m%d")
+    times = get_segment_times(start_time, end_time, n_segments)
+    segments = []
+    for n_segment, (segment_start, segment_end) in enumerate(
+            zip(times[:-1], times[1:])):
+        spinup_time = segment_start
+        segment_restart_file = initial_restart
+        if n_segment > 0:
+            spinup_start = datetime.datetime.strptime(
+                segment_start, "%Y%m%d") - spinup
+            spinup_time = max(spinup_start, run_start).strftime("%Y%m%d")
+            segment_restart_file = restart_file
+        segment_dir = os.path.join(run_dir, SEGMENTS_DIR, segment_start)
+        create_segment_directory(
+            segment_dir, spinup_time, segment_end, run_dir=run_dir,
+            restart_file=segment_restart_file,
+            restart_file_template=restart_file_template)
+        segments.append({
+            'segment_dir': segment_dir,
+            'spinup_time': spinup_time,
+            'start_time': segment_start,
+            'end_time': segment_end,
+        })
+    with open(os.path.join(run_dir, SEGMENTS_MANIFEST), 'w') as manifest:
+        for segment in segments:
+            manifest.write("{} {} {} {}\n".format(
+                os.path.basename(segment['segment_dir']),
+                segment['spinup_time'], segment['start_time'],
+                segment['end_time']))
+    return segments
+
+
+def stitch_segments(run_dir='.'):
+    """
+    Link the output of the segments of a run into its OutputDir
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory that was split into segments
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Returned list is the names of the files linked
+     - A file is from the date in its name (e.g. GEOSChem.SpeciesConc.
+     20070101_0000z.nc4), and is only kept from the segment that date is in,
+     so the output of the spin-up is discarded. Files without a date are not
+     linked
+    """
+    output_dir = os.path.join(run_dir, 'OutputDir')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    linked = []
+    with open(os.path.join(run_dir, SEGMENTS_MANIFEST), 'r') as manifest:
+        segments = [line.split() for line in manifest if line.strip()]
+    for name, spinup_time, start_time, end_time in segments:
+        segment_output_dir = os.path.join(run_dir, SEGMENTS_DIR, name,
+                                          'OutputDir')
+        for output_file in sorted(os.listdir(segment_output_dir)):
+            date = DATE_RE.search(output_file)
+            if (date is None) or \
+                    not (start_time <= date.group(1) < end_time):
+                continue
+            link = os.path.join(output_dir, output_file)
+            if os.path.islink(link):
+                os.remove(link)
+            elif os.path.exists(link):
+                continue
+            os.symlink(os.path.relpath(
+                os.path.join(segment_output_dir, output_file), output_dir),
+                link)
+            linked.append(output_file)
+    return linked
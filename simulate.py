@@ -0,0 +1,261 @@
+"""
+Discrete-event simulation of a campaign's chunks to compare chunking
+strategies (e.g. month, 3month, 6month) before submitting
+
+Notes
+-------
+ - Each chunk waits in the queue once the chunk before it has finished,
+ then runs for its simulated days (at the throughput) plus a fixed overhead
+ for starting up
+ - Queue waits are drawn from the waits of past jobs (sacct Submit/Start, or
+ qtime/stime of qstat -x -f) or from an exponential distribution with a mean
+ given by hand
+ - Failures (e.g. node failures) arrive at a rate per hour of running, so a
+ longer chunk is more likely to fail and loses more when it does. A failed
+ chunk is resubmitted and waits in the queue again
+ - A chunk that would run longer than the wall time can never finish, so its
+ strategy is reported as not fitting rather than simulated
+ - Many replications are run and the mean (and 90th percentile) time to
+ completion and core hours of each strategy are reported
+"""
+import heapq
+import random
+import datetime
+import itertools
+import subprocess
+
+from utils import wall_time_to_seconds, parse_qstat_jobs
+from resource_history import get_number_of_days, get_quantile
+
+# Commands to read the queue waits of past jobs
+QUEUE_WAIT_COMMANDS = {
+    'PBS': 'qstat -x -f -u "$USER"',
+    'SLURM': 'sacct -n -P -X -u "$USER" -S "$(date -d "-90 days" +%Y-%m-%d)" -o Submit,Start',
+}
+SACCT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+PBS_TIME_FORMAT = '%a %b %d %H:%M:%S %Y'
+# Most attempts at a chunk before a replication is given up on
+MAX_ATTEMPTS = 100
+
+
+def parse_queue_waits(accounting_output, scheduler='SLURM'):
+    """
+    Get the queue waits (in seconds) of past jobs from their accounting
+
+    Parameters
+    -------
+    accounting_output (str): Output of the command in QUEUE_WAIT_COMMANDS
+    scheduler (str): Scheduler the output is from ("SLURM" or "PBS")
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Jobs that have not started are skipped
+    """
+    if scheduler == 'PBS':
+        times = [(i.get('qtime'), i.get('stime'))
+                 for i in parse_qstat_jobs(accounting_output)]
+        time_format = PBS_TIME_FORMAT
+    else:
+        times = [line.strip().split('|')[:2]
+                 for line in accounting_output.splitlines()
+                 if line.count('|') >= 1]
+        time_format = SACCT_TIME_FORMAT
+    waits = []
+    for submit_time, start_time in times:
+        try:
+            wait = datetime.datetime.strptime(start_time, time_format) - \
+                datetime.datetime.strptime(submit_time, time_format)
+        except (TypeError, ValueError):
+            continue
+        waits.append(max(wait.total_seconds(), 0.))
+    return waits
+
+
+def get_queue_waits(inputs=None, accounting_output=None):
+    """
+    Get the queue waits (in seconds) of the user's past jobs
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    accounting_output (str): Output of the accounting (default: run the
+    command in QUEUE_WAIT_COMMANDS)
+
+    Returns
+    -------
+    (list)
+    """
+    if accounting_output is None:
+        accounting_output = subprocess.run(
+            QUEUE_WAIT_COMMANDS[inputs.scheduler], shell=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return parse_queue_waits(accounting_output, scheduler=inputs.scheduler)
+
+
+def get_chunk_seconds(times, simulated_days_per_hour, overhead_seconds=0.):
+    """
+    Get the run time (in seconds) of each chunk of a plan
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    simulated_days_per_hour (float): Throughput of the model
+    overhead_seconds (float): Time each chunk takes to start up
+
+    Returns
+    -------
+    (list)
+    """
+    return [get_number_of_days(start_time, end_time) * 3600. /
+            simulated_days_per_hour + overhead_seconds
+            for start_time, end_time in zip(times[:-1], times[1:])]
+
+
+def simulate_campaign(chunk_seconds, queue_wait, failure_rate=0.,
+                      n_chains=1, rng=None):
+    """
+    Simulate one campaign of chains of chunks
+
+    Parameters
+    -------
+    chunk_seconds (list): Run time of each chunk of a chain in seconds
+    queue_wait (function): Draws a queue wait in seconds (given rng)
+    failure_rate (float): Failures per hour of running
+    n_chains (int): Number of chains (run directories) run at the same time
+    rng (random.Random): Random number generator
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary is the "seconds" until the last chunk finished,
+     the "core_seconds" (per core) run, including those lost to failures, and
+     the number of "failures"
+     - The events (a chunk submitted, starting or ending) are handled in the
+     order of their times from a heap
+    """
+    if rng is None:
+        rng = random.Random(0)
+    events = []
+    order = itertools.count()
+    for chain in range(n_chains):
+        heapq.heappush(events, (0., next(order), 'submit', chain, 0))
+    attempts = {}
+    result = {'seconds': 0., 'core_seconds': 0., 'failures': 0}
+    while events:
+        now, _, event, chain, n_chunk = heapq.heappop(events)
+        if event == 'submit':
+            heapq.heappush(events, (now + queue_wait(rng), next(order),
+                                    'start', chain, n_chunk))
+        elif event == 'start':
+            attempts[chain, n_chunk] = attempts.get((chain, n_chunk), 0) + 1
+            AssStr = "A chunk failed {} times, is the failure rate right?"
+            assert attempts[chain, n_chunk] <= MAX_ATTEMPTS, \
+                AssStr.format(MAX_ATTEMPTS)
+            run_seconds = chunk_seconds[n_chunk]
+            fail_seconds = float('inf')
+            if failure_rate > 0:
+                fail_seconds = rng.expovariate(failure_rate / 3600.)
+            if fail_seconds < run_seconds:
+                result['core_seconds'] += fail_seconds
+                result['failures'] += 1
+                heapq.heappush(events, (now + fail_seconds, next(order),
+                                        'submit', chain, n_chunk))
+            else:
+                result['core_seconds'] += run_seconds
+                heapq.heappush(events, (now + run_seconds, next(order),
+                                        'end', chain, n_chunk))
+        elif event == 'end':
+            result['seconds'] = max(result['seconds'], now)
+            if n_chunk + 1 < len(chunk_seconds):
+                heapq.heappush(events, (now, next(order), 'submit', chain,
+                                        n_chunk + 1))
+    return result
+
+
+def simulate_strategy(times, simulated_days_per_hour, queue_wait,
+                      inputs=None, n_chains=1, seed=0):
+    """
+    Simulate a chunking strategy many times
+
+    Parameters
+    -------
+    times (list): list of string times in the format YYYYMMDD
+    simulated_days_per_hour (float): Throughput of the model
+    queue_wait (function): Draws a queue wait in seconds (given rng)
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    n_chains (int): Number of run directories run at the same time
+    seed (int): Seed of the random number generator
+
+    Returns
+    -------
+    (dict)
+
+    Notes
+    -------
+     - Returned dictionary has the number of "chunks", whether they "fit" in
+     the wall time, and (if they do) the "mean_days" and "p90_days" to
+     completion, the "core_hours" (for all the CPUs) and "failures" on
+     average
+    """
+    chunk_seconds = get_chunk_seconds(
+        times, simulated_days_per_hour,
+        overhead_seconds=float(inputs.simulation_overhead_seconds))
+    summary = {'chunks': len(chunk_seconds),
+               'fit': max(chunk_seconds) <=
+               wall_time_to_seconds(inputs.wall_time)}
+    if not summary['fit']:
+        return summary
+    rng = random.Random(seed)
+    results = [simulate_campaign(chunk_seconds, queue_wait,
+                                 failure_rate=float(
+                                     inputs.simulation_failure_rate),
+                                 n_chains=n_chains, rng=rng)
+               for _ in range(int(inputs.simulation_runs))]
+    days = [i['seconds'] / 86400. for i in results]
+    summary.update({
+        'mean_days': sum(days) / len(days),
+        'p90_days': get_quantile(days, 0.9),
+        'core_hours': sum(i['core_seconds'] for i in results) /
+        len(results) * int(inputs.cpus_need) / 3600.,
+        'failures': sum(i['failures'] for i in results) / float(len(results)),
+    })
+    return summary
+
+
+def print_simulation_summary(summaries):
+    """
+    Print the simulated chunking strategies, soonest to finish first
+
+    Parameters
+    -------
+    summaries (dict): Summary of each strategy (see simulate_strategy)
+
+    Returns
+    -------
+    (None)
+    """
+    PrtStr = "{:<10} {:>6} {:>10} {:>10} {:>12} {:>9}"
+    print(PrtStr.format('step', 'chunks', 'mean_days', 'p90_days',
+                        'core_hours', 'failures'))
+    fitting = sorted((i for i in summaries.items() if i[1]['fit']),
+                     key=lambda i: i[1]['mean_days'])
+    for step, summary in fitting:
+        print(PrtStr.format(step, summary['chunks'],
+                            '{:.1f}'.format(summary['mean_days']),
+                            '{:.1f}'.format(summary['p90_days']),
+                            '{:.0f}'.format(summary['core_hours']),
+                            '{:.2f}'.format(summary['failures'])))
+    for step, summary in summaries.items():
+        if not summary['fit']:
+            print(PrtStr.format(step, summary['chunks'], '-', '-', '-', '-') +
+                  "  (chunks longer than the wall time)")
+    if fitting:
+        print("Soonest to finish: --step={}".format(fitting[0][0]))
+    return
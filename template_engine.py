@@ -0,0 +1,169 @@
+"""
+Queue script template engine for geos-chem-schedule
+
+Notes
+-------
+ - Templates are loaded and compiled once per process and then rendered for
+ every chunk from the compiled form
+ - "{name}" is replaced by the value of the variable "name". Shell variables
+ (e.g. "${SLURM_SUBMIT_DIR}") are left as they are, so no escaping is needed
+ - Sections can be included conditionally with lines containing only
+ "{% if name %}", "{% if not name %}", "{% else %}" and "{% endif %}"
+"""
+import os
+import re
+import functools
+
+# Location of the queue script templates
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+# A "{name}" placeholder that is not part of a shell "${name}"
+PLACEHOLDER_RE = re.compile(r'(?<!\$)\{(\w+)\}')
+# A line holding a conditional section tag
+TAG_RE = re.compile(r'^[ \t]*\{%\s*(if not|if|else|endif)\s*(\w*)\s*%\}[ \t]*$')
+
+
+class CompiledTemplate:
+    """
+    A queue script template compiled into literal text and placeholder nodes
+
+    Attributes
+    -------
+        name: Name of the template (for error messages)
+        nodes: List of nodes. A node is a literal string, a placeholder name
+        (as a one item tuple) or a conditional section given as a tuple of
+        (variable name, negate, nodes if true, nodes if false)
+    """
+
+    def __init__(self, text, name='<string>'):
+        self.name = name
+        self.nodes = compile_template_nodes(text, name=name)
+        return
+
+    def render(self, variables):
+        """
+        Render the template with a dictionary of variables
+
+        Parameters
+        -------
+        variables (dict): Values for the placeholders and conditions
+
+        Returns
+        -------
+        (str)
+        """
+        parts = []
+        render_nodes(self.nodes, variables, parts)
+        return ''.join(parts)
+
+    def __repr__(self):
+        return 'CompiledTemplate({})'.format(self.name)
+
+
+def compile_template_nodes(text, name='<string>'):
+    """
+    Compile template text into a list of nodes (see CompiledTemplate)
+
+    Parameters
+    -------
+    text (str): Template text
+    name (str): Name of the template (for error messages)
+
+    Returns
+    -------
+    (list)
+    """
+    # Stack of (node list, open conditional section) for nested sections
+    nodes = []
+    stack = []
+    literal = []
+
+    def flush(nodes, literal):
+        """
+        Add any literal text and placeholders collected to the node list
+        """
+        text = ''.join(literal)
+        del literal[:]
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            if match.start() > position:
+                nodes.append(text[position:match.start()])
+            nodes.append((match.group(1),))
+            position = match.end()
+        if position < len(text):
+            nodes.append(text[position:])
+        return
+
+    for n_line, line in enumerate(text.splitlines(True)):
+        match = TAG_RE.match(line.rstrip('\n'))
+        if not match:
+            literal.append(line)
+            continue
+        flush(nodes, literal)
+        tag, variable = match.groups()
+        AssStr = "Invalid '{}' at line {} of template {}"
+        if tag in ('if', 'if not'):
+            assert variable, AssStr.format(tag, n_line+1, name)
+            section = [variable, (tag == 'if not'), [], []]
+            nodes.append(section)
+            stack.append((nodes, section))
+            nodes = section[2]
+        elif tag == 'else':
+            assert stack, AssStr.format(tag, n_line+1, name)
+            nodes = stack[-1][1][3]
+        elif tag == 'endif':
+            assert stack, AssStr.format(tag, n_line+1, name)
+            nodes = stack.pop()[0]
+    flush(nodes, literal)
+    AssStr = "Missing '{{% endif %}}' in template {}"
+    assert not stack, AssStr.format(name)
+    return freeze_nodes(nodes)
+
+
+def freeze_nodes(nodes):
+    """
+    Turn the conditional sections of a node list into tuples
+    """
+    frozen = []
+    for node in nodes:
+        if isinstance(node, list):
+            node = (node[0], node[1], freeze_nodes(node[2]),
+                    freeze_nodes(node[3]))
+        frozen.append(node)
+    return tuple(frozen)
+
+
+def render_nodes(nodes, variables, parts):
+    """
+    Render a node list into a list of strings (see CompiledTemplate)
+    """
+    for node in nodes:
+        if isinstance(node, str):
+            parts.append(node)
+        elif len(node) == 1:
+            parts.append(str(variables[node[0]]))
+        elif bool(variables[node[0]]) != node[1]:
+            render_nodes(node[2], variables, parts)
+        else:
+            render_nodes(node[3], variables, parts)
+    return
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(template_name, templates_dir=TEMPLATES_DIR):
+    """
+    Load and compile a queue script template (once per process)
+
+    Parameters
+    -------
+    template_name (str): Name of the template file in the templates directory
+    templates_dir (str): Directory containing the templates
+
+    Returns
+    -------
+    (CompiledTemplate)
+    """
+    template_location = os.path.join(templates_dir, template_name)
+    with open(template_location, 'r') as template_file:
+        text = template_file.read()
+    return CompiledTemplate(text, name=template_name)
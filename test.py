@@ -10,11 +10,28 @@ import sys
 import shutil
 import datetime
 import calendar
+import hashlib
+import asyncio
+import time
 from dateutil.relativedelta import relativedelta
 import pytest
 
 from core import *
 from utils import *
+from out_of_hours import get_out_of_hours_windows, get_next_window_start
+from out_of_hours import write_out_of_hours_files
+from resource_history import load_history
+from feeder import feed_once, run_feeder, get_chunk_dependency
+from feeder import add_feeder_chunks
+from resume import QUEUE_STATUS_COMMANDS
+from registry import connect_registry, sync_registry, get_core_hours
+from registry import get_chunk_state_counts, get_failed_chunks
+from retry import retry_chunk, classify_failure
+from monitor import load_submitted_jobs, poll_job_states
+from segments import stitch_segments
+from dag import get_topological_order, add_chain, write_dag_run_script
+from placement import load_cluster_state, advise_placement
+from benchmark import run_benchmarks, compare_results
 
 
 def test_check_inputs():
@@ -38,13 +55,13 @@ def test_check_inputs():
         "name": "out_of_hours_string",
         "valid_data": yes_list + no_list,
         "invalid_data": ["bob"],
-        "data_logical": "out_of_hours"
+        "data_logical": "out_of_hours",
     }
     send_email = {
         "name": "send_email",
         "valid_data": yes_list + no_list,
         "invalid_data": ["bob", 1000],
-        "data_logical": "email"
+        "data_logical": "send_email"
     }
     run_script_string = {
         "name": "run_script_string",
@@ -100,6 +117,32 @@ def test_check_inputs():
     return
 
 
+def test_check_inputs_conflicts():
+    """
+    Test options left unset follow the others, and conflicting ones fail
+    """
+    # Out of hours jobs each submit the next one, unless chosen otherwise
+    inputs = GC_Job()
+    inputs.out_of_hours_string = "yes"
+    assert not check_inputs(inputs).submit_jobs_together
+    inputs = GC_Job()
+    assert check_inputs(inputs).submit_jobs_together
+    conflicts = [
+        {"out_of_hours_string": "yes", "submit_jobs_together": "yes"},
+        {"out_of_hours_string": "yes", "use_job_array": "yes",
+         "submit_jobs_together": "no"},
+        {"auto_retry": True, "use_job_array": "yes"},
+        {"feeder": True, "submit_jobs_together": "no"},
+        {"feeder": True, "use_job_array": "yes"},
+    ]
+    for settings in conflicts:
+        inputs = GC_Job()
+        inputs.update(settings)
+        with pytest.raises(AssertionError):
+            check_inputs(inputs)
+    return
+
+
 def test_check_inputs_steps():
     """
     Test check_inputs() steps
@@ -243,29 +286,1662 @@ def test_update_output_line():
     return
 
 
-def test_get_variables_from_cli():
+def test_get_variables_from_cli(monkeypatch):
     """
     Test that variables passed from the cli make it into the class.
     """
-    #########
-    # To-do
-    ########
-    #
-    # Write this test
-    #
-    ##########
+    monkeypatch.setattr("core.clear_screen", lambda: None)
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.manage_hemco_files = False
+    # Answers in the order asked, blank keeps the default
+    answers = iter([
+        "mytestjob",        # job name
+        "3MONTH",           # step
+        "week",             # queue
+        "yes",              # out of hours
+        "12:00:00",         # wall time
+        "no",               # submit jobs together
+        "no",               # job array
+        "",                 # manage HEMCO files
+        "4Gb",              # memory
+        "8",                # CPUs
+        "me@example.com",   # email
+        "no",               # run the script
+    ])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    inputs = get_variables_from_cli(inputs)
+    assert inputs.job_name == "mytestjob"
+    assert inputs.step == "3month"
+    assert inputs.queue_name == "week"
+    assert inputs.out_of_hours_string == "yes"
+    assert inputs.wall_time == "12:00:00"
+    assert inputs.submit_jobs_together == "no"
+    assert inputs.use_job_array == "no"
+    assert inputs.manage_hemco_files is False
+    assert inputs.memory_need == "4Gb"
+    assert inputs.cpus_need == "8"
+    assert inputs.email_address == "me@example.com"
+    assert inputs.send_email
+    assert inputs.run_script_string == "no"
+    # Every question was asked
+    assert next(answers, None) is None
     return
 
 
-def test_get_arguments():
+def test_get_arguments(monkeypatch):
     """
     Test that the passed arguments get assigned to the class.
     """
-    ########
-    # TO DO
-    ########
-    #
-    # Write these tests ...
-    #
-    ########
+    monkeypatch.setattr(sys, "argv", [
+        "geos-chem-schedule.py", "--job-name=averylongjobname",
+        "--step=3month", "--queue-name=week", "--wall-time=12:00:00",
+        "--submit=no", "--resume=yes", "--segments=3",
+        "--batch=runs/*", "--batch-processes=4", "--status"])
+    inputs = get_arguments(GC_Job())
+    # The job name is cut to fit in the queue
+    assert inputs.job_name == "averylong"
+    assert inputs.step == "3month"
+    assert inputs.queue_name == "week"
+    assert inputs.wall_time == "12:00:00"
+    assert inputs.run_script_string == "no"
+    assert inputs.resume == "yes"
+    assert inputs.segments == 3
+    assert inputs.batch_run_dirs == "runs/*"
+    assert inputs.batch_processes == 4
+    assert inputs.monitor == "status"
+
+    # An unknown argument stops the script
+    monkeypatch.setattr(sys, "argv", ["geos-chem-schedule.py", "--bob=1"])
+    with pytest.raises(SystemExit):
+        get_arguments(GC_Job())
+    return
+
+
+def test_create_SLURM_array_queue_files(tmp_path, monkeypatch):
+    """
+    Test a single job array script and chunk table are made for all chunks
+    """
+    monkeypatch.chdir(tmp_path)
+    inputs = GC_Job()
+    inputs.manage_hemco_files = False
+    times = ["20070101", "20070201", "20070301", "20070401"]
+    create_SLURM_array_queue_files(times, inputs=inputs)
+
+    assert sorted(os.listdir("SLURM_queue_files")) == ["array.sbatch",
+                                                      "chunk_table.txt"]
+    with open("SLURM_queue_files/chunk_table.txt", "r") as chunk_table:
+        assert chunk_table.readlines() == ["0 20070101 20070201\n",
+                                           "1 20070201 20070301\n",
+                                           "2 20070301 20070401\n"]
+    with open("SLURM_queue_files/array.sbatch", "r") as queue_file:
+        queue_file_string = queue_file.read()
+    assert "#SBATCH --array=0-2%1\n" in queue_file_string
+    assert "${SLURM_ARRAY_TASK_ID}" in queue_file_string
+
+    # More chunks than MaxArraySize are submitted as arrays, one after another
+    inputs.max_array_size = 2
+    create_SLURM_array_queue_files(times, inputs=inputs)
+    with open("SLURM_queue_files/array.sbatch", "r") as queue_file:
+        assert "#SBATCH --array=0-1%1\n" in queue_file.read()
+    create_SLURM_array_run_script(times, max_array_size=2)
+    with open("run_geos_SLURM_array.sh", "r") as run_script:
+        lines = [i for i in run_script if i.startswith("job_number=")]
+    assert lines == [
+        "job_number=$(sbatch --parsable --array=0-1%1 "
+        "SLURM_queue_files/array.sbatch 0)\n",
+        "job_number=$(sbatch --parsable --dependency=afterok:\"$job_number\" "
+        "--array=0-0%1 SLURM_queue_files/array.sbatch 2)\n",
+    ]
+    # Each array records its tasks' chunks (chunk 2 is task 0 of the 2nd)
+    with open("SLURM_queue_files/chunk_table.txt", "w") as chunk_table:
+        chunk_table.write("0 20070101 20070201\n1 20070201 20070301\n"
+                          "2 20070301 20070401\n")
+    fake_sbatch = 'sbatch() { echo "$*" >> calls.txt; wc -l < calls.txt; }\n'
+    with open("run_geos_SLURM_array.sh", "r") as run_script:
+        subprocess.run(["bash", "-c", fake_sbatch + run_script.read()],
+                       check=True, stdout=subprocess.DEVNULL)
+    assert load_submitted_jobs(".") == {"20070101": "1_0",
+                                        "20070201": "1_1",
+                                        "20070301": "2_0"}
+    return
+
+
+def make_test_run_directory(run_dir, start_date="20070101",
+                            end_date="20070401"):
+    """
+    Make a minimal GEOS-Chem run directory (just input.geos) for testing
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "input.geos"), "w") as input_file:
+        input_file.write(
+            "Start YYYYMMDD, hhmmss  : {} 000000\n".format(start_date))
+        input_file.write(
+            "End   YYYYMMDD, hhmmss  : {} 000000\n".format(end_date))
+        input_file.write("Read and save CSPEC_FULL: f\n")
+        for month in calendar.month_abbr[1:]:
+            input_file.write("Schedule output for {} : {}\n".format(
+                month.upper(), "0"*31))
+    return run_dir
+
+
+def test_schedule_run_directories(tmp_path):
+    """
+    Test a batch of run directories are scheduled with per directory settings
+    """
+    run_dirs = [make_test_run_directory(str(tmp_path / name))
+                for name in ("member_0", "member_1", "member_2")]
+    inputs = GC_Job()
+    inputs.run_script_string = "no"
+    inputs.scheduler = "SLURM"
+    inputs.use_job_array = False
+    inputs.submit_jobs_together = True
+    inputs.step = "month"
+    overrides = {
+        "member_1": {"wall_time": "12:00:00"},
+        "member_2": {"step": "bob"},
+    }
+    results = schedule_run_directories(str(tmp_path / "member_*"),
+                                       inputs=inputs, overrides=overrides,
+                                       processes=2)
+
+    assert [i["run_dir"] for i in results] == run_dirs
+    assert [i["n_chunks"] for i in results[:2]] == [3, 3]
+    assert results[2]["error"]
+    for run_dir in run_dirs[:2]:
+        assert sorted(os.listdir(os.path.join(run_dir, "input_files"))) == [
+            "20070101.input.geos", "20070201.input.geos",
+            "20070301.input.geos"]
+        assert os.path.isfile(os.path.join(
+            run_dir, "run_geos_SLURM_queue_all_jobs.sh"))
+    queue_file = os.path.join(run_dirs[1], "SLURM_queue_files",
+                              "20070101.sbatch")
+    with open(queue_file, "r") as queue_file:
+        assert "#SBATCH --time=12:00:00\n" in queue_file.read()
+    return
+
+
+def test_compiled_template():
+    """
+    Test placeholders and conditional sections of the queue script templates
+    """
+    from template_engine import CompiledTemplate
+    template = CompiledTemplate(
+        "cd ${SLURM_SUBMIT_DIR}\n"
+        "run {start_time}\n"
+        "{% if email %}\n"
+        "mail {email_address}\n"
+        "{% else %}\n"
+        "no mail\n"
+        "{% endif %}\n"
+        "{% if not last %}\n"
+        "next {end_time}\n"
+        "{% endif %}\n"
+    )
+    variables = {"start_time": "20070101", "end_time": "20070201",
+                 "email": False, "email_address": "a@b.c", "last": False}
+    assert template.render(variables) == (
+        "cd ${SLURM_SUBMIT_DIR}\nrun 20070101\nno mail\nnext 20070201\n")
+    variables.update(email=True, last=True)
+    assert template.render(variables) == (
+        "cd ${SLURM_SUBMIT_DIR}\nrun 20070101\nmail a@b.c\n")
+    with pytest.raises(Exception):
+        CompiledTemplate("{% if email %}\nmail\n")
+    return
+
+
+def test_create_queue_files(tmp_path, monkeypatch):
+    """
+    Test the queue files are made for each chunk with both schedulers
+    """
+    monkeypatch.chdir(tmp_path)
+    inputs = GC_Job()
+    inputs.manage_hemco_files = True
+    inputs.send_email = True
+    inputs.submit_jobs_together = False
+    times = ["20070101", "20070201", "20070301"]
+    create_SLURM_queue_files(times, inputs=inputs)
+    create_PBS_queue_files(times, inputs=inputs)
+
+    with open("SLURM_queue_files/20070101.sbatch", "r") as queue_file:
+        first = queue_file.read()
+    with open("SLURM_queue_files/20070201.sbatch", "r") as queue_file:
+        last = queue_file.read()
+    assert "ln -s input_files/20070101.HEMCO_Config.rc" in first
+    assert "sbatch --parsable SLURM_queue_files/20070201.sbatch" in first
+    assert "#SBATCH --mail-user" not in first
+    assert "sbatch SLURM_queue_files/20070301.sbatch" not in last
+    assert "#SBATCH --mail-user={}".format(inputs.email_address) in last
+    with open("PBS_queue_files/20070201.pbs", "r") as queue_file:
+        assert "#PBS -M {}".format(inputs.email_address) in queue_file.read()
+    return
+
+
+def test_input_geos():
+    """
+    Test input.geos is parsed once and each chunk patched from the buffer
+    """
+    from input_geos import InputGeos
+    input_lines = [
+        "Start YYYYMMDD, hhmmss  : 20120101 000000\n",
+        "End   YYYYMMDD, hhmmss  : 20120109 000000\n",
+        "Read and save CSPEC_FULL: f\n",
+        "Schedule output for JAN : 3000000000000000000000000000000\n",
+        "Schedule output for FEB : 3000000000000000000000000000000\n",
+    ]
+    input_geos = InputGeos(input_lines)
+    assert (input_geos.start_index, input_geos.end_index) == (0, 1)
+    assert input_geos.cspec_index == 2
+    assert input_geos.output_indices == {"JAN": [3], "FEB": [4]}
+    assert (input_geos.start_date, input_geos.end_date) == ("20120101",
+                                                            "20120109")
+    first = input_geos.create_lines("20120101", "20120201")
+    second = input_geos.create_lines("20120201", "20120205")
+    assert first[0] == "Start YYYYMMDD, hhmmss  : 20120101 000000\n"
+    assert first[2] == "Read and save CSPEC_FULL: T\n"
+    assert first[4] == "Schedule output for FEB : 3000000000000000000000000000000\n"
+    assert second[3] == "Schedule output for JAN : 0000000000000000000000000000000\n"
+    assert second[4] == "Schedule output for FEB : 0000300000000000000000000000000\n"
+    # Confirm the same as the line by line editor
+    inputs = GC_Job()
+    inputs.step = "month"
+    assert input_geos.create_lines("20120201", "20120301", True) == \
+        [update_output_line(i, "20120301", inputs=inputs)
+         if i.startswith("Schedule") else i
+         for i in create_new_input_file("20120201", "20120301",
+                                        input_lines)]
+    return
+
+
+def test_create_the_input_files_HEMCO_store(tmp_path):
+    """
+    Test each distinct HEMCO_Config.rc is only stored once and linked to
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20090101")
+    with open(os.path.join(run_dir, "HEMCO_Config.rc"), "w") as HEMCO_file:
+        HEMCO_file.write("MetYear:                     2016\n")
+        HEMCO_file.write("EmisYear:                    2016\n")
+    inputs = GC_Job()
+    inputs.step = "month"
+    inputs.manage_hemco_files = True
+    inputs.MetYear = "2016"
+    inputs.EmisYear = "+0"
+    times = list_of_times_to_run("20070101", "20090101", inputs)
+    create_the_input_files(times, inputs=inputs, run_dir=run_dir)
+
+    input_files_dir = os.path.join(run_dir, "input_files")
+    # Two years of emissions, so only two distinct files are written
+    assert len(os.listdir(os.path.join(input_files_dir, "HEMCO_store"))) == 2
+    for time, EmisYear in (("20070101", 2007), ("20081201", 2008)):
+        HEMCO_file_location = os.path.join(
+            input_files_dir, "{}.HEMCO_Config.rc".format(time))
+        assert os.path.islink(HEMCO_file_location)
+        with open(HEMCO_file_location, "r") as HEMCO_file:
+            assert HEMCO_file.readlines()[1].split() == ["EmisYear:",
+                                                         str(EmisYear)]
+    return
+
+
+def test_get_times_to_resume_run_directory(tmp_path):
+    """
+    Test only the chunks that have not completed or been queued are resumed
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20070601")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.use_job_array = False
+    inputs.submit_jobs_together = True
+    times = list_of_times_to_run("20070101", "20070601", inputs)
+    # January completed (log moved) and February wrote its restart file
+    os.makedirs(os.path.join(run_dir, "OutputDir"))
+    with open(os.path.join(run_dir, "OutputDir/20070101.geos.log"), "w") as f:
+        f.write("...\n" + GEOS_CHEM_END_BANNER + "\n")
+    open(os.path.join(run_dir, "GEOSChem.Restart.20070301_0000z.nc4"),
+         "w").close()
+    # March is running
+    queue_output = "1234|RUNNING|{}\n5678|PENDING|/elsewhere/x.sbatch\n".format(
+        os.path.join(run_dir, "SLURM_queue_files/20070301.sbatch"))
+
+    times_to_resume, dependency = get_times_to_resume_run_directory(
+        times, run_dir=run_dir, inputs=inputs, queue_output=queue_output)
+    assert times_to_resume == ["20070401", "20070501", "20070601"]
+    assert dependency == "1234"
+    # Jobs that call the next job themselves just continue the chain
+    inputs.submit_jobs_together = False
+    times_to_resume, dependency = get_times_to_resume_run_directory(
+        times, run_dir=run_dir, inputs=inputs, queue_output=queue_output)
+    assert (times_to_resume, dependency) == (["20070401"], None)
+    # Never submit a chunk that is already queued after one still to run
+    queue_output = "1234|PENDING|{}\n".format(
+        os.path.join(run_dir, "SLURM_queue_files/20070501.sbatch"))
+    with pytest.raises(AssertionError):
+        get_times_to_resume_run_directory(
+            times, run_dir=run_dir, inputs=inputs, queue_output=queue_output)
+
+    # PBS jobs are matched by ID, as names cut to 15 characters collide
+    inputs.scheduler = "PBS"
+    inputs.job_name = "LongName"
+    with open(os.path.join(run_dir, "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("11.pbs 20070201\n12.pbs 20070301\n")
+    queue_output = "\n".join([
+        "Job Id: 12.pbs", "    Job_Name = LongName200703",
+        "    job_state = R", "",
+        "Job Id: 13.pbs", "    Job_Name = LongName200703",
+        "    job_state = Q", ""])
+    queued = get_queued_chunks(times, run_dir=run_dir, inputs=inputs,
+                               queue_output=queue_output)
+    assert queued == {"20070301": "12.pbs"}
+    return
+
+
+def test_resume_after_input_geos_linked(tmp_path):
+    """
+    Test a resume plans the whole run once input.geos is a chunk's link
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20080101")
+    inputs = GC_Job()
+    inputs.scheduler = "local"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs = check_inputs(inputs)
+    schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    # The chain stopped in the March chunk, which linked its input.geos
+    input_geos = os.path.join(run_dir, "input.geos")
+    os.remove(input_geos)
+    os.symlink("input_files/20070301.input.geos", input_geos)
+    os.makedirs(os.path.join(run_dir, "OutputDir"))
+    for start_time in ("20070101", "20070201"):
+        with open(os.path.join(run_dir, "OutputDir",
+                               start_time + ".geos.log"), "w") as log:
+            log.write("...\n" + GEOS_CHEM_END_BANNER + "\n")
+    assert get_start_and_end_dates(run_dir, verbose=False) == \
+        ("20070101", "20080101")
+    inputs.resume = True
+    result = schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    assert result["times"][0] == "20070301"
+    assert result["times"][-1] == "20080101"
+    assert result["n_chunks"] == 10
+    chunk_input_geos = InputGeos.from_file(
+        os.path.join(run_dir, "input_files", "20070601.input.geos"))
+    assert (chunk_input_geos.start_date, chunk_input_geos.end_date) == \
+        ("20070601", "20070701")
+    return
+
+
+def test_predict_chunk_resources(tmp_path):
+    """
+    Test chunks are sized from the history collected from the accounting
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20070401")
+    with open(os.path.join(run_dir, "input.geos"), "a") as input_file:
+        input_file.write("Grid resolution         : 4.0x5.0\n")
+        input_file.write("Simulation name         : standard\n")
+    # A stand-in for sacct, with one step of each job holding the MaxRSS
+    fake_sacct = tmp_path / "fake_sacct.txt"
+    fake_sacct.write_text("\n".join([
+        "101|GEOS20070101|{0}|03:06:00||COMPLETED|20",
+        "101.batch|batch||03:06:00|20000M|COMPLETED|20",
+        "102|GEOS20070201|{0}|02:48:00||COMPLETED|20",
+        "102.batch|batch||02:48:00|18000M|COMPLETED|20",
+        "103|GEOS20070301|{0}|01:00:00||TIMEOUT|20",
+        "104|GEOS20070301|/elsewhere|03:06:00||COMPLETED|20",
+        "105|GEOS20070101|{0}|03:06:00||COMPLETED|20",
+    ]).format(run_dir))
+    # Only the jobs submitted for the run directory are its chunks
+    with open(os.path.join(run_dir, "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("101 20070101\n102 20070201\n103 20070301\n")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.cpus_need = "20"
+    inputs.history_file = str(tmp_path / "history.jsonl")
+    inputs.accounting_command = "cat {}".format(fake_sacct)
+    inputs.min_history_samples = 2
+    inputs.resource_quantile = 1.0
+    inputs.resource_margin = 0.0
+    times = list_of_times_to_run("20070101", "20070401", inputs)
+
+    records = collect_run_directory_history(times, run_dir=run_dir,
+                                            inputs=inputs)
+    assert [i["job_id"] for i in records] == ["101", "102"]
+    # Jobs already in the history are not added again
+    assert collect_run_directory_history(times, run_dir=run_dir,
+                                         inputs=inputs) == []
+
+    # 6 minutes per simulated day and 1000M per CPU at most
+    resources = predict_chunk_resources(times, run_dir=run_dir,
+                                        inputs=inputs)
+    assert resources["20070101"] == {"wall_time": "03:06:00",
+                                     "memory_need": "1000M"}
+    assert resources["20070201"]["wall_time"] == "02:48:00"
+    # Chunks longer than the partition allows are rejected
+    inputs.max_wall_time = "02:00:00"
+    with pytest.raises(AssertionError):
+        predict_chunk_resources(times, run_dir=run_dir, inputs=inputs)
+    inputs.max_wall_time = "48:00:00"
+
+    # Chunks timed from their logs have no memory, so it is not predicted
+    history = [dict(i, max_rss_mb=None) for i in load_history(
+        inputs.history_file)]
+    inputs.memory_need = "2G"
+    resources = predict_chunk_resources(times, run_dir=run_dir,
+                                        inputs=inputs, history=history)
+    assert resources["20070101"]["memory_need"] == "2G"
+    return
+
+
+def test_list_of_times_to_run_auto(tmp_path):
+    """
+    Test step "auto" fits the chunks to the wall time from the throughput
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20080101")
+    inputs = GC_Job()
+    inputs.step = "auto"
+    inputs.resume = False
+    inputs.history_file = str(tmp_path / "history.jsonl")
+    inputs.wall_time = "48:00:00"
+    inputs.max_wall_time = "24:00:00"
+    inputs.resource_margin = 0.0
+    # 3 days per hour fills the 24 hour partition limit with 72 days
+    inputs.simulated_days_per_hour = 3
+    inputs.align_chunks_to_months = True
+    times = list_of_times_to_run("20070101", "20080101", inputs,
+                                 run_dir=run_dir)
+    assert times == ["20070101", "20070301", "20070501", "20070701",
+                     "20070901", "20071101", "20080101"]
+    # Without alignment the fewest chunks share the days evenly
+    inputs.align_chunks_to_months = False
+    times = list_of_times_to_run("20070101", "20080101", inputs,
+                                 run_dir=run_dir)
+    assert len(times) == 7
+    assert times[-1] == "20080101"
+    # A month too long for a chunk is split
+    inputs.align_chunks_to_months = True
+    inputs.simulated_days_per_hour = 0.5
+    times = list_of_times_to_run("20070101", "20070201", inputs,
+                                 run_dir=run_dir)
+    assert times == ["20070101", "20070113", "20070125", "20070201"]
+    # Without throughput (or history) fall back to a step of month
+    inputs.simulated_days_per_hour = None
+    times = list_of_times_to_run("20070101", "20070301", inputs,
+                                 run_dir=run_dir)
+    assert times == ["20070101", "20070201", "20070301"]
+    return
+
+
+def test_schedule_run_directory_local(tmp_path):
+    """
+    Test the local scheduler runs the chunks in order and stops at a failure
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20070401")
+    # A stand-in for GEOS-Chem that fails for March
+    fake_geos = os.path.join(run_dir, "fake_geos.sh")
+    with open(fake_geos, "w") as fake_geos_file:
+        fake_geos_file.write("""
+start=$(grep "Start YYYYMMDD" input.geos | cut -c27-34)
+echo "Running $start"
+if [ "$start" = "20070301" ]; then exit 1; fi
+echo "**************   E N D   O F   G E O S -- C H E M   **************"
+""")
+    inputs = GC_Job()
+    inputs.scheduler = "local"
+    inputs.step = "month"
+    inputs.resume = False
+    inputs.predict_resources = False
+    inputs.run_script = True
+    inputs.local_geos_command = "bash fake_geos.sh"
+    summary = schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+
+    assert summary["run_script"] == "run_geos_local.sh"
+    assert summary["n_chunks"] == 3
+    assert "20070301" in summary["error"]
+    output_dir = os.path.join(run_dir, "OutputDir")
+    assert sorted(os.listdir(output_dir)) == ["20070101.geos.log",
+                                              "20070201.geos.log"]
+    local_log = os.path.join(run_dir, "queue_output", "20070101.local.log")
+    assert os.path.isfile(local_log)
+    return
+
+
+def test_out_of_hours(tmp_path):
+    """
+    Test the out of hours windows and the option jobs are submitted with
+    """
+    holidays_file = tmp_path / "holidays.txt"
+    holidays_file.write_text("# Bank holiday\n2020-05-25\n")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.out_of_hours = True
+    inputs.working_hours = "08:00-18:00"
+    inputs.working_days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+    inputs.holidays_file = str(holidays_file)
+    # From midday on a Friday, through a bank holiday weekend
+    windows = get_out_of_hours_windows(datetime.datetime(2020, 5, 22, 12),
+                                       inputs, n_days=5)
+    assert windows[0] == (datetime.datetime(2020, 5, 22, 18),
+                          datetime.datetime(2020, 5, 26, 8))
+    assert get_next_window_start(datetime.datetime(2020, 5, 26, 9),
+                                 windows) == datetime.datetime(2020, 5, 26, 18)
+    assert get_next_window_start(datetime.datetime(2020, 5, 23, 9),
+                                 windows) == datetime.datetime(2020, 5, 23, 9)
+
+    # The next job is submitted with --begin= read from the windows table
+    inputs.manage_hemco_files = False
+    inputs.submit_jobs_together = False
+    times = ["20070101", "20070201", "20070301"]
+    create_queue_files(times, inputs=inputs, run_dir=str(tmp_path),
+                       scheduler="SLURM")
+    queue_dir = tmp_path / "SLURM_queue_files"
+    queue_file = (queue_dir / "20070101.sbatch").read_text()
+    assert 'sbatch --parsable --begin="$(bash SLURM_queue_files/next_out_of_hours.sh)" SLURM_queue_files/20070201.sbatch' in queue_file
+    assert (queue_dir / "out_of_hours_windows.txt").exists()
+    begin = subprocess.check_output(
+        ["bash", "SLURM_queue_files/next_out_of_hours.sh"], cwd=str(tmp_path),
+        universal_newlines=True).strip()
+    assert datetime.datetime.strptime(begin, "%Y-%m-%dT%H:%M:%S")
+
+    # A table that has run out is written again from now by the script
+    write_out_of_hours_files(str(queue_dir), inputs, "SLURM",
+                             now=datetime.datetime(2000, 1, 1))
+    begin = subprocess.check_output(
+        ["bash", "SLURM_queue_files/next_out_of_hours.sh"], cwd=str(tmp_path),
+        universal_newlines=True).strip()
+    assert datetime.datetime.strptime(begin, "%Y-%m-%dT%H:%M:%S") >= \
+        datetime.datetime.now().replace(microsecond=0) - \
+        datetime.timedelta(minutes=1)
+    with open(str(queue_dir / "out_of_hours_windows.txt")) as table:
+        last_end = int(table.readlines()[-1].split()[1])
+    assert last_end > time.time() + 300 * 86400
+
+    # Jobs submitted together would not wait for the windows
+    inputs.out_of_hours_string = "yes"
+    inputs.submit_jobs_together = True
+    with pytest.raises(AssertionError):
+        check_inputs(inputs)
+    return
+
+
+def test_scratch_staging(tmp_path):
+    """
+    Test chunks are staged to scratch and their outputs copied back
+    """
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    (run_dir / "OutputDir").mkdir()
+    (run_dir / "input.geos").write_text("input.geos\n")
+    (run_dir / "GEOSChem.Restart.20070101_0000z.nc4").write_text("restart\n")
+    (run_dir / "FJX_spec.dat").write_text("chemistry input\n")
+    # A stand-in for GEOS-Chem that writes its output in the working directory
+    (run_dir / "geos").write_text("""#!/bin/bash
+cat FJX_spec.dat > OutputDir/GEOSChem.SpeciesConc.20070101_0000z.nc4
+echo restart > GEOSChem.Restart.20070201_0000z.nc4
+""")
+    inputs = GC_Job()
+    inputs.stage_to_scratch = True
+    inputs.submit_jobs_together = False
+    inputs.out_of_hours = False
+    create_queue_files(["20070101", "20070201"], inputs=inputs,
+                       run_dir=str(run_dir), scheduler="SLURM")
+    queue_file = (run_dir / "SLURM_queue_files" / "20070101.sbatch").read_text()
+    assert 'bash SLURM_queue_files/stage_scratch.sh in "${TMPDIR:-/tmp}" "GEOSChem.Restart.20070101_0000z.nc4"' in queue_file
+
+    scratch_root = str(tmp_path / "scratch")
+    scratch_dir = subprocess.check_output(
+        ["bash", "SLURM_queue_files/stage_scratch.sh", "in", scratch_root,
+         "GEOSChem.Restart.20070101_0000z.nc4"],
+        cwd=str(run_dir), universal_newlines=True).strip()
+    assert not os.path.islink(os.path.join(scratch_dir, "geos"))
+    assert os.path.islink(os.path.join(scratch_dir, "FJX_spec.dat"))
+    subprocess.check_call(["bash", "geos"], cwd=scratch_dir)
+    subprocess.check_call(["bash", "SLURM_queue_files/stage_scratch.sh", "out",
+                           scratch_dir], cwd=str(run_dir))
+    assert (run_dir / "OutputDir" /
+            "GEOSChem.SpeciesConc.20070101_0000z.nc4").read_text() == \
+        "chemistry input\n"
+    assert (run_dir / "GEOSChem.Restart.20070201_0000z.nc4").exists()
+    # Staged inputs are not copied back, and scratch is cleaned up
+    assert (run_dir / "input.geos").read_text() == "input.geos\n"
+    assert not os.path.exists(scratch_dir)
+    return
+
+
+def write_test_HEMCO_Config(filename):
+    """
+    Write a cut down HEMCO_Config.rc for testing
+    """
+    with open(filename, "w") as HEMCO_file:
+        HEMCO_file.write("""###############################################################################
+### BEGIN SECTION SETTINGS
+###############################################################################
+ROOT:                        /data/HEMCO
+METDIR:                      /data/GEOS_4x5/GEOS_FP
+MET:                         geosfp
+RES:                         4x5
+NC:                          nc
+### END SECTION SETTINGS ###
+
+###############################################################################
+### BEGIN SECTION EXTENSION SWITCHES
+###############################################################################
+# ExtNr ExtName                on/off  Species
+0       Base                   : on    *
+    --> CEDS                   :       true
+    --> EDGAR                  :       false
+108     MEGAN                  : off   ISOP
+### END SECTION EXTENSION SWITCHES ###
+
+###############################################################################
+### BEGIN SECTION BASE EMISSIONS
+###############################################################################
+(((CEDS
+0 CEDS_CO $ROOT/CEDS/$YYYY/CEDS_CO_$YYYY.nc CO 1950-2014/1-12/1/0 C xy kg/m2/s CO 26 1 5
+)))CEDS
+(((EDGAR
+0 EDGAR_CO $ROOT/EDGAR/EDGAR_v42_CO.nc emi_co 1970-2008/1/1/0 C xy kg/m2/s CO 1 1 2
+)))EDGAR
+### END SECTION BASE EMISSIONS ###
+
+###############################################################################
+### BEGIN SECTION EXTENSION DATA
+###############################################################################
+108 MEGAN_AEF_ISOP $ROOT/MEGAN/CLM4_PFT.nc PFT_BOREAL 2000/1/1/0 C xy 1 * - 1 1
+### END SECTION EXTENSION DATA ###
+
+###############################################################################
+### BEGIN SECTION SCALE FACTORS
+###############################################################################
+1 TOTAL_POP $ROOT/MASKS/population.nc POP 2000/1/1/0 C xy unitless 1
+26 ANTHRO 1.0 - - - xy unitless 1
+### END SECTION SCALE FACTORS ###
+
+###############################################################################
+### BEGIN SECTION NON-EMISSIONS DATA
+###############################################################################
+* PS $METDIR/$YYYY/$MM/$MET.$YYYY$MM$DD.I3.$RES.$NC PS 2011-2021/1-12/1-31/0-23 C xy 1 * - 1 1
+### END SECTION NON-EMISSIONS DATA ###
+""")
+    return
+
+
+def test_get_chunk_input_files(tmp_path):
+    """
+    Test the files each chunk reads are resolved from HEMCO_Config.rc
+    """
+    write_test_HEMCO_Config(str(tmp_path / "HEMCO_Config.rc"))
+    inputs = GC_Job()
+    inputs.manage_hemco_files = True
+    inputs.MetYear = "2016"
+    inputs.EmisYear = "-1"
+    times = ["20170101", "20170103", "20170105"]
+    chunk_files = get_chunk_input_files(times, run_dir=str(tmp_path),
+                                        inputs=inputs)
+    # Switched off data (EDGAR, MEGAN) are not read, and years outside the
+    # data's range use the nearest year
+    assert chunk_files["20170101"] == [
+        "/data/GEOS_4x5/GEOS_FP/2016/01/geosfp.20160101.I3.4x5.nc",
+        "/data/GEOS_4x5/GEOS_FP/2016/01/geosfp.20160102.I3.4x5.nc",
+        "/data/HEMCO/CEDS/2014/CEDS_CO_2014.nc",
+        "/data/HEMCO/MASKS/population.nc",
+    ]
+    assert chunk_files["20170103"][0] == \
+        "/data/GEOS_4x5/GEOS_FP/2016/01/geosfp.20160103.I3.4x5.nc"
+
+    # Prefetch jobs are made for each chunk after the 1st
+    inputs.scheduler = "SLURM"
+    inputs.prefetch_inputs = True
+    inputs.submit_jobs_together = False
+    inputs.out_of_hours = False
+    inputs.stage_to_scratch = False
+    create_queue_files(times, inputs=inputs, run_dir=str(tmp_path))
+    queue_dir = tmp_path / "SLURM_queue_files"
+    assert not (queue_dir / "20170101.prefetch.sbatch").exists()
+    assert (queue_dir / "20170103.prefetch.sbatch").exists()
+    assert (queue_dir / "20170103.prefetch.txt").read_text().splitlines() == \
+        chunk_files["20170103"]
+    # ... and submitted by the chunk before
+    queue_file = (queue_dir / "20170101.sbatch").read_text()
+    assert "sbatch SLURM_queue_files/20170103.prefetch.sbatch" in queue_file
+    queue_file = (queue_dir / "20170103.sbatch").read_text()
+    assert "prefetch" not in queue_file
+    # ... or by the task before in a job array
+    inputs.prefetch_wall_time = "00:30:00"
+    create_SLURM_array_queue_files(times, inputs=inputs, run_dir=str(tmp_path))
+    assert "--time=00:30:00" in \
+        (queue_dir / "20170103.prefetch.sbatch").read_text()
+    queue_file = (queue_dir / "array.sbatch").read_text()
+    assert 'sbatch "SLURM_queue_files/${end_time}.prefetch.sbatch"' in \
+        queue_file
+    return
+
+
+def test_check_input_files_available(tmp_path):
+    """
+    Test missing input files are found (and files found are cached)
+    """
+    data_dir = tmp_path / "data"
+    write_test_HEMCO_Config(str(tmp_path / "HEMCO_Config.rc"))
+    with open(str(tmp_path / "HEMCO_Config.rc")) as HEMCO_file:
+        HEMCO_config = HEMCO_file.read()
+    with open(str(tmp_path / "HEMCO_Config.rc"), "w") as HEMCO_file:
+        HEMCO_file.write(HEMCO_config.replace("/data", str(data_dir)))
+    inputs = GC_Job()
+    inputs.manage_hemco_files = False
+    inputs.input_index_file = str(tmp_path / "input_index.json")
+    times = ["20140101", "20140102", "20140103"]
+    chunk_files = get_chunk_input_files(times, run_dir=str(tmp_path),
+                                        inputs=inputs)
+    # Only the 2nd day of met is missing
+    for filename in chunk_files["20140101"]:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        open(filename, "w").close()
+    with pytest.raises(AssertionError) as error:
+        check_input_files_available(times, run_dir=str(tmp_path),
+                                    inputs=inputs)
+    assert "1 chunk(s), starting with the chunk from 20140102" in \
+        str(error.value)
+    assert "geosfp.20140102.I3.4x5.nc" in str(error.value)
+    with open(inputs.input_index_file) as index_file:
+        index = json.load(index_file)
+    assert sorted(index) == chunk_files["20140101"]
+
+    # Once the file is there, the check passes
+    missing_file = [i for i in chunk_files["20140102"] if i not in index][0]
+    open(missing_file, "w").close()
+    check_input_files_available(times, run_dir=str(tmp_path), inputs=inputs)
+    return
+
+
+def test_monitor_run_directories(tmp_path):
+    """
+    Test the jobs of a run are polled together until the run finishes
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20070301")
+    os.makedirs(os.path.join(run_dir, "input_files"))
+    for start_time in ("20070101", "20070201"):
+        open(os.path.join(run_dir, "input_files",
+                          start_time + ".input.geos"), "w").close()
+    with open(os.path.join(run_dir, "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("101 20070101\n")
+    # A fake sacct: the 1st call has 101 running, then it completes and the
+    # next chunk (102) is submitted and completes
+    fake_sacct = tmp_path / "fake_sacct.sh"
+    calls = tmp_path / "calls.txt"
+    fake_sacct.write_text("""
+echo "$1" >> {calls}
+if [ $(wc -l < {calls}) -eq 1 ]; then
+  echo "101|RUNNING"
+else
+  echo "102 20070201" >> {run_dir}/submitted_jobs.txt
+  echo "101|COMPLETED"
+  echo "101.batch|COMPLETED"
+  echo "102|COMPLETED"
+fi
+""".format(calls=calls, run_dir=run_dir))
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.monitor = "watch"
+    inputs.monitor_command = "bash {} {{job_ids}}".format(fake_sacct)
+    inputs.monitor_interval = 0.01
+    inputs.monitor_max_interval = 0.01
+    run_states = monitor_run_directories([run_dir], inputs=inputs,
+                                         verbose=False)
+    assert run_states[os.path.normpath(run_dir)] == [
+        ("20070101", "101", "COMPLETED"),
+        ("20070201", "102", "COMPLETED"),
+    ]
+    # Every job is polled in a single call
+    assert calls.read_text().splitlines()[-1] == "101,102"
+    return
+
+
+
+def test_monitor_failures(tmp_path):
+    """
+    Test the monitor fails loudly rather than watching forever
+    """
+    # qstat takes its job IDs separated by spaces
+    ids_file = tmp_path / "ids.txt"
+    asyncio.run(poll_job_states(["1.pbs", "2.pbs"], scheduler="PBS",
+                                command="echo {{job_ids}} > {}".format(
+                                    ids_file)))
+    assert ids_file.read_text() == "1.pbs 2.pbs\n"
+    # A failing sacct is an error, not every job UNKNOWN
+    with pytest.raises(AssertionError):
+        asyncio.run(poll_job_states(["101"], command="exit 1"))
+    # Chunks that are never submitted stop the watch
+    run_dir = make_test_run_directory(str(tmp_path / "run"))
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.monitor = "watch"
+    run_states = run_monitor({run_dir: ["20070101", "20070201"]},
+                             interval=0.01, max_interval=0.01,
+                             verbose=False)
+    assert [i[2] for i in run_states[run_dir]] == ["NOT SUBMITTED"] * 2
+    # Without a scheduler there is nothing to monitor
+    inputs.scheduler = "local"
+    with pytest.raises(AssertionError):
+        check_inputs(inputs)
+    return
+
+def write_test_GEOS_Chem_log(filename, start_date, end_date, seconds,
+                             complete=True):
+    """
+    Write a cut down GEOS-Chem log for testing
+    """
+    start = datetime.datetime.strptime(start_date, "%Y%m%d")
+    end = datetime.datetime.strptime(end_date, "%Y%m%d")
+    with open(filename, "w") as log:
+        log.write("*  G E O S - C H E M   *\n")
+        date = start
+        while date <= end:
+            log.write("---> DATE: {}  UTC: 00:00  X-HRS:      0.000\n".format(
+                date.strftime("%Y/%m/%d")))
+            log.write("Chemistry output\n" * 20)
+            date += datetime.timedelta(days=1)
+        if complete:
+            log.write("""
+  G E O S - C H E M   T I M E R S
+
+  Timer name                       DD-hh:mm:ss.SSS     Total Seconds
+-------------------------------------------------------------------------------
+  GEOS-Chem                     :  00-00:00:00.000         {:.3f}
+  Chemistry                     :  00-00:00:00.000         {:.3f}
+
+**************   E N D   O F   G E O S -- C H E M   **************
+""".format(seconds, seconds/2))
+    return
+
+
+def test_analyse_run_directories_logs(tmp_path):
+    """
+    Test the throughput of the chunks is read from their logs
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20070401")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.cpus_need = "10"
+    inputs.manage_hemco_files = False
+    inputs.history_file = str(tmp_path / "history.jsonl")
+    times = list_of_times_to_run("20070101", "20070401", inputs)
+    create_the_input_files(times, inputs=inputs, run_dir=run_dir)
+    output_dir = os.path.join(run_dir, "OutputDir")
+    os.makedirs(output_dir)
+    # 31 days in 3.1 hours, 28 days in 5.6 hours (slow), March stopped early
+    write_test_GEOS_Chem_log(os.path.join(output_dir, "20070101.geos.log"),
+                             "20070101", "20070201", 3.1*3600)
+    write_test_GEOS_Chem_log(os.path.join(output_dir, "20070201.geos.log"),
+                             "20070201", "20070301", 5.6*3600)
+    write_test_GEOS_Chem_log(os.path.join(output_dir, "20070301.geos.log"),
+                             "20070301", "20070311", 0, complete=False)
+    chunks = analyse_run_directories_logs([run_dir], inputs=inputs,
+                                          verbose=False)
+    assert [i["start_time"] for i in chunks] == ["20070101", "20070201",
+                                                 "20070301"]
+    assert chunks[0]["days_per_hour"] == pytest.approx(10)
+    assert chunks[0]["core_hours_per_year"] == pytest.approx(365.25)
+    assert [i["regression"] for i in chunks] == [False, True, False]
+    assert not chunks[2]["complete"]
+    assert chunks[2]["end_time"] == "20070311"
+    # The complete chunks are added to the history store (once)
+    assert len(load_history(inputs.history_file)) == 2
+    analyse_run_directories_logs([run_dir], inputs=inputs, verbose=False)
+    assert len(load_history(inputs.history_file)) == 2
+    return
+
+
+def test_postprocess_files(tmp_path):
+    """
+    Test each chunk submits a job to post-process its output when it completes
+    """
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    inputs = GC_Job()
+    inputs.submit_jobs_together = False
+    inputs.out_of_hours = False
+    inputs.postprocess_command = 'gzip OutputDir/*.${START_TIME}_0000z.nc4'
+    times = ["20170101", "20170201", "20170301"]
+    create_queue_files(times, inputs=inputs, run_dir=str(run_dir),
+                       scheduler="SLURM")
+    queue_dir = run_dir / "SLURM_queue_files"
+    queue_file = (queue_dir / "20170101.sbatch").read_text()
+    assert "   sbatch SLURM_queue_files/20170101.post.sbatch" in queue_file
+    # Only submitted if GEOS-Chem completed
+    assert queue_file.index("mv 20170101.geos.log OutputDir/") < \
+        queue_file.index("20170101.post.sbatch")
+    post_file = (queue_dir / "20170201.post.sbatch").read_text()
+    assert "export START_TIME=20170201" in post_file
+    assert "export END_TIME=20170301" in post_file
+    assert "export FINAL_CHUNK=yes" in post_file
+    assert post_file.rstrip().endswith(inputs.postprocess_command)
+    assert "#SBATCH --job-name=ppGEOS2017020" in post_file
+    assert "export FINAL_CHUNK=no" in \
+        (queue_dir / "20170101.post.sbatch").read_text()
+
+    # Without a command there are no post-processing jobs
+    inputs.postprocess_command = None
+    create_queue_files(times, inputs=inputs, run_dir=str(tmp_path / "run2"),
+                       scheduler="SLURM")
+    queue_file = (tmp_path / "run2" / "SLURM_queue_files" /
+                  "20170101.sbatch").read_text()
+    assert "post" not in queue_file
+    return
+
+
+def test_feeder(tmp_path):
+    """
+    Test the feeder tops up the queue to the user's limit as jobs finish
+    """
+    run_dirs = [make_test_run_directory(str(tmp_path / name))
+                for name in ("member_0", "member_1")]
+    state_file = str(tmp_path / "feeder_state.json")
+    # A stand-in sbatch that refuses more than 2 queued or running jobs
+    active = tmp_path / "active.txt"
+    active.write_text("")
+    calls = tmp_path / "calls.txt"
+    fake_sbatch = tmp_path / "fake_sbatch.sh"
+    fake_sbatch.write_text("""
+if [ $(wc -l < {active}) -ge 2 ]; then
+  echo "sbatch: error: QOSMaxSubmitJobPerUserLimit" >&2
+  exit 1
+fi
+job_id=$(( $(cat {counter} 2>/dev/null || echo 100) + 1 ))
+echo $job_id > {counter}
+echo $job_id >> {active}
+echo "$job_id $*" >> {calls}
+echo $job_id
+""".format(active=active, calls=calls, counter=tmp_path / "counter.txt"))
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script = True
+    inputs.feeder = True
+    inputs.feeder_state_file = state_file
+    inputs.feeder_max_jobs = 3
+    inputs.feeder_interval = 0
+    inputs.feeder_submit_command = "bash {} {{options}}{{queue_file}}".format(
+        fake_sbatch)
+    inputs.feeder_active_command = "cat {}".format(active)
+    for run_dir in run_dirs:
+        result = schedule_run_directory(run_dir, inputs=inputs, verbose=False,
+                                        feed=False)
+        assert result["run_script"] == state_file
+    assert not os.path.exists(os.path.join(
+        run_dirs[0], "run_geos_SLURM_queue_all_jobs.sh"))
+    # Nothing is submitted until the feeder runs
+    assert not calls.exists()
+
+    def finish_job(job_id, run_dir=None, start_time=None):
+        active.write_text("".join(i + "\n" for i in
+                                  active.read_text().split() if i != job_id))
+        if run_dir:
+            write_test_GEOS_Chem_log(
+                os.path.join(run_dir, "OutputDir", start_time + ".geos.log"),
+                start_time, start_time, 60)
+
+    # The 1st chunk of each member, then sbatch refuses the 3rd job
+    assert feed_once(state_file, inputs=inputs) == 2
+    assert feed_once(state_file, inputs=inputs) == 0
+    # member_0's 1st chunk completes, so its 2nd is submitted (no dependency)
+    os.makedirs(os.path.join(run_dirs[0], "OutputDir"))
+    finish_job("101", run_dirs[0], "20070101")
+    assert feed_once(state_file, inputs=inputs) == 1
+    # member_1's 1st chunk fails, so the rest of member_1 is never submitted
+    # and the feeder carries on from its saved state
+    finish_job("102")
+    state = run_feeder(state_file, inputs=inputs, verbose=False)
+    assert [(i["start_time"], i["job_id"], i["blocked"])
+            for i in state["chunks"]] == [
+        ("20070101", "101", False),
+        ("20070201", "103", False),
+        ("20070301", "104", False),
+        ("20070101", "102", False),
+        ("20070201", None, True),
+        ("20070301", None, True),
+    ]
+    assert calls.read_text().splitlines() == [
+        "101 SLURM_queue_files/20070101.sbatch",
+        "102 SLURM_queue_files/20070101.sbatch",
+        "103 SLURM_queue_files/20070201.sbatch",
+        "104 --dependency=afterok:103 SLURM_queue_files/20070301.sbatch",
+    ]
+    with open(os.path.join(run_dirs[0], "submitted_jobs.txt")) as jobs:
+        assert jobs.read().split("\n")[:3] == \
+            ["101 20070101", "103 20070201", "104 20070301"]
+
+    # Fed chunks would not wait for the out of hours windows
+    inputs.out_of_hours_string = "yes"
+    inputs.submit_jobs_together = False
+    with pytest.raises(AssertionError):
+        check_inputs(inputs)
+    return
+
+
+def test_feeder_prefetch(tmp_path):
+    """
+    Test the feeder submits each chunk's prefetch job with the chunk before
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"))
+    state_file = str(tmp_path / "feeder_state.json")
+    times = ["20070101", "20070201", "20070301", "20070401"]
+    # Prefetch jobs are made for each chunk after the 1st (not the last)
+    queue_dir = os.path.join(run_dir, "SLURM_queue_files")
+    os.makedirs(queue_dir)
+    for start_time in times[1:-1]:
+        open(os.path.join(queue_dir, start_time + ".prefetch.sbatch"),
+             "w").close()
+    add_feeder_chunks(state_file, run_dir, times)
+    calls = tmp_path / "calls.txt"
+    fake_sbatch = tmp_path / "fake_sbatch.sh"
+    fake_sbatch.write_text("""
+job_id=$(( $(cat {counter} 2>/dev/null || echo 100) + 1 ))
+echo $job_id > {counter}
+echo "$job_id $*" >> {calls}
+echo $job_id
+""".format(calls=calls, counter=tmp_path / "counter.txt"))
+    inputs = GC_Job()
+    inputs.prefetch_inputs = True
+    inputs.feeder_max_jobs = 10
+    inputs.feeder_submit_command = "bash {} {{options}}{{queue_file}}".format(
+        fake_sbatch)
+    inputs.feeder_active_command = "true"
+    assert feed_once(state_file, inputs=inputs) == 3
+    assert calls.read_text().splitlines() == [
+        "101 SLURM_queue_files/20070101.sbatch",
+        "102 --dependency=after:101 SLURM_queue_files/20070201.prefetch.sbatch",
+        "103 --dependency=afterok:101 SLURM_queue_files/20070201.sbatch",
+        "104 --dependency=after:103 SLURM_queue_files/20070301.prefetch.sbatch",
+        "105 --dependency=afterok:103 SLURM_queue_files/20070301.sbatch",
+    ]
+    return
+
+
+def test_feeder_follows_retried_job(tmp_path):
+    """
+    Test a chunk after one that was retried depends on the retry's job
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"))
+    previous = {"run_dir": run_dir, "start_time": "20070101",
+                "job_id": "101", "blocked": False}
+    chunk = {"run_dir": run_dir, "start_time": "20070201",
+             "dependency": None, "job_id": None, "blocked": False}
+    with open(os.path.join(run_dir, "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("101 20070101\n105 20070101\n")
+    # The original job has left the queue, but its retry is queued
+    assert get_chunk_dependency(chunk, previous, {"105"}) == (True, "105")
+    assert previous["job_id"] == "105"
+    assert not chunk["blocked"]
+    return
+
+def test_registry(tmp_path):
+    """
+    Test runs, chunks and jobs are recorded in the registry and queried
+    """
+    run_dirs = [make_test_run_directory(str(tmp_path / name))
+                for name in ("member_0", "member_1")]
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script = False
+    inputs.registry = True
+    inputs.registry_file = str(tmp_path / "registry.sqlite")
+    for run_dir in run_dirs:
+        schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    connection = connect_registry(inputs.registry_file)
+    assert get_chunk_state_counts(connection) == {"NOT SUBMITTED": 6}
+    input_hash, queue_file_hash = connection.execute(
+        "SELECT input_hash, queue_file_hash FROM chunks WHERE run_dir=? "
+        "AND start_time='20070201'",
+        (os.path.realpath(run_dirs[0]),)).fetchone()
+    with open(os.path.join(run_dirs[0], "input_files",
+                           "20070201.input.geos"), "rb") as input_file:
+        assert input_hash == hashlib.sha1(input_file.read()).hexdigest()
+    assert queue_file_hash is not None
+
+    # member_0's 1st chunk completed, member_1's timed out
+    with open(os.path.join(run_dirs[0], "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("101 20070101\n102 20070201\n")
+    with open(os.path.join(run_dirs[1], "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("201 20070101\n")
+    fake_sacct = tmp_path / "fake_sacct.sh"
+    fake_sacct.write_text("""
+echo "101|COMPLETED"
+echo "102|RUNNING"
+echo "201|TIMEOUT"
+""")
+    inputs.monitor_command = "bash {} {{job_ids}}".format(fake_sacct)
+    accounting_output = "\n".join([
+        "101|GEOS20070101|{}|02:00:00||COMPLETED|10|2020-03-02T10:00:00",
+        "101.batch|batch||02:00:00|2000M|COMPLETED|10|2020-03-02T10:00:00",
+        "201|GEOS20070101|{}|01:00:00||TIMEOUT|4|2020-02-28T10:00:00",
+    ]).format(run_dirs[0], run_dirs[1])
+    sync_registry(inputs=inputs, accounting_output=accounting_output)
+    assert get_chunk_state_counts(connection) == {
+        "COMPLETED": 1, "RUNNING": 1, "TIMEOUT": 1, "NOT SUBMITTED": 3}
+    assert get_failed_chunks(connection) == [
+        (os.path.realpath(run_dirs[1]), "20070101", "201", "TIMEOUT")]
+    # Only the job that ended in March counts for March
+    assert get_core_hours(connection, datetime.datetime(2020, 3, 1)) == 20.
+    assert connection.execute(
+        "SELECT max_rss_mb FROM jobs WHERE job_id='101'").fetchone()[0] == \
+        2000.
+    connection.close()
+    return
+
+
+def test_auto_retry(tmp_path, monkeypatch):
+    """
+    Test failed chunks are classified and resubmitted within a retry budget
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"))
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script = False
+    inputs.auto_retry = True
+    inputs.wall_time = "12:00:00"
+    schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    with open(os.path.join(run_dir, "SLURM_queue_files",
+                           "20070101.sbatch")) as queue_file:
+        queue_file = queue_file.read()
+    assert 'retry_job=$(sbatch --parsable --dependency=afternotok:"${SLURM_JOB_ID}" SLURM_queue_files/retry.sbatch 20070101 "${SLURM_JOB_ID}")' in queue_file
+    assert 'scancel "$retry_job"' in queue_file
+    assert "   exit 1\nfi" in queue_file
+
+    # Stand-ins for sacct, sbatch and scontrol
+    fake_bin = tmp_path / "bin"
+    fake_bin.mkdir()
+    calls = tmp_path / "calls.txt"
+    (fake_bin / "sacct").write_text('#!/bin/bash\necho "101|TIMEOUT"\n')
+    (fake_bin / "sbatch").write_text(
+        '#!/bin/bash\necho "sbatch $*" >> {}\necho 301\n'.format(calls))
+    (fake_bin / "scontrol").write_text(
+        '#!/bin/bash\necho "scontrol $*" >> {}\n'.format(calls))
+    for fake in fake_bin.iterdir():
+        fake.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(fake_bin, os.environ["PATH"]))
+    with open(os.path.join(run_dir, "submitted_jobs.txt"), "w") as jobs:
+        jobs.write("101 20070101\n102 20070201\n")
+    log_file = os.path.join(run_dir, "20070101.geos.log")
+    with open(log_file, "w") as log:
+        log.write("---> DATE: 2007/01/20  UTC: 00:00\n")
+        log.write("slurmstepd: error: *** JOB 101 ON node1 CANCELLED AT "
+                  "2020-01-01T00:00:00 DUE TO TIME LIMIT ***\n")
+
+    # A timeout is resubmitted with more time, and the next chunk moved on
+    monkeypatch.setenv("SLURM_SUBMIT_DIR", run_dir)
+    subprocess.check_call(["bash", "SLURM_queue_files/retry.sbatch",
+                           "20070101", "101"], cwd=run_dir)
+    assert calls.read_text().splitlines() == [
+        "sbatch --parsable --time=18:00:00 --mem-per-cpu=2Gb SLURM_queue_files/20070101.sbatch",
+        "scontrol update JobId=102 Dependency=afterok:301",
+    ]
+    assert load_submitted_jobs(run_dir)["20070101"] == "301"
+    assert os.path.isfile(os.path.join(run_dir, "queue_output",
+                                       "20070101.geos.log.101"))
+    # Out of memory gets more memory (and keeps the longer wall time)
+    result = retry_chunk("20070101", "301", run_dir=run_dir,
+                         state="OUT_OF_MEMORY")
+    assert result == {"failure": "oom", "attempts": 2, "job_id": "301"}
+    assert calls.read_text().splitlines()[2] == \
+        "sbatch --parsable --time=18:00:00 --mem-per-cpu=3072M SLURM_queue_files/20070101.sbatch"
+    # ... up to the retry budget
+    result = retry_chunk("20070101", "301", run_dir=run_dir,
+                         state="NODE_FAIL")
+    assert result == {"failure": "node_fail", "attempts": 3, "job_id": None}
+
+    # Model errors are never retried
+    with open(os.path.join(run_dir, "20070201.geos.log"), "w") as log:
+        log.write("GEOS-CHEM ERROR: Negative concentration\n")
+    result = retry_chunk("20070201", "102", run_dir=run_dir, state="FAILED")
+    assert result == {"failure": "model_error", "attempts": 1, "job_id": None}
+    assert classify_failure("FAILED", "oom-kill event(s) in step 101.0") == \
+        "oom"
+
+    # Out of hours, the chunk waits for the next window again
+    run_dir = make_test_run_directory(str(tmp_path / "out_of_hours"))
+    inputs.out_of_hours = True
+    inputs.submit_jobs_together = False
+    schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    result = retry_chunk("20070101", "401", run_dir=run_dir,
+                         state="NODE_FAIL")
+    assert result["job_id"] == "301"
+    assert calls.read_text().splitlines()[-1].startswith(
+        "sbatch --parsable --begin=20")
+    return
+
+
+def test_schedule_segments(tmp_path):
+    """
+    Test a run is split into segments with spin-up, and stitched together
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20080101")
+    with open(os.path.join(run_dir, "geos"), "w") as geos:
+        geos.write("GEOS-Chem\n")
+    with open(os.path.join(run_dir, "GEOSChem.Restart.20070101_0000z.nc4"),
+              "w") as restart:
+        restart.write("restart\n")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs.segments = 3
+    inputs.segment_spinup = "1month"
+    results = schedule_segments(run_dir, inputs=inputs)
+    assert [i["error"] for i in results] == [None, None, None]
+    segments_dir = os.path.join(run_dir, "segments")
+    assert sorted(os.listdir(segments_dir)) == [
+        "20070101", "20070501", "20070901", "segments.txt"]
+    segment_dir = os.path.join(segments_dir, "20070501")
+    assert get_start_and_end_dates(segment_dir, verbose=False) == \
+        ("20070401", "20070901")
+    # The spin-up starts from the run's initial restart
+    restart_file = os.path.join(segment_dir,
+                                "GEOSChem.Restart.20070401_0000z.nc4")
+    assert os.path.realpath(restart_file) == os.path.realpath(
+        os.path.join(run_dir, "GEOSChem.Restart.20070101_0000z.nc4"))
+    assert os.path.islink(os.path.join(segment_dir, "geos"))
+    assert not os.path.islink(os.path.join(segment_dir, "OutputDir"))
+    assert sorted(os.listdir(os.path.join(segment_dir, "input_files")))[0] \
+        == "20070401.input.geos"
+
+    # Only the output after each segment's spin-up is stitched together
+    for segment, months in (("20070101", range(1, 5)),
+                            ("20070501", range(4, 9)),
+                            ("20070901", range(8, 13))):
+        for month in months:
+            output_file = os.path.join(
+                segments_dir, segment, "OutputDir",
+                "GEOSChem.SpeciesConc.2007{:02d}01_0000z.nc4".format(month))
+            with open(output_file, "w") as output:
+                output.write(segment)
+    linked = stitch_segments(run_dir)
+    assert len(linked) == 12
+    output_file = os.path.join(run_dir, "OutputDir",
+                               "GEOSChem.SpeciesConc.20070801_0000z.nc4")
+    with open(output_file) as output:
+        assert output.read() == "20070501"
+    return
+
+
+def test_schedule_campaign_dag(tmp_path, monkeypatch):
+    """
+    Test a spin-up and its branches are submitted as one graph
+    """
+    monkeypatch.chdir(tmp_path)
+    spinup_dir = make_test_run_directory(str(tmp_path / "spinup"),
+                                         start_date="20060101",
+                                         end_date="20070101")
+    for name in ("branch_a", "branch_b"):
+        make_test_run_directory(str(tmp_path / name),
+                                start_date="20070101", end_date="20070301")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs.spinup_dir = spinup_dir
+    inputs.batch_run_dirs = [str(tmp_path / "branch_*")]
+    inputs = check_inputs(inputs)
+    assert inputs.submit_jobs_together and not inputs.use_job_array
+    results = schedule_campaign_dag(spinup_dir, inputs.batch_run_dirs,
+                                    inputs=inputs)
+    assert [i["error"] for i in results] == [None, None, None]
+    assert [i["n_chunks"] for i in results] == [12, 2, 2]
+
+    # Each branch starts from the spin-up's final restart
+    restart_file = os.path.join(str(tmp_path / "branch_a"),
+                                "GEOSChem.Restart.20070101_0000z.nc4")
+    assert os.path.islink(restart_file)
+    assert os.readlink(restart_file) == os.path.join(
+        os.path.realpath(spinup_dir), "GEOSChem.Restart.20070101_0000z.nc4")
+
+    with open("run_geos_dag.sh") as run_script:
+        lines = [i for i in run_script if i.startswith("job_")]
+    assert len(lines) == 16
+    # The spin-up's last chunk is n11, and each branch's 1st chunk needs it
+    assert 'afterok:"$job_n11" SLURM_queue_files/20070101' in lines[12]
+    assert 'afterok:"$job_n11" SLURM_queue_files/20070101' in lines[13]
+    assert 'afterok:"$job_n12" SLURM_queue_files/20070201' in lines[14]
+    assert "--dependency" not in lines[0]
+
+    # Prefetch jobs start with the chunk before in the same run directory
+    branch_dir = os.path.realpath(str(tmp_path / "branch_a"))
+    open(os.path.join(branch_dir, "SLURM_queue_files",
+                      "20070201.prefetch.sbatch"), "w").close()
+    dag = {"nodes": {}, "edges": []}
+    add_chain(dag, branch_dir, ["20070101", "20070201", "20070301"])
+    write_dag_run_script(dag, filename="prefetch_dag.sh", prefetch=True)
+    with open("prefetch_dag.sh") as run_script:
+        lines = [i for i in run_script if i.startswith("prefetch_")]
+    assert lines == [
+        'prefetch_n1=$(cd "{}" && sbatch --parsable --dependency=after:'
+        '"$job_n0" SLURM_queue_files/20070201.prefetch.sbatch)\n'.format(
+            branch_dir)]
+
+    # A graph with a cycle can not be submitted
+    dag = {"nodes": {"n0": {}, "n1": {}}, "edges": [("n0", "n1"),
+                                                    ("n1", "n0")]}
+    with pytest.raises(AssertionError):
+        get_topological_order(dag)
+    return
+
+
+
+def test_resume_campaign_dag(tmp_path, monkeypatch):
+    """
+    Test a campaign is resumed once its spin-up has finished or is queued
+    """
+    monkeypatch.chdir(tmp_path)
+    spinup_dir = make_test_run_directory(str(tmp_path / "spinup"),
+                                         start_date="20060101",
+                                         end_date="20070101")
+    branch_dirs = [make_test_run_directory(str(tmp_path / name),
+                                           start_date="20070101",
+                                           end_date="20070301")
+                   for name in ("branch_a", "branch_b")]
+    restart_file = "GEOSChem.Restart.{}_0000z.nc4"
+    # The spin-up has finished, and branch_b has run its 1st chunk
+    for month in range(2, 14):
+        date = "{}{:02d}01".format(2006 + month // 13, (month - 1) % 12 + 1)
+        open(os.path.join(spinup_dir, restart_file.format(date)), "w").close()
+    open(os.path.join(branch_dirs[1], restart_file.format("20070201")),
+         "w").close()
+    monkeypatch.setitem(QUEUE_STATUS_COMMANDS, "SLURM", "true")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs.resume = "yes"
+    inputs.spinup_dir = spinup_dir
+    inputs.batch_run_dirs = [str(tmp_path / "branch_*")]
+    inputs = check_inputs(inputs)
+    results = schedule_campaign_dag(spinup_dir, inputs.batch_run_dirs,
+                                    inputs=inputs)
+    assert [i["n_chunks"] for i in results] == [0, 2, 1]
+    # Only the branch that has not started is linked to the final restart
+    assert os.path.islink(os.path.join(branch_dirs[0],
+                                       restart_file.format("20070101")))
+    assert not os.path.lexists(os.path.join(branch_dirs[1],
+                                            restart_file.format("20070101")))
+    with open("run_geos_dag.sh") as run_script:
+        lines = [i for i in run_script if i.startswith("job_")]
+    # Each branch's 1st chunk (n0 and n2) is submitted first
+    assert len(lines) == 3
+    assert "--dependency" not in lines[0] + lines[1]
+
+    # The spin-up's last chunk is still queued, so the branches wait for it
+    os.remove(os.path.join(spinup_dir, restart_file.format("20070101")))
+    os.remove(os.path.join(branch_dirs[1], restart_file.format("20070201")))
+    monkeypatch.setitem(QUEUE_STATUS_COMMANDS, "SLURM", "echo '999|PENDING|{}'"
+                        .format(os.path.join(spinup_dir, "SLURM_queue_files",
+                                             "20061201.sbatch")))
+    results = schedule_campaign_dag(spinup_dir, inputs.batch_run_dirs,
+                                    inputs=inputs)
+    assert [i["n_chunks"] for i in results] == [0, 2, 2]
+    with open("run_geos_dag.sh") as run_script:
+        lines = [i for i in run_script if i.startswith("job_")]
+    assert "--dependency=afterok:999 SLURM_queue_files/20070101" in lines[0]
+    assert "--dependency=afterok:999 SLURM_queue_files/20070101" in lines[1]
+
+    # Branches must start where the spin-up ends
+    make_test_run_directory(str(tmp_path / "branch_c"),
+                            start_date="20070201", end_date="20070301")
+    with pytest.raises(AssertionError):
+        schedule_campaign_dag(spinup_dir, inputs.batch_run_dirs,
+                              inputs=inputs)
+    return
+
+def test_clone_run_directories(tmp_path):
+    """
+    Test a run directory is cloned into an ensemble with per member edits
+    """
+    template_dir = make_test_run_directory(str(tmp_path / "template"))
+    write_test_HEMCO_Config(os.path.join(template_dir, "HEMCO_Config.rc"))
+    restart_file = os.path.join(template_dir,
+                                "GEOSChem.Restart.20070101_0000z.nc4")
+    with open(restart_file, "wb") as restart:
+        restart.write(b"\0" * (2 << 20))
+    os.symlink("/data/ExtData", os.path.join(template_dir, "ExtData"))
+    os.makedirs(os.path.join(template_dir, "OutputDir"))
+    with open(os.path.join(template_dir, "OutputDir", "old.nc4"), "w") as old:
+        old.write("output\n")
+    os.makedirs(os.path.join(template_dir, "input_files"))
+    members_file = str(tmp_path / "members.json")
+    with open(members_file, "w") as members:
+        json.dump({
+            "high": {
+                "input.geos": {"end_date": "20070301",
+                               "Read and save CSPEC_FULL": "T"},
+                "HEMCO_Config.rc": {"--> CEDS": "false", "ROOT": "/scratch"},
+                "settings": {"wall_time": "12:00:00"},
+            },
+            "low": {},
+        }, members)
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs.clone = members_file
+    inputs.clone_dir = str(tmp_path / "ensemble")
+    inputs = check_inputs(inputs)
+    results = clone_run_directories(template_dir, inputs.clone, inputs=inputs)
+    assert [i["error"] for i in results] == [None, None]
+    assert [i["n_chunks"] for i in results] == [2, 3]
+
+    member_dir = str(tmp_path / "ensemble" / "high")
+    # The restart is shared, not copied
+    member_restart_file = os.path.join(member_dir,
+                                       "GEOSChem.Restart.20070101_0000z.nc4")
+    assert os.path.getsize(member_restart_file) == 2 << 20
+    assert not os.path.islink(member_restart_file)
+    assert os.readlink(os.path.join(member_dir, "ExtData")) == "/data/ExtData"
+    assert os.listdir(os.path.join(member_dir, "OutputDir")) == []
+    input_geos = InputGeos.from_file(os.path.join(member_dir, "input.geos"))
+    assert input_geos.end_date == "20070301"
+    assert input_geos.get_setting("Read and save CSPEC_FULL") == "T"
+    with open(os.path.join(member_dir, "HEMCO_Config.rc")) as HEMCO_file:
+        HEMCO_lines = HEMCO_file.readlines()
+    assert "ROOT:                        /scratch\n" in HEMCO_lines
+    assert "    --> CEDS                   :       false\n" in HEMCO_lines
+    # The template is left as it was
+    assert InputGeos.from_file(os.path.join(
+        template_dir, "input.geos")).end_date == "20070401"
+    queue_file = os.path.join(member_dir, "SLURM_queue_files",
+                              "20070101.sbatch")
+    with open(queue_file) as queue:
+        assert "#SBATCH --time=12:00:00\n" in queue.readlines()
+    return
+
+
+def test_clone_scheduled_template(tmp_path):
+    """
+    Test a template that has been scheduled (its input.geos a link to a
+    chunk's) is cloned from its original files, without its later restarts
+    """
+    template_dir = make_test_run_directory(str(tmp_path / "template"))
+    write_test_HEMCO_Config(os.path.join(template_dir, "HEMCO_Config.rc"))
+    for date in ("20070101", "20070201"):
+        restart_file = os.path.join(
+            template_dir, "GEOSChem.Restart.{}_0000z.nc4".format(date))
+        with open(restart_file, "wb") as restart:
+            restart.write(b"\0" * (2 << 20))
+    os.makedirs(os.path.join(template_dir, "input_files"))
+    for filename in ("input.geos", "HEMCO_Config.rc"):
+        location = os.path.join(template_dir, filename)
+        shutil.copy2(location, location + ".orig")
+        chunk_file = os.path.join("input_files", "20070201." + filename)
+        shutil.copy2(location, os.path.join(template_dir, chunk_file))
+        os.remove(location)
+        os.symlink(chunk_file, location)
+    member_dir = str(tmp_path / "member")
+    clone_run_directory(
+        template_dir, member_dir,
+        restart_file_template="GEOSChem.Restart.{date}_0000z.nc4",
+        start_time="20070101")
+    for filename in ("input.geos", "HEMCO_Config.rc"):
+        location = os.path.join(member_dir, filename)
+        assert os.path.isfile(location) and not os.path.islink(location)
+        with open(location) as member_file:
+            with open(os.path.join(template_dir,
+                                   filename + ".orig")) as original:
+                assert member_file.read() == original.read()
+    # Only the member's initial restart is shared
+    assert os.path.isfile(os.path.join(member_dir,
+                                       "GEOSChem.Restart.20070101_0000z.nc4"))
+    assert not os.path.lexists(os.path.join(
+        member_dir, "GEOSChem.Restart.20070201_0000z.nc4"))
+    return
+
+
+def test_advise_placement(tmp_path):
+    """
+    Test the partition with the earliest expected end is picked from
+    captured sinfo/squeue output
+    """
+    with open(str(tmp_path / "sinfo.txt"), "w") as sinfo:
+        sinfo.write("nodes|2-00:00:00|up|800/0/0/800\n"
+                    "week|7-00:00:00|up|700/100/0/800\n"
+                    "test|30:00|up|0/40/0/40\n"
+                    "himem|2-00:00:00|down|0/80/0/80\n")
+    with open(str(tmp_path / "squeue.txt"), "w") as squeue:
+        squeue.write(
+            "nodes|PENDING|2021-01-12T14:00:00|N/A|40\n"
+            "nodes|RUNNING|2021-01-11T10:00:00|2021-01-12T12:00:00|40\n"
+            "week|PENDING|2021-01-12T18:00:00|N/A|200\n"
+            "week|RUNNING|2021-01-10T00:00:00|2021-01-13T00:00:00|200\n")
+    cluster_state = load_cluster_state("SLURM", capture_dir=str(tmp_path))
+    now = datetime.datetime(2021, 1, 12, 10)
+    # A short job backfills before the pending job on week
+    advice = advise_placement("06:00:00", 20, cluster_state, now=now)
+    assert [i["partition"] for i in advice] == ["week", "nodes"]
+    assert advice[0]["start"] == now
+    # A long one does not, so is sooner behind the smaller queue on nodes
+    advice = advise_placement("12:00:00", 20, cluster_state, now=now)
+    assert [i["partition"] for i in advice] == ["nodes", "week"]
+    assert advice[0]["start"] == datetime.datetime(2021, 1, 12, 14)
+    assert advice[1]["start"] == datetime.datetime(2021, 1, 13)
+    with pytest.raises(AssertionError):
+        advise_placement("10-00:00:00", 20, cluster_state, now=now)
+
+    # PBS queues are read from qstat -Qf
+    with open(str(tmp_path / "qstat_Qf.txt"), "w") as qstat:
+        qstat.write("Queue: run\n"
+                    "    state_count = Transit:0 Queued:10 Held:0 "
+                    "Waiting:0 Running:5 Exiting:0 Begun:0\n"
+                    "    resources_max.walltime = 48:00:00\n"
+                    "    enabled = True\n    started = True\n\n"
+                    "Queue: large\n"
+                    "    state_count = Transit:0 Queued:0 Held:0 "
+                    "Waiting:0 Running:2 Exiting:0 Begun:0\n"
+                    "    resources_max.walltime = 24:00:00\n"
+                    "    enabled = True\n    started = True\n")
+    cluster_state = load_cluster_state("PBS", capture_dir=str(tmp_path))
+    advice = advise_placement("12:00:00", 20, cluster_state, now=now)
+    assert [i["partition"] for i in advice] == ["large", "run"]
+    assert advice[1]["start"] == now + datetime.timedelta(hours=24)
+
+    # Each chunk's queue file is given the partition picked
+    with open(str(tmp_path / "squeue.txt"), "w") as squeue:
+        squeue.write("nodes|PENDING|2099-01-01T00:00:00|N/A|40\n")
+    run_dir = make_test_run_directory(str(tmp_path / "run"))
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.step = "month"
+    inputs.run_script_string = "no"
+    inputs.wall_time = "06:00:00"
+    inputs.cpus_need = 20
+    inputs.queue_name = "bob"
+    inputs.auto_placement = "yes"
+    inputs.placement_capture_dir = str(tmp_path)
+    inputs = check_inputs(inputs)
+    schedule_run_directory(run_dir, inputs=inputs, verbose=False)
+    with open(os.path.join(run_dir, "SLURM_queue_files",
+                           "20070101.sbatch")) as queue:
+        assert "#SBATCH --partition=week\n" in queue.readlines()
+    return
+
+
+def test_simulate_chunking_strategies(tmp_path):
+    """
+    Test steps are compared by simulating the run with past queue waits
+    """
+    run_dir = make_test_run_directory(str(tmp_path / "run"),
+                                      start_date="20070101",
+                                      end_date="20080101")
+    inputs = GC_Job()
+    inputs.scheduler = "SLURM"
+    inputs.wall_time = "48:00:00"
+    inputs.cpus_need = 1
+    inputs.simulated_days_per_hour = 2
+    inputs.simulation_failure_rate = 0
+    inputs.simulation_runs = 5
+    # Every past job waited 12 hours in the queue
+    accounting_output = "2021-01-01T00:00:00|2021-01-01T12:00:00\n" * 3 + \
+        "2021-01-02T00:00:00|Unknown\n"
+    summaries = simulate_chunking_strategies(
+        run_dir, inputs=inputs, steps="month,3month,6month",
+        accounting_output=accounting_output)
+    assert summaries["month"]["chunks"] == 12
+    # A month of chunks queue 12 times, but 3 months only 4 times
+    assert summaries["month"]["mean_days"] == pytest.approx(
+        (12*12 + 365/2. + 12*300/3600.) / 24)
+    assert summaries["3month"]["mean_days"] == pytest.approx(
+        (4*12 + 365/2. + 4*300/3600.) / 24)
+    assert summaries["3month"]["core_hours"] == pytest.approx(
+        365/2. + 4*300/3600.)
+    # 6 months does not fit in the wall time
+    assert not summaries["6month"]["fit"]
+
+    # Failures cost core hours and time, more so for longer chunks
+    inputs.simulation_failure_rate = 0.05
+    inputs.simulation_queue_wait = 0
+    summaries = simulate_chunking_strategies(
+        run_dir, inputs=inputs, steps=["month", "3month"], verbose=False)
+    assert summaries["3month"]["failures"] > summaries["month"]["failures"]
+    assert summaries["month"]["core_hours"] > 365/2. + 12*300/3600.
+    return
+
+
+def test_benchmarks(tmp_path):
+    """
+    Test the benchmarks run on a small run and regressions are found
+    """
+    benchmarks = run_benchmarks(chunks=[12], repeat=1,
+                                tmpfs_dir=str(tmp_path / "no_tmpfs"),
+                                disk_dir=str(tmp_path), verbose=False)
+    results = benchmarks["results"]
+    assert [i["benchmark"] for i in results[:4]] == [
+        "list_of_times_to_run", "create_new_input_file",
+        "update_output_line", "create_new_HEMCO_input_file"]
+    # File generation is timed with and without HEMCO files (on disk only)
+    assert [(i["filesystem"], i["manage_hemco_files"]) for i in
+            results[4:]] == [("disk", False), ("disk", True)]
+    # The synthetic run directories are removed
+    assert os.listdir(str(tmp_path)) == []
+    json.dumps(benchmarks)
+
+    baseline = [dict(i) for i in results]
+    baseline[0]["seconds_min"] = results[0]["seconds_min"] / 2.
+    regressions = compare_results(results, baseline)
+    assert [i["benchmark"] for i in regressions] == ["list_of_times_to_run"]
+    assert regressions[0]["slow_down"] == pytest.approx(1.)
     return
@@ -10,8 +10,10 @@ import sys
 import shutil
 import datetime
 import calendar
+import hashlib
 from dateutil.relativedelta import relativedelta
 import pytest
+from input_geos import InputGeos
 
 
 def clear_screen():
@@ -22,33 +24,73 @@ def clear_screen():
     return
 
 
-def get_start_and_end_dates():
+def get_start_and_end_dates(run_dir='.', verbose=True):
     """
     Get the start date and end date from input.geos
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory containing input.geos
+    verbose (bool): Print the start and end dates to the screen
+
+    Returns
+    -------
+    (tuple)
     """
-    input_geos = open('input.geos', 'r')
-    for line in input_geos:
-        if line.startswith("Start YYYYMMDD"):
-            start_date = line[26:34]
-        if line.startswith("End   YYYYMMDD"):
-            end_date = line[26:34]
+    input_geos = InputGeos.from_file(get_run_input_file(run_dir,
+                                                        'input.geos'))
+    start_date = input_geos.start_date
+    end_date = input_geos.end_date
 
     # Error checking though print...
-    print("Start time = {start_date}".format(start_date=start_date))
-    print("End time = {end_date}".format(end_date=end_date))
-    input_geos.close()
+    if verbose:
+        print("Start time = {start_date}".format(start_date=start_date))
+        print("End time = {end_date}".format(end_date=end_date))
 
     return start_date, end_date
 
 
-def backup_the_input_files(inputs=None):
+def get_run_input_file(run_dir='.', filename='input.geos'):
+    """
+    Get the location of a run directory's own input file (e.g. input.geos)
+
+    Parameters
+    -------
+    run_dir (str): GEOS-Chem run directory
+    filename (str): Name of the input file ("input.geos" or "HEMCO_Config.rc")
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Once a chunk has started, the queue script replaces the file with a
+     link to that chunk's file (in input_files/), which only has the chunk's
+     dates. The backup of the original (<file>.orig, see
+     backup_the_input_files) is used instead
+    """
+    location = os.path.join(run_dir, filename)
+    original = '{}.orig'.format(location)
+    if os.path.islink(location) and os.path.isfile(original):
+        return original
+    return location
+
+
+def backup_the_input_files(inputs=None, run_dir='.'):
     """
     Save a copy of the original input file
+
+    Parameters
+    -------
+    inputs (GC_Job class): Class containing various inputs like a dictionary
+    run_dir (str): GEOS-Chem run directory containing the input files
     """
     input_files = ["input.geos"]
     if inputs.manage_hemco_files:
         input_files += ['HEMCO_Config.rc']
     for input_file in input_files:
+        input_file = os.path.join(run_dir, input_file)
         backup_input_file = '{}.orig'.format(input_file)
         if not os.path.isfile(backup_input_file):
             shutil.copyfile(input_file, backup_input_file)
@@ -98,3 +140,199 @@ def is_current_year_a_leap_year(year):
     """
     import calender
     return calendar.isleap(year)
+
+
+def write_content_addressed_file(contents, store_dir, suffix=''):
+    """
+    Write a file to a store, named by the hash of its contents
+
+    Parameters
+    -------
+    contents (str): Contents of the file
+    store_dir (str): Directory of the store
+    suffix (str): Suffix for the stored file name (e.g. ".HEMCO_Config.rc")
+
+    Returns
+    -------
+    (str)
+
+    Notes
+    -------
+     - Returned string is the location of the file in the store
+     - Files with the same contents are only written once
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    digest = hashlib.sha1(contents.encode()).hexdigest()
+    store_file_location = os.path.join(store_dir, digest + suffix)
+    if not os.path.isfile(store_file_location):
+        # Write to a temporary file first so a partial file is never stored
+        temporary_file_location = '{}.{}.tmp'.format(store_file_location,
+                                                     os.getpid())
+        with open(temporary_file_location, 'w') as store_file:
+            store_file.write(contents)
+        os.replace(temporary_file_location, store_file_location)
+    return store_file_location
+
+
+def link_file(target, link_location):
+    """
+    Create (or replace) a relative symbolic link to a file
+
+    Parameters
+    -------
+    target (str): File to link to
+    link_location (str): Location of the link
+
+    Returns
+    -------
+    (None)
+    """
+    relative_target = os.path.relpath(target, os.path.dirname(link_location))
+    if os.path.lexists(link_location):
+        os.remove(link_location)
+    os.symlink(relative_target, link_location)
+    return
+
+
+# Last line of the log of a GEOS-Chem run that completed
+GEOS_CHEM_END_BANNER = "**************   E N D   O F   G E O S -- C H E M   **************"
+
+
+def get_last_line(filename, block_size=4096):
+    """
+    Get the last (non-empty) line of a file without reading the whole file
+
+    Parameters
+    -------
+    filename (str): Location of the file
+    block_size (int): Number of bytes read from the end of the file at a time
+
+    Returns
+    -------
+    (str)
+    """
+    with open(filename, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        tail = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            tail = file.read(read_size) + tail
+            lines = tail.rstrip().splitlines()
+            if len(lines) > 1 or (position == 0):
+                break
+    lines = tail.rstrip().splitlines()
+    if not lines:
+        return ''
+    return lines[-1].decode(errors='replace')
+
+
+def is_GEOS_Chem_log_complete(log_file):
+    """
+    Check if a GEOS-Chem log file ends with the end of simulation banner
+
+    Parameters
+    -------
+    log_file (str): Location of the log file
+
+    Returns
+    -------
+    (bool)
+    """
+    if not os.path.isfile(log_file):
+        return False
+    return get_last_line(log_file).strip() == GEOS_CHEM_END_BANNER
+
+
+def wall_time_to_seconds(wall_time):
+    """
+    Convert a wall time ("[DD-]HH:MM:SS", "MM:SS" or "MM") to seconds
+
+    Parameters
+    -------
+    wall_time (str): Wall time as used by SLURM/PBS (e.g. "1-02:00:00")
+
+    Returns
+    -------
+    (float)
+    """
+    days = 0
+    wall_time = wall_time.strip()
+    if '-' in wall_time:
+        days, wall_time = wall_time.split('-', 1)
+    parts = [float(i) for i in wall_time.split(':')]
+    if len(parts) == 1:
+        # A single number is minutes
+        parts = [0, parts[0], 0]
+    while len(parts) < 3:
+        parts = [0] + parts
+    hours, minutes, seconds = parts
+    return ((int(days)*24 + hours)*60 + minutes)*60 + seconds
+
+
+def seconds_to_wall_time(seconds):
+    """
+    Convert seconds to a wall time ("HH:MM:SS"), rounding up to the minute
+
+    Parameters
+    -------
+    seconds (float): Number of seconds
+
+    Returns
+    -------
+    (str)
+    """
+    minutes = int(-(-seconds // 60))
+    return "{:02d}:{:02d}:00".format(minutes // 60, minutes % 60)
+
+
+def memory_to_megabytes(memory):
+    """
+    Convert a memory amount (e.g. "2Gb", "200Mb", "1.5G", "2000K") to Mb
+
+    Parameters
+    -------
+    memory (str): Memory amount, with an optional unit (bytes if not given)
+
+    Returns
+    -------
+    (float)
+    """
+    memory = str(memory).strip().lower().rstrip('b')
+    units = {'k': 1/1024, 'm': 1, 'g': 1024, 't': 1024*1024}
+    if memory and memory[-1] in units:
+        return float(memory[:-1]) * units[memory[-1]]
+    return float(memory) / (1024*1024)
+
+
+def parse_qstat_jobs(qstat_output):
+    """
+    Parse the output of PBS "qstat -f" (or "qstat -x -f") into dictionaries
+
+    Parameters
+    -------
+    qstat_output (str): Output of qstat -f
+
+    Returns
+    -------
+    (list)
+
+    Notes
+    -------
+     - Each dictionary has the job's "id" and its "key = value" attributes
+    """
+    jobs = []
+    job = {}
+    for line in qstat_output.splitlines() + ['']:
+        if line.startswith('Job Id:'):
+            job = {'id': line.split(':', 1)[1].strip()}
+        elif ' = ' in line and job:
+            key, value = line.strip().split(' = ', 1)
+            job[key] = value
+        elif not line.strip() and job:
+            jobs.append(job)
+            job = {}
+    return jobs